@@ -0,0 +1,53 @@
+"""Micro-benchmark of the per-event CPU cost of producing an app JWT.
+
+Compares signing a fresh JWT from the PEM (the behavior before JWTs and
+parsed keys were memoized) with the memoized ``auth.get_jwt_token``.
+
+Run from the repository root with ``python benchmarks/bench_auth.py``.
+"""
+import argparse
+import time
+
+import jwcrypto.jwk
+import python_jwt
+
+from labelbot import auth
+
+APP_ID = 12334
+
+
+def _uncached_jwt(private_pem: bytes, app_id: int) -> str:
+    private_key = jwcrypto.jwk.JWK.from_pem(private_pem)
+    return python_jwt.generate_jwt(
+        {"iss": app_id}, private_key, "RS256", auth.JWT_LIFETIME
+    )
+
+
+def _cpu_time_per_call(func, iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    key = jwcrypto.jwk.JWK.generate(kty="RSA", size=2048)
+    pem = key.export_to_pem(private_key=True, password=None)
+
+    uncached = _cpu_time_per_call(lambda: _uncached_jwt(pem, APP_ID), args.iterations)
+    auth.JWT_CACHE.invalidate()
+    cached = _cpu_time_per_call(
+        lambda: auth.get_jwt_token(pem, APP_ID), args.iterations
+    )
+
+    print(f"uncached: {uncached * 1e6:10.1f} us CPU/event")
+    print(f"cached:   {cached * 1e6:10.1f} us CPU/event")
+    print(f"saved:    {(uncached - cached) * 1e6:10.1f} us CPU/event")
+
+
+if __name__ == "__main__":
+    main()
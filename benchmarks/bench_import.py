@@ -0,0 +1,137 @@
+"""Benchmark of import time and cold start time.
+
+Measures, each in fresh interpreter processes:
+
+* the cumulative import time of labelbot and of its heavy dependencies, as
+  reported by ``python -X importtime``;
+* cold starts, i.e. importing ``labelbot.bot`` and handling a first webhook,
+  for a webhook that is rejected, one that is ignored, and one that labels
+  an issue against a local fake GitHub API. Each run also reports which
+  heavy dependencies ended up imported.
+
+Run from the repository root with ``python benchmarks/bench_import.py``.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_github  # noqa: E402
+import harness  # noqa: E402
+import payloads  # noqa: E402
+
+MODULES = ["labelbot.bot", "requests", "boto3", "jwcrypto.jwk", "python_jwt"]
+HEAVY_MODULES = ["requests", "boto3", "botocore", "jwcrypto", "python_jwt"]
+
+_COLD_START = """
+import json, os, sys, time
+start = time.perf_counter()
+from labelbot import bot, github_api
+imported = time.perf_counter()
+github_api.BASE_URL = os.environ["GITHUB_URL"]
+response = bot.lambda_handler(json.loads(sys.stdin.read()), None)
+handled = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "total_ms": (handled - start) * 1000,
+    "status": response.get("statusCode", response.get("statuscode")),
+    "heavy_modules": [m for m in %r if m in sys.modules],
+}))
+""" % (
+    HEAVY_MODULES,
+)
+
+
+def import_time(module: str) -> float:
+    """Return the cumulative import time of a module in milliseconds, in a
+    fresh interpreter.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    # lines are "import time: self [us] | cumulative | imported package"
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            return int(cumulative) / 1000
+    raise RuntimeError(f"no import time reported for {module}")
+
+
+def cold_start(event: dict, github_url: str) -> dict:
+    """Import labelbot and handle a single webhook in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-c", _COLD_START],
+        input=json.dumps(event),
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        env={**os.environ, "GITHUB_URL": github_url},
+        check=True,
+    )
+    return json.loads(result.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--runs", type=int, default=5)
+    parser.add_argument("-o", "--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    results = {"import_ms": {}, "cold_start": {}}
+    for module in MODULES:
+        try:
+            timings = [import_time(module) for _ in range(args.runs)]
+        except subprocess.CalledProcessError:
+            print(f"{module:16} not installed")
+            continue
+        results["import_ms"][module] = statistics.median(timings)
+        print(f"{module:16} {results['import_ms'][module]:8.1f} ms import")
+
+    with fake_github.FakeGitHub() as github:
+        harness.configure_environment(github.url)
+        events = {
+            "rejected": {
+                "headers": {"X-Hub-Signature": "sha1=0"},
+                "body": payloads.issue_event(1, ":label:`bug`"),
+            },
+            "ignored": payloads.signed_event(
+                payloads.issue_event(1, ":label:`bug`", action="closed"),
+                harness.SECRET_KEY,
+            ),
+            "labeled": payloads.signed_event(
+                payloads.issue_event(1, ":label:`bug`"), harness.SECRET_KEY
+            ),
+        }
+        for name, event in events.items():
+            runs = [cold_start(event, github.url) for _ in range(args.runs)]
+            results["cold_start"][name] = {
+                "import_ms": statistics.median(run["import_ms"] for run in runs),
+                "total_ms": statistics.median(run["total_ms"] for run in runs),
+                "status": runs[0]["status"],
+                "heavy_modules": runs[0]["heavy_modules"],
+            }
+            result = results["cold_start"][name]
+            print(
+                f"cold start, {name:9} {result['total_ms']:8.1f} ms "
+                f"(import {result['import_ms']:6.1f} ms, "
+                f"status {result['status']}, "
+                f"imported {', '.join(result['heavy_modules']) or 'no heavy modules'})"
+            )
+
+    if args.output:
+        results["python"] = platform.python_version()
+        with open(args.output, mode="w", encoding="utf8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
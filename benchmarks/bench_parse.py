@@ -0,0 +1,66 @@
+"""Micro-benchmark of extracting label markup from issue bodies.
+
+Compares the original uncompiled, lazy ``:label:`(.*?)``` regex with
+``parse.scan_wanted_labels`` on realistic bodies and on adversarial bodies
+of the maximum size GitHub allows.
+
+Run from the repository root with ``python benchmarks/bench_parse.py``.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import payloads  # noqa: E402
+
+from labelbot import parse  # noqa: E402
+
+
+def _original_parse_wanted_labels(text):
+    return re.findall(":label:`(.*?)`", text, re.MULTILINE)
+
+
+def _bodies():
+    size = parse.MAX_SCAN_LENGTH
+    return {
+        "small": payloads.markdown_body(500, ["bug", "help"]),
+        "large": payloads.markdown_body(size, ["bug", "help"]),
+        "backticks": "`" * size,
+        "open tokens": (":label:`" * size)[:size],
+        "unclosed token": ":label:`" + "x" * (size - 8),
+        "many tokens": (":label:`bug` " * size)[:size],
+    }
+
+
+def _time_per_call(func, text, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(text)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    scanners = [
+        ("original", _original_parse_wanted_labels),
+        ("scan", parse.scan_wanted_labels),
+        ("scan bytes", lambda text: parse.scan_wanted_labels(text.encode("utf8"))),
+        (
+            "scan no code",
+            lambda text: parse.scan_wanted_labels(text, skip_code_blocks=True),
+        ),
+    ]
+    print(f"{'body':<16}" + "".join(f"{name:>14}" for name, _ in scanners))
+    for body_name, text in _bodies().items():
+        timings = [_time_per_call(func, text, args.iterations) for _, func in scanners]
+        print(f"{body_name:<16}" + "".join(f"{t * 1e6:11.1f} us" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Micro-benchmark of extracting the fields of issue webhooks.
+
+Compares decoding the whole payload with ``json.loads``, as the handler
+originally did, with :py:class:`labelbot.payload.WebhookPayload` using the
+standard library and using ``orjson`` (if installed). For each payload it
+reports the time and the peak memory allocated to extract the fields used by
+the handler, for issue bodies of different sizes and for an ignored event.
+
+Run from the repository root with ``python benchmarks/bench_payload.py``.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import payloads  # noqa: E402
+
+from labelbot import payload  # noqa: E402
+
+
+def _original_fields(body):
+    data = json.loads(body)
+    if data.get("action") not in ("opened", "edited", "reopened"):
+        return None
+    return (
+        data["installation"]["id"],
+        data["repository"]["owner"]["login"],
+        data["repository"]["name"],
+        data["issue"]["number"],
+        data["issue"]["body"] or "",
+        [label["name"] for label in data["issue"]["labels"]],
+    )
+
+
+def _payload_fields(body):
+    webhook = payload.WebhookPayload(body)
+    if webhook.action not in ("opened", "edited", "reopened"):
+        return None
+    return (
+        webhook.installation_id,
+        webhook.owner,
+        webhook.repo,
+        webhook.issue_nr,
+        webhook.issue_body,
+        webhook.label_names,
+    )
+
+
+def _extractors():
+    extractors = {"json.loads": _original_fields}
+
+    def stdlib(body):
+        payload._loads = json.loads
+        return _payload_fields(body)
+
+    extractors["payload (json)"] = stdlib
+    try:
+        import orjson
+    except ImportError:
+        return extractors
+
+    def fast(body):
+        payload._loads = orjson.loads
+        return _payload_fields(body)
+
+    extractors["payload (orjson)"] = fast
+    return extractors
+
+
+def _bodies():
+    labels = ["bug", "help wanted"]
+    return {
+        "opened 1 KB": payloads.issue_event(1, payloads.markdown_body(1000, labels)),
+        "opened 16 KB": payloads.issue_event(1, payloads.markdown_body(16000, labels)),
+        "opened 64 KB": payloads.issue_event(1, payloads.markdown_body(65536, labels)),
+        "closed 16 KB": payloads.issue_event(
+            1, payloads.markdown_body(16000, labels), action="closed"
+        ),
+    }
+
+
+def _time_per_call(func, body, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(body)
+    return (time.perf_counter() - start) / iterations
+
+
+def _peak_allocation(func, body) -> int:
+    tracemalloc.start()
+    try:
+        func(body)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--iterations", type=int, default=1000)
+    args = parser.parse_args()
+
+    extractors = _extractors()
+    for name, body in _bodies().items():
+        print(f"{name} ({len(body)} bytes)")
+        for extractor_name, extractor in extractors.items():
+            # warm up, which also selects the decoder
+            extractor(body)
+            seconds = _time_per_call(extractor, body, args.iterations)
+            peak = _peak_allocation(extractor, body)
+            print(
+                f"    {extractor_name:18} {seconds * 1e6:9.1f} us/call "
+                f"{peak / 1024:8.1f} KiB peak allocation"
+            )
+
+
+if __name__ == "__main__":
+    main()
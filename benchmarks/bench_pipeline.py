@@ -0,0 +1,353 @@
+"""Offline benchmark of the full webhook pipeline.
+
+Drives the webhook entry points with signed issue events against a local
+fake GitHub API and a fake S3 bucket holding the private key, both with
+configurable latency. For each scenario it reports throughput, p50/p99
+latency, GitHub and S3 calls per event, and the time spent in each stage
+of the pipeline. Stages nest, e.g. ``access_token`` includes ``jwt`` when
+the token is not cached.
+
+Scenarios:
+
+* ``lambda-cold``: ``bot.lambda_handler`` with all process state dropped
+  before each event, as when every event lands in a fresh Lambda container.
+* ``lambda-warm``: ``bot.lambda_handler`` in a warm process.
+* ``server``: HTTP requests to a ``labelbot.server.WebhookServer``.
+
+By default the events are a mix of label requests, edits that do not change
+the requested labels and ignored actions. Recorded webhooks can be replayed
+instead with ``--events-file``, a JSON lines file with one raw webhook body
+per line.
+
+Labels are set with the REST API, or with the GraphQL API with
+``--api graphql``.
+
+Results can be saved with ``--output`` and compared with an earlier run with
+``--baseline``, which exits with status 1 if any scenario regressed by more
+than ``--threshold``.
+
+Run from the repository root with ``python benchmarks/bench_pipeline.py``.
+"""
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_github  # noqa: E402
+import fake_s3  # noqa: E402
+import harness  # noqa: E402
+import payloads  # noqa: E402
+
+from labelbot import auth  # noqa: E402
+from labelbot import bot  # noqa: E402
+from labelbot import github_api  # noqa: E402
+from labelbot import graphql  # noqa: E402
+from labelbot import server  # noqa: E402
+
+# (stage, module, function) of the pipeline stages to time
+STAGES = [
+    ("triage", bot, "triage"),
+    ("private_key", bot, "load_private_key"),
+    ("jwt", auth, "get_jwt_token"),
+    ("access_token", auth, "get_installation_access_token"),
+    ("allowed_labels", github_api, "get_allowed_labels"),
+    ("label_catalog", github_api, "get_label_catalog"),
+    ("add_labels", github_api, "add_labels"),
+    ("graphql_query", graphql, "get_issue_label_state"),
+    ("graphql_add_labels", graphql, "add_labels_by_id"),
+]
+# metrics where a higher value is a regression
+LOWER_IS_BETTER = ("p50_ms", "p99_ms", "github_calls_per_event", "s3_calls_per_event")
+
+
+class StageTimer:
+    """Times calls to the pipeline stages by wrapping the stage functions."""
+
+    def __init__(self):
+        self.timings = collections.defaultdict(list)
+        self._originals = []
+
+    def install(self) -> None:
+        for stage, module, name in STAGES:
+            original = getattr(module, name)
+            self._originals.append((module, name, original))
+            setattr(module, name, self._wrap(stage, original))
+
+    def uninstall(self) -> None:
+        for module, name, original in reversed(self._originals):
+            setattr(module, name, original)
+        self._originals.clear()
+
+    def reset(self) -> None:
+        self.timings.clear()
+
+    def summary(self, events: int) -> dict:
+        return {
+            stage: {
+                "calls_per_event": len(timings) / events,
+                "mean_ms": sum(timings) / len(timings) * 1000,
+                "p50_ms": harness.percentile(timings, 0.5) * 1000,
+                "p99_ms": harness.percentile(timings, 0.99) * 1000,
+            }
+            for stage, timings in self.timings.items()
+        }
+
+    def _wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.timings[stage].append(time.perf_counter() - start)
+
+        return timed
+
+
+def generated_events(count: int) -> list:
+    """Return a realistic mix of signed issue events."""
+    events = []
+    for nr in range(1, count + 1):
+        body = payloads.markdown_body(2000, ["bug"])
+        if nr % 10 == 0:
+            payload = payloads.issue_event(nr, body, action="closed")
+        elif nr % 4 == 0:
+            typo = body.replace("reproduce", "reproduec", 1)
+            payload = payloads.issue_event(
+                nr, body, action="edited", changes={"body": {"from": typo}}
+            )
+        else:
+            payload = payloads.issue_event(nr, body)
+        events.append(payloads.signed_event(payload, harness.SECRET_KEY))
+    return events
+
+
+def recorded_events(path: str) -> list:
+    """Read raw webhook bodies from a JSON lines file, and sign them."""
+    with open(path, mode="r", encoding="utf8") as f:
+        return [
+            payloads.signed_event(line.strip(), harness.SECRET_KEY)
+            for line in f
+            if line.strip()
+        ]
+
+
+def run_scenario(send, events, concurrency, github, s3, timer) -> dict:
+    github.reset_calls()
+    s3.reset_calls()
+    timer.reset()
+    latencies = []
+
+    def timed_send(event):
+        start = time.perf_counter()
+        status = send(event)
+        latencies.append(time.perf_counter() - start)
+        return status
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        statuses = list(executor.map(timed_send, events))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "events": len(events),
+        "events_per_second": len(events) / elapsed,
+        "p50_ms": harness.percentile(latencies, 0.5) * 1000,
+        "p99_ms": harness.percentile(latencies, 0.99) * 1000,
+        "github_calls_per_event": github.total_calls / len(events),
+        "s3_calls_per_event": s3.calls / len(events),
+        "failures": sum(status >= 400 for status in statuses),
+        "stages": timer.summary(len(events)),
+    }
+
+
+def _serve_in_thread(concurrency):
+    webhook_server = server.WebhookServer(("127.0.0.1", 0), workers=concurrency)
+    thread = threading.Thread(target=webhook_server.serve_forever)
+    thread.start()
+
+    def stop():
+        webhook_server.shutdown()
+        webhook_server.server_close()
+        thread.join()
+
+    host, port = webhook_server.server_address
+    return f"http://{host}:{port}/", stop
+
+
+def run_all(args) -> dict:
+    results = {}
+    timer = StageTimer()
+    s3 = fake_s3.FakeS3(latency=args.s3_latency)
+    with fake_github.FakeGitHub(latency=args.latency) as github:
+        harness.configure_environment(github.url, s3)
+        if args.events_file:
+            events = recorded_events(args.events_file)
+        else:
+            events = generated_events(args.events)
+
+        def lambda_cold(event):
+            harness.reset_process_state()
+            return bot.lambda_handler(event, None)["statusCode"]
+
+        def lambda_warm(event):
+            return bot.lambda_handler(event, None)["statusCode"]
+
+        timer.install()
+        try:
+            # the cold path serializes on cache resets, so run it sequentially
+            results["lambda-cold"] = run_scenario(
+                lambda_cold, events, 1, github, s3, timer
+            )
+            harness.reset_process_state()
+            results["lambda-warm"] = run_scenario(
+                lambda_warm, events, args.concurrency, github, s3, timer
+            )
+
+            harness.reset_process_state()
+            url, stop = _serve_in_thread(args.concurrency)
+            with requests.Session() as session:
+
+                def post(event):
+                    return session.post(
+                        url, data=event["body"], headers=event["headers"]
+                    ).status_code
+
+                try:
+                    results["server"] = run_scenario(
+                        post, events, args.concurrency, github, s3, timer
+                    )
+                finally:
+                    stop()
+        finally:
+            timer.uninstall()
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Return descriptions of the metrics that regressed by more than the
+    threshold (a fraction) relative to the baseline.
+    """
+    regressions = []
+    for scenario, metrics in results.items():
+        old = baseline.get("scenarios", {}).get(scenario)
+        if old is None:
+            continue
+        changes = [("events_per_second", old["events_per_second"], False)]
+        changes += [(name, old[name], True) for name in LOWER_IS_BETTER]
+        for name, old_value, lower_is_better in changes:
+            new_value = metrics[name]
+            if not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            if (change if lower_is_better else -change) > threshold:
+                regressions.append(
+                    f"{scenario} {name}: {old_value:.2f} -> {new_value:.2f} "
+                    f"({change:+.0%})"
+                )
+    return regressions
+
+
+def _print_results(results: dict) -> None:
+    for scenario, metrics in results.items():
+        print(
+            f"{scenario:12} {metrics['events_per_second']:8.1f} events/s "
+            f"p50 {metrics['p50_ms']:7.1f} ms "
+            f"p99 {metrics['p99_ms']:7.1f} ms "
+            f"{metrics['github_calls_per_event']:5.2f} GitHub calls/event "
+            f"{metrics['s3_calls_per_event']:5.2f} S3 calls/event "
+            f"{metrics['failures']} failures"
+        )
+        for stage, timing in metrics["stages"].items():
+            print(
+                f"    {stage:16} {timing['calls_per_event']:5.2f} calls/event "
+                f"mean {timing['mean_ms']:7.2f} ms "
+                f"p50 {timing['p50_ms']:7.2f} ms "
+                f"p99 {timing['p99_ms']:7.2f} ms"
+            )
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+            universal_newlines=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--events", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="GitHub API latency in seconds"
+    )
+    parser.add_argument(
+        "--s3-latency", type=float, default=0.03, help="S3 latency in seconds"
+    )
+    parser.add_argument("--events-file", help="JSON lines file of webhook bodies")
+    parser.add_argument(
+        "--api",
+        choices=("rest", "graphql"),
+        default=github_api.API,
+        help="GitHub API to set labels with",
+    )
+    parser.add_argument("-o", "--output", help="Write the results to a JSON file")
+    parser.add_argument("--baseline", help="Compare with results from a JSON file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative change that counts as a regression (default 0.1)",
+    )
+    args = parser.parse_args()
+
+    github_api.API = args.api
+    results = run_all(args)
+    _print_results(results)
+
+    if args.output:
+        with open(args.output, mode="w", encoding="utf8") as f:
+            json.dump(
+                {
+                    "revision": _git_revision(),
+                    "python": platform.python_version(),
+                    "parameters": {
+                        "events": results["lambda-warm"]["events"],
+                        "concurrency": args.concurrency,
+                        "latency": args.latency,
+                        "s3_latency": args.s3_latency,
+                        "events_file": args.events_file,
+                        "api": args.api,
+                    },
+                    "scenarios": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline, mode="r", encoding="utf8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
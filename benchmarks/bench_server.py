@@ -0,0 +1,109 @@
+"""Load test comparing the webhook server with the Lambda handler.
+
+Sends signed issue events that request labels, against a local fake GitHub
+API with configurable latency, through three paths:
+
+* ``lambda-cold``: ``bot.lambda_handler`` with all caches dropped before each
+  event, as when every event lands in a fresh Lambda container.
+* ``lambda-warm``: ``bot.lambda_handler`` in a warm process.
+* ``server``: HTTP requests to a ``labelbot.server.WebhookServer``.
+
+Run from the repository root with ``python benchmarks/bench_server.py``.
+"""
+import argparse
+import concurrent.futures
+import os
+import sys
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_github  # noqa: E402
+import harness  # noqa: E402
+import payloads  # noqa: E402
+
+from labelbot import bot  # noqa: E402
+from labelbot import server  # noqa: E402
+
+
+def _run(name, send, events, concurrency, github):
+    github.reset_calls()
+    latencies = []
+
+    def timed_send(event):
+        start = time.perf_counter()
+        status = send(event)
+        latencies.append(time.perf_counter() - start)
+        return status
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        statuses = list(executor.map(timed_send, events))
+    elapsed = time.perf_counter() - start
+
+    failures = sum(status != 200 for status in statuses)
+    print(
+        f"{name:12} {len(events) / elapsed:8.1f} events/s "
+        f"p50 {harness.percentile(latencies, 0.5) * 1000:7.1f} ms "
+        f"p99 {harness.percentile(latencies, 0.99) * 1000:7.1f} ms "
+        f"{github.total_calls / len(events):5.2f} GitHub calls/event "
+        f"{failures} failures"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--events", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="GitHub API latency in seconds"
+    )
+    args = parser.parse_args()
+
+    with fake_github.FakeGitHub(latency=args.latency) as github:
+        harness.configure_environment(github.url)
+        events = [
+            payloads.signed_event(
+                payloads.issue_event(nr, ":label:`bug`"), harness.SECRET_KEY
+            )
+            for nr in range(1, args.events + 1)
+        ]
+
+        def lambda_cold(event):
+            harness.reset_process_state()
+            return bot.lambda_handler(event, None)["statusCode"]
+
+        def lambda_warm(event):
+            return bot.lambda_handler(event, None)["statusCode"]
+
+        # the cold path serializes on cache resets, so run it without concurrency
+        _run("lambda-cold", lambda_cold, events, 1, github)
+        harness.reset_process_state()
+        _run("lambda-warm", lambda_warm, events, args.concurrency, github)
+
+        harness.reset_process_state()
+        webhook_server = server.WebhookServer(
+            ("127.0.0.1", 0), workers=args.concurrency
+        )
+        thread = threading.Thread(target=webhook_server.serve_forever)
+        thread.start()
+        host, port = webhook_server.server_address
+        url = f"http://{host}:{port}/"
+        with requests.Session() as session:
+
+            def post(event):
+                return session.post(
+                    url, data=event["body"], headers=event["headers"]
+                ).status_code
+
+            _run("server", post, events, args.concurrency, github)
+        webhook_server.shutdown()
+        webhook_server.server_close()
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
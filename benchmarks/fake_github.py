@@ -0,0 +1,191 @@
+"""A local stand-in for the parts of the GitHub API that labelbot uses.
+
+The fake runs an HTTP server in a background thread, optionally delays every
+response by a fixed latency, and counts the requests it receives per route.
+"""
+import base64
+import collections
+import hashlib
+import http.server
+import json
+import re
+import threading
+import time
+
+ACCESS_TOKEN = "fake-installation-token"
+
+_ROUTES = [
+    ("POST", re.compile(r"^/app/installations/\d+/access_tokens$"), "access_tokens"),
+    ("GET", re.compile(r"^/repos/[^/]+/[^/]+/contents/.+$"), "contents"),
+    ("GET", re.compile(r"^/repos/[^/]+/[^/]+/labels$"), "repo_labels"),
+    ("POST", re.compile(r"^/repos/[^/]+/[^/]+/issues/\d+/labels$"), "add_labels"),
+    ("PATCH", re.compile(r"^/repos/[^/]+/[^/]+/issues/\d+$"), "set_labels"),
+    ("GET", re.compile(r"^/repos/[^/]+/[^/]+/issues/\d+$"), "get_issue"),
+    ("POST", re.compile(r"^/graphql$"), "graphql"),
+]
+
+
+class FakeGitHub:
+    """A fake GitHub API serving a single .allowed-labels file for all repos."""
+
+    def __init__(self, allowed_labels: str = "bug\nhelp\n", latency: float = 0.0):
+        """
+        Args:
+            allowed_labels: Contents of the .allowed-labels file.
+            latency: Seconds to delay each response.
+        """
+        self.allowed_labels = allowed_labels
+        self.latency = latency
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def total_calls(self) -> int:
+        with self._lock:
+            return sum(self.calls.values())
+
+    def reset_calls(self) -> None:
+        with self._lock:
+            self.calls.clear()
+
+    def start(self) -> str:
+        """Start the server and return its base url."""
+        self._server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), _make_handler(self)
+        )
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _record(self, route: str) -> None:
+        with self._lock:
+            self.calls[route] += 1
+
+    def _contents(self):
+        content = self.allowed_labels.encode("utf8")
+        # the git blob SHA, as returned by the real contents API
+        sha = hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+        return (
+            {
+                "sha": sha,
+                "encoding": "base64",
+                "content": base64.b64encode(content).decode("ascii"),
+            },
+            f'"{sha}"',
+        )
+
+    def _repo_labels(self) -> list:
+        """List the labels of a repo, which are the labels in the
+        .allowed-labels file, on a single page.
+        """
+        return [{"name": line.strip()} for line in self.allowed_labels.splitlines()]
+
+    def _graphql(self, request: dict) -> dict:
+        """Answer the issue label query and the label mutation of
+        labelbot.graphql. Every label in the .allowed-labels file exists in
+        the repo, and issues have no labels.
+        """
+        if request["query"].lstrip().startswith("mutation"):
+            return {"data": {"addLabelsToLabelable": {"clientMutationId": None}}}
+
+        payload, _ = self._contents()
+        existing = {line.strip().casefold() for line in self.allowed_labels.split()}
+        repository = {
+            "allowedLabels": {"oid": payload["sha"], "text": self.allowed_labels},
+            "issue": {"id": "I_fake", "labels": {"nodes": []}},
+        }
+        for name, value in request["variables"].items():
+            if name.startswith("label"):
+                exists = value.casefold() in existing
+                repository[name] = (
+                    {"id": f"LA_{value}", "name": value} if exists else None
+                )
+        return {"data": {"repository": repository}}
+
+
+def _make_handler(github: FakeGitHub):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # the headers and the body are separate writes, which Nagle's
+        # algorithm would hold back until the client's delayed ACK
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self._dispatch("GET")
+
+        def do_POST(self):
+            self._dispatch("POST")
+
+        def do_PATCH(self):
+            self._dispatch("PATCH")
+
+        def _dispatch(self, method):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length) if length else b""
+            path = self.path.split("?")[0]
+            for route_method, pattern, route in _ROUTES:
+                if route_method == method and pattern.match(path):
+                    break
+            else:
+                self._respond(404, {"message": "Not Found"})
+                return
+
+            github._record(route)
+            if github.latency:
+                time.sleep(github.latency)
+
+            if route == "access_tokens":
+                expires_at = time.strftime(
+                    "%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() + 3600)
+                )
+                self._respond(201, {"token": ACCESS_TOKEN, "expires_at": expires_at})
+            elif route == "contents":
+                payload, etag = github._contents()
+                if self.headers.get("If-None-Match") == etag:
+                    self._respond(304, None, {"ETag": etag})
+                else:
+                    self._respond(200, payload, {"ETag": etag})
+            elif route == "repo_labels":
+                self._respond(200, github._repo_labels())
+            elif route in ("add_labels", "set_labels"):
+                labels = json.loads(body or b"{}").get("labels", [])
+                self._respond(200, [{"name": label} for label in labels])
+            elif route == "graphql":
+                self._respond(200, github._graphql(json.loads(body)))
+            else:
+                self._respond(200, {"labels": []})
+
+        def _respond(self, status, payload, headers=None):
+            data = b"" if payload is None else json.dumps(payload).encode("utf8")
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
@@ -0,0 +1,57 @@
+"""A local stand-in for the S3 client that labelbot loads its private key with.
+
+The fake implements the subset of the boto3 S3 client API that
+``auth.PemLoader`` uses, optionally delays every call by a fixed latency, and
+counts the calls it receives.
+"""
+import hashlib
+import io
+import threading
+import time
+
+import botocore.exceptions
+
+
+class FakeS3:
+    """A fake S3 client that keeps objects in memory."""
+
+    def __init__(self, latency: float = 0.0):
+        """
+        Args:
+            latency: Seconds to delay each call.
+        """
+        self.latency = latency
+        self.calls = 0
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes) -> None:
+        self._objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket: str, Key: str, IfNoneMatch: str = None) -> dict:
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        body = self._objects.get((Bucket, Key))
+        if body is None:
+            raise _client_error(404, "NoSuchKey")
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if IfNoneMatch == etag:
+            raise _client_error(304, "304")
+        return {"Body": io.BytesIO(body), "ETag": etag}
+
+    def reset_calls(self) -> None:
+        with self._lock:
+            self.calls = 0
+
+
+def _client_error(status: int, code: str) -> botocore.exceptions.ClientError:
+    return botocore.exceptions.ClientError(
+        {
+            "Error": {"Code": code, "Message": ""},
+            "ResponseMetadata": {"HTTPStatusCode": status},
+        },
+        "GetObject",
+    )
@@ -0,0 +1,59 @@
+"""Shared setup for the benchmarks that drive the webhook handler."""
+import os
+
+import jwcrypto.jwk
+
+from labelbot import auth
+from labelbot import github_api
+from labelbot import parse
+from labelbot import transport
+
+APP_ID = "12334"
+SECRET_KEY = "benchmark-secret"
+BUCKET_NAME = "labelbot-benchmark"
+BUCKET_KEY = "private-key.pem"
+
+
+def configure_environment(github_url: str, s3_client=None) -> None:
+    """Point labelbot at a fake GitHub API, and set the environment variables
+    of the handler, with a freshly generated private key.
+
+    Args:
+        github_url: Base url of the fake GitHub API.
+        s3_client: A fake S3 client to load the private key from. If None,
+            the key is passed in the PRIVATE_KEY environment variable.
+    """
+    key = jwcrypto.jwk.JWK.generate(kty="RSA", size=2048)
+    pem = key.export_to_pem(private_key=True, password=None)
+    if s3_client is None:
+        os.environ["PRIVATE_KEY"] = pem.decode("utf8")
+    else:
+        os.environ.pop("PRIVATE_KEY", None)
+        os.environ["BUCKET_NAME"] = BUCKET_NAME
+        os.environ["BUCKET_KEY"] = BUCKET_KEY
+        s3_client.put_object(Bucket=BUCKET_NAME, Key=BUCKET_KEY, Body=pem)
+        auth._s3_client = s3_client
+    os.environ["APP_ID"] = APP_ID
+    os.environ["SECRET_KEY"] = SECRET_KEY
+    github_api.BASE_URL = github_url
+
+
+def reset_process_state() -> None:
+    """Drop all process-wide caches and pooled connections, which emulates
+    running each event in a fresh Lambda container (minus import time).
+    """
+    auth.TOKEN_CACHE.invalidate()
+    auth.JWT_CACHE.invalidate()
+    auth._load_private_key.cache_clear()
+    auth._pem_loaders.clear()
+    github_api.ALLOWED_LABELS_CACHE.invalidate()
+    github_api.LABEL_CATALOG_CACHE.invalidate()
+    parse.MATCHER_CACHE.invalidate()
+    transport.set_session(None)
+
+
+def percentile(values, fraction: float) -> float:
+    """Return the value at the given fraction (0-1) of the sorted values."""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
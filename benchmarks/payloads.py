@@ -0,0 +1,172 @@
+"""Realistic GitHub issue webhook payloads for benchmarks.
+
+The payloads mirror the structure and size of real ``issues`` events, which
+carry full issue, repository, sender and installation objects.
+"""
+import hashlib
+import hmac
+import json
+from typing import List, Optional
+
+OWNER = "jcroona"
+REPO = "testrepo"
+INSTALLATION_ID = 825958
+
+
+def _user(login: str, user_id: int) -> dict:
+    api = f"https://api.github.com/users/{login}"
+    return {
+        "login": login,
+        "id": user_id,
+        "node_id": "MDQ6VXNlcjE5MTYyNzg0",
+        "avatar_url": f"https://avatars0.githubusercontent.com/u/{user_id}?v=4",
+        "gravatar_id": "",
+        "url": api,
+        "html_url": f"https://github.com/{login}",
+        "followers_url": f"{api}/followers",
+        "following_url": f"{api}/following{{/other_user}}",
+        "gists_url": f"{api}/gists{{/gist_id}}",
+        "starred_url": f"{api}/starred{{/owner}}{{/repo}}",
+        "subscriptions_url": f"{api}/subscriptions",
+        "organizations_url": f"{api}/orgs",
+        "repos_url": f"{api}/repos",
+        "events_url": f"{api}/events{{/privacy}}",
+        "received_events_url": f"{api}/received_events",
+        "type": "User",
+        "site_admin": False,
+    }
+
+
+def _repository(owner: str, repo: str) -> dict:
+    api = f"https://api.github.com/repos/{owner}/{repo}"
+    payload = {
+        "id": 179567397,
+        "node_id": "MDEwOlJlcG9zaXRvcnkxNzk1NjczOTc=",
+        "name": repo,
+        "full_name": f"{owner}/{repo}",
+        "private": False,
+        "owner": _user(owner, 19162784),
+        "html_url": f"https://github.com/{owner}/{repo}",
+        "description": "Repo for testing aws lambda",
+        "fork": False,
+        "url": api,
+        "created_at": "2019-04-04T19:54:23Z",
+        "updated_at": "2019-04-12T08:28:32Z",
+        "pushed_at": "2019-04-12T08:28:31Z",
+        "git_url": f"git://github.com/{owner}/{repo}.git",
+        "ssh_url": f"git@github.com:{owner}/{repo}.git",
+        "clone_url": f"https://github.com/{owner}/{repo}.git",
+        "homepage": None,
+        "size": 1,
+        "stargazers_count": 0,
+        "watchers_count": 0,
+        "language": None,
+        "has_issues": True,
+        "has_projects": True,
+        "has_downloads": True,
+        "has_wiki": True,
+        "has_pages": False,
+        "forks_count": 0,
+        "archived": False,
+        "disabled": False,
+        "open_issues_count": 8,
+        "license": None,
+        "default_branch": "master",
+    }
+    for name in (
+        "forks hooks events tags languages stargazers contributors subscribers "
+        "subscription merges downloads deployments teams"
+    ).split():
+        payload[f"{name}_url"] = f"{api}/{name}"
+    for name in (
+        "keys collaborators issue_events assignees branches blobs git_tags "
+        "git_refs trees statuses commits git_commits comments issue_comment "
+        "contents compare archive issues pulls milestones notifications labels "
+        "releases"
+    ).split():
+        payload[f"{name}_url"] = f"{api}/{name}{{/id}}"
+    return payload
+
+
+def markdown_body(size: int, labels: List[str] = ("bug",)) -> str:
+    """Return an issue body of about ``size`` characters, with prose, inline
+    code, a fenced code block and label markup for the given labels.
+    """
+    paragraph = (
+        "When running `labelbot` against a repo with many issues, the handler "
+        "sometimes times out. Steps to reproduce are below, and the full log "
+        "is attached.\n\n"
+    )
+    code_block = "```python\nfor issue in issues:\n    handle(issue)\n```\n\n"
+    markup = " ".join(f":label:`{label}`" for label in labels) + "\n"
+    body = markup
+    while len(body) < size:
+        body += paragraph + code_block
+    return body[: max(size, len(markup))]
+
+
+def issue_event(
+    issue_nr: int,
+    body: str,
+    action: str = "opened",
+    labels: Optional[List[str]] = None,
+    owner: str = OWNER,
+    repo: str = REPO,
+    changes: Optional[dict] = None,
+) -> str:
+    """Return the JSON body of an issues webhook event."""
+    issue_api = f"https://api.github.com/repos/{owner}/{repo}/issues/{issue_nr}"
+    payload = {
+        "action": action,
+        "issue": {
+            "url": issue_api,
+            "repository_url": f"https://api.github.com/repos/{owner}/{repo}",
+            "labels_url": f"{issue_api}/labels{{/name}}",
+            "comments_url": f"{issue_api}/comments",
+            "events_url": f"{issue_api}/events",
+            "html_url": f"https://github.com/{owner}/{repo}/issues/{issue_nr}",
+            "id": 434163632 + issue_nr,
+            "node_id": "MDU6SXNzdWU0MzQxNjM2MzI=",
+            "number": issue_nr,
+            "title": f"Issue number {issue_nr}",
+            "user": _user(owner, 19162784),
+            "labels": [{"name": label} for label in labels or []],
+            "state": "open",
+            "locked": False,
+            "assignee": None,
+            "assignees": [],
+            "milestone": None,
+            "comments": 0,
+            "created_at": "2019-04-17T08:47:17Z",
+            "updated_at": "2019-04-17T08:52:14Z",
+            "closed_at": None,
+            "author_association": "OWNER",
+            "body": body,
+        },
+        "repository": _repository(owner, repo),
+        "sender": _user(owner, 19162784),
+        "installation": {
+            "id": INSTALLATION_ID,
+            "node_id": "MDIzOkludGVncmF0aW9uSW5zdGFsbGF0aW9uODI1OTU4",
+        },
+    }
+    if changes is not None:
+        payload["changes"] = changes
+    return json.dumps(payload, indent=2)
+
+
+def signed_event(body: str, secret: str) -> dict:
+    """Wrap a webhook body in an API Gateway proxy event with a valid
+    signature.
+    """
+    key = secret.encode("utf8")
+    sha1 = hmac.new(key, body.encode("utf8"), hashlib.sha1)
+    sha256 = hmac.new(key, body.encode("utf8"), hashlib.sha256)
+    return {
+        "headers": {
+            "X-GitHub-Event": "issues",
+            "X-Hub-Signature": f"sha1={sha1.hexdigest()}",
+            "X-Hub-Signature-256": f"sha256={sha256.hexdigest()}",
+        },
+        "body": body,
+    }
@@ -0,0 +1,4 @@
+import time
+
+# when the import of the package started, for measuring cold start time
+IMPORT_STARTED_AT = time.perf_counter()
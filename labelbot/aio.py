@@ -0,0 +1,311 @@
+"""Asyncio variants of the GitHub API functions and of the event handler.
+
+This module requires the optional ``aiohttp`` dependency, which is installed
+with ``pip install labelbot[ASYNC]``. It shares its caches (installation
+tokens, JWTs and allowed labels) with the synchronous API, so a process can
+mix both. A single event loop can handle many webhooks concurrently, without
+a thread per request.
+
+.. module:: aio
+    :synopsis: Asyncio variants of the GitHub API functions and event handler.
+"""
+import asyncio
+import json
+from typing import Any, Callable, Iterable, List, Mapping, Optional, Tuple
+
+import aiohttp
+
+from labelbot import auth
+from labelbot import bot
+from labelbot import github_api
+from labelbot import metrics
+from labelbot import parse
+from labelbot import ratelimit
+from labelbot import singleflight
+from labelbot import transport
+
+# maximum amount of concurrent connections to the GitHub API
+CONNECTION_LIMIT = 100
+# shares concurrent requests for the token of the same installation
+TOKEN_FLIGHTS = singleflight.AsyncSingleFlight()
+
+
+async def handle_event(event) -> dict:
+    """Asyncio variant of :py:func:`labelbot.bot.lambda_handler`.
+
+    Args:
+        event: An API Gateway proxy event with a GitHub webhook.
+    Returns:
+        An API Gateway proxy response.
+    """
+    with metrics.event("webhook"), ratelimit.wait_budget():
+        response = await _handle_event(event)
+        metrics.set_property("status_code", bot._status_code(response))
+        return response
+
+
+async def _handle_event(event) -> dict:
+    issue_event, response = bot.triage(event)
+    if issue_event is None:
+        return response
+
+    with metrics.stage("get_installation_access_token"):
+        access_token = await get_installation_access_token(
+            issue_event.installation_id, bot.generate_jwt_token
+        )
+    with metrics.stage("set_allowed_labels"):
+        success = await set_allowed_labels(
+            issue_event.owner,
+            issue_event.repo,
+            issue_event.issue_nr,
+            issue_event.issue_body,
+            issue_event.current_labels,
+            access_token,
+        )
+    return bot._response(200 if success else 403, "labels set" if success else "failed")
+
+
+async def get_installation_access_token(
+    installation_id, jwt_factory: Callable[[], str]
+) -> str:
+    """Asyncio variant of :py:func:`labelbot.auth.get_installation_access_token`.
+
+    The JWT factory may block on I/O (e.g. downloading the private key), and
+    is therefore run in the default executor.
+    """
+
+    async def fetch() -> str:
+        loop = asyncio.get_event_loop()
+        jwt_token = await loop.run_in_executor(None, jwt_factory)
+        _, _, data = await _request(
+            "POST",
+            auth._access_tokens_url(installation_id),
+            auth._create_app_auth_headers(jwt_token),
+        )
+        token, expires_at = auth._parse_access_token(data)
+        auth.TOKEN_CACHE.put(installation_id, token, expires_at)
+        return token
+
+    token = auth.TOKEN_CACHE.get(installation_id)
+    if token is None:
+        return await TOKEN_FLIGHTS.do(installation_id, fetch)
+    time_to_stale = auth.TOKEN_CACHE.time_to_stale(installation_id)
+    if time_to_stale is not None and time_to_stale < auth.TOKEN_REFRESH_AHEAD:
+        TOKEN_FLIGHTS.refresh(installation_id, fetch)
+    return token
+
+
+async def set_allowed_labels(
+    owner: str,
+    repo: str,
+    issue_nr: int,
+    issue_body: str,
+    current_labels: List[str],
+    access_token: str,
+) -> bool:
+    """Asyncio variant of :py:func:`labelbot.github_api.set_allowed_labels`."""
+    allowed_labels = await get_allowed_labels(owner, repo, access_token)
+    labels_to_add = github_api.select_labels_to_add(
+        allowed_labels, issue_body, current_labels
+    )
+    if labels_to_add:
+        catalog = await get_label_catalog(owner, repo, access_token)
+        labels_to_add = catalog.filter(labels_to_add)
+    if not labels_to_add:
+        return True
+    return await add_labels(labels_to_add, owner, repo, issue_nr, access_token)
+
+
+async def get_label_catalog(
+    owner: str, repo: str, access_token: str
+) -> github_api.LabelCatalog:
+    """Asyncio variant of :py:func:`labelbot.github_api.get_label_catalog`.
+
+    Pages are requested by number until a page is not full, as the headers
+    returned by :py:func:`_request` are not parsed for next links.
+    """
+    cache = github_api.LABEL_CATALOG_CACHE
+    catalog = cache.lookup(owner, repo)
+    if catalog is not None:
+        return catalog
+
+    async def fetch() -> github_api.LabelCatalog:
+        generation = cache.generation
+        url = github_api._repo_labels_url(owner, repo)
+        headers = github_api._create_auth_headers(access_token)
+        per_page = github_api.PER_PAGE
+        names = []
+        page = 1
+        while True:
+            status, _, data = await _request(
+                "GET", f"{url}?per_page={per_page}&page={page}", headers
+            )
+            if status != 200 or not isinstance(data, list):
+                raise github_api.APIError(f"could not list {url}: {status}")
+            names.extend(label["name"] for label in data)
+            if len(data) < per_page:
+                break
+            page += 1
+        catalog = github_api.LabelCatalog(names)
+        cache.put(owner, repo, catalog, generation)
+        return catalog
+
+    return await cache.async_flights.do((owner, repo), fetch)
+
+
+async def get_allowed_labels(
+    owner: str, repo: str, access_token: str
+) -> parse.AllowListMatcher:
+    """Asyncio variant of :py:func:`labelbot.github_api.get_allowed_labels`."""
+    cache = github_api.ALLOWED_LABELS_CACHE
+    labels, etag, last_modified = cache.lookup(owner, repo)
+
+    async def fetch() -> parse.AllowListMatcher:
+        headers = github_api._create_auth_headers(access_token)
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        status, resp_headers, data = await _request(
+            "GET", github_api._allowed_labels_url(owner, repo), headers
+        )
+        return cache.update(owner, repo, status, resp_headers, data)
+
+    if labels is None:
+        return await cache.async_flights.do((owner, repo), fetch)
+    if cache.needs_refresh(owner, repo):
+        cache.async_flights.refresh((owner, repo), fetch)
+    return labels
+
+
+async def add_labels(
+    labels: Iterable[str], owner: str, repo: str, issue_nr: int, access_token: str
+) -> bool:
+    """Asyncio variant of :py:func:`labelbot.github_api.add_labels`."""
+    status, _, _ = await _request(
+        "POST",
+        github_api._issue_labels_url(owner, repo, issue_nr),
+        github_api._create_auth_headers(access_token),
+        {"labels": list(labels)},
+    )
+    return status == 200
+
+
+async def set_labels(
+    labels: Iterable[str], owner: str, repo: str, issue_nr: int, access_token: str
+) -> bool:
+    """Asyncio variant of :py:func:`labelbot.github_api.set_labels`."""
+    status, _, _ = await _request(
+        "PATCH",
+        github_api._issue_url(owner, repo, issue_nr),
+        github_api._create_auth_headers(access_token),
+        {"labels": list(labels)},
+    )
+    return status == 200
+
+
+async def get_labels(
+    owner: str, repo: str, issue_nr: int, access_token: str
+) -> List[str]:
+    """Asyncio variant of :py:func:`labelbot.github_api.get_labels`."""
+    _, _, data = await _request(
+        "GET",
+        github_api._issue_url(owner, repo, issue_nr),
+        github_api._create_auth_headers(access_token),
+    )
+    try:
+        return [lab["name"] for lab in data["labels"]]
+    except (KeyError, TypeError):
+        raise github_api.APIError(
+            f"could not get labels from {owner}/{repo}#{issue_nr}"
+        )
+
+
+async def get_file_contents(
+    owner: str, repo: str, filepath: str, access_token: str
+) -> str:
+    """Asyncio variant of :py:func:`labelbot.github_api.get_file_contents`."""
+    _, _, data = await _request(
+        "GET",
+        github_api._contents_url(owner, repo, filepath),
+        github_api._create_auth_headers(access_token),
+    )
+    return github_api._decode_contents(data, owner, repo, filepath)
+
+
+async def _request(
+    method: str, url: str, headers: dict, payload: Optional[dict] = None
+) -> Tuple[int, Mapping[str, str], Optional[Any]]:
+    """Send a request with the shared session, paced by the shared rate
+    limiter. Rate limited requests are retried if the backoff is short
+    enough.
+
+    Returns:
+        A tuple (status, headers, data), where data is the decoded JSON
+        payload of the response, or None if there is none.
+    """
+    limiter = ratelimit.LIMITER
+    key = ratelimit.request_key(headers)
+    data = None if payload is None else json.dumps(payload)
+    session = await get_session()
+    for retry in range(transport.RATE_LIMIT_RETRIES + 1):
+        delay = limiter.acquire(key)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with session.request(method, url, headers=headers, data=data) as resp:
+            status, resp_headers = resp.status, resp.headers
+            body = await resp.read()
+        metrics.record_request(status, len(data) if data else 0, len(body))
+        throttled = limiter.update(key, status, resp_headers)
+        if (
+            not throttled
+            or retry == transport.RATE_LIMIT_RETRIES
+            or limiter.backoff(key) > limiter.max_delay()
+        ):
+            break
+    try:
+        return status, resp_headers, json.loads(body) if body else None
+    except ValueError:
+        return status, resp_headers, None
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """Return the client session shared by all calls made from the running
+    event loop, creating it on first use.
+    """
+    global _session, _session_loop
+    loop = asyncio.get_event_loop()
+    if _session is None or _session.closed or _session_loop not in (None, loop):
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=CONNECTION_LIMIT),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=transport.CONNECT_TIMEOUT,
+                sock_read=transport.READ_TIMEOUT,
+            ),
+            headers={"User-Agent": transport.USER_AGENT},
+        )
+        _session_loop = loop
+    return _session
+
+
+def set_session(session: Optional[aiohttp.ClientSession]) -> None:
+    """Replace the shared client session, e.g. in tests. Passing None causes
+    a new default session to be created on next use.
+
+    Args:
+        session: The session to use for all asyncio GitHub API calls.
+    """
+    global _session, _session_loop
+    _session = session
+    _session_loop = None
+
+
+async def close_session() -> None:
+    """Close the shared client session, if any."""
+    if _session is not None and not _session.closed:
+        await _session.close()
+    set_session(None)
+
+
+_session = None  # type: Optional[aiohttp.ClientSession]
+_session_loop = None  # type: Optional[asyncio.AbstractEventLoop]
@@ -1,24 +1,56 @@
 """Functions for handling authentication procedures.
 
+The dependencies for signing JWTs (``jwcrypto``, ``python_jwt``), for
+downloading the private key (``boto3``) and for HTTP requests (``requests``)
+are imported on first use, so that webhooks that are rejected or ignored
+without calling GitHub do not pay for importing them on a cold start.
+
 .. module:: auth
     :synopsis: Functions for handling authentication procedures.
 .. moduleauthor:: Lars Hummelgren <larshum@kth.se> & Joakim Croona <jcroona@kth.se>
 """
 
 import datetime
-import http.client
-import json
-import jwcrypto
-import python_jwt
-import requests
-import boto3
-import botocore
+import functools
 import hmac
 import hashlib
+import threading
+import time
+from typing import Callable, Dict, Iterable, Mapping, Optional, Tuple, Union
+
+from labelbot import cache
+from labelbot import github_api
+from labelbot import metrics
+from labelbot import singleflight
+
+USER_AGENT = github_api.USER_AGENT
+# installation access tokens are refreshed this many seconds before they expire
+TOKEN_EXPIRY_MARGIN = 5 * 60
+# fallback lifetime in seconds for tokens without an expires_at timestamp
+TOKEN_LIFETIME = 60 * 60
 
-USER_AGENT = "label-bot"
+# lifetime of a JWT, GitHub allows at most 10 minutes
+JWT_LIFETIME = datetime.timedelta(minutes=10)
+# signed JWTs are reused until this many seconds before they expire
+JWT_EXPIRY_MARGIN = 60
+# cached tokens are refreshed in the background when they are used this many
+# seconds before they become stale
+TOKEN_REFRESH_AHEAD = 5 * 60
+# seconds between checks for a changed private key in S3
+PEM_REVALIDATE_INTERVAL = 15 * 60
+# webhook signature headers, strongest first, with their prefix and digest
+SIGNATURE_HEADERS = (
+    ("X-Hub-Signature-256", "sha256", hashlib.sha256),
+    ("X-Hub-Signature", "sha1", hashlib.sha1),
+)
 
+TOKEN_CACHE = cache.ExpiringCache(margin=TOKEN_EXPIRY_MARGIN)
+JWT_CACHE = cache.ExpiringCache(margin=JWT_EXPIRY_MARGIN)
+# shares concurrent requests for the token of the same installation
+TOKEN_FLIGHTS = singleflight.SingleFlight()
 
+
+@metrics.timed("generate_jwt_token")
 def generate_jwt_token(private_pem: bytes, app_id: int) -> str:
     """Generates a JWT token valid for 10 minutes using the private key.
 
@@ -28,10 +60,38 @@ def generate_jwt_token(private_pem: bytes, app_id: int) -> str:
     Returns:
         The JWT that was generated using the private key and the app id
     """
-    private_key = jwcrypto.jwk.JWK.from_pem(private_pem)
+    import python_jwt
+
+    private_key = _load_private_key(private_pem)
     payload = {"iss": app_id}
-    duration = datetime.timedelta(minutes=10)
-    return python_jwt.generate_jwt(payload, private_key, "RS256", duration)
+    return python_jwt.generate_jwt(payload, private_key, "RS256", JWT_LIFETIME)
+
+
+def get_jwt_token(private_pem: bytes, app_id: int) -> str:
+    """Get a JWT token for the app, reusing a previously signed token if it
+    does not expire within the next ``JWT_EXPIRY_MARGIN`` seconds.
+
+    Args:
+        private_pem: the private key that is used to generate a JWT
+        app_id the Application id
+    Returns:
+        A JWT that is valid for at least ``JWT_EXPIRY_MARGIN`` seconds.
+    """
+    key = (app_id, private_pem)
+    jwt_token = JWT_CACHE.get(key)
+    if jwt_token is None:
+        expires_at = time.time() + JWT_LIFETIME.total_seconds()
+        jwt_token = generate_jwt_token(private_pem, app_id)
+        JWT_CACHE.put(key, jwt_token, expires_at)
+    return jwt_token
+
+
+@functools.lru_cache(maxsize=4)
+def _load_private_key(private_pem: bytes) -> "jwcrypto.jwk.JWK":
+    """Parse a private PEM key. The result is memoized as parsing is slow."""
+    import jwcrypto.jwk
+
+    return jwcrypto.jwk.JWK.from_pem(private_pem)
 
 
 def generate_installation_access_token(jwt_token: str, installation_id) -> str:
@@ -45,29 +105,205 @@ def generate_installation_access_token(jwt_token: str, installation_id) -> str:
     Returns:
         An installation access token from the GitHub API
     """
-    headers = {
+    token, _ = _request_installation_access_token(jwt_token, installation_id)
+    return token
+
+
+def get_installation_access_token(
+    installation_id, jwt_factory: Callable[[], str]
+) -> str:
+    """Get an installation access token, reusing a cached token if there is
+    one that does not expire within the next ``TOKEN_EXPIRY_MARGIN`` seconds.
+
+    Concurrent calls for the same installation share a single request for a
+    new token, and a cached token that is used within ``TOKEN_REFRESH_AHEAD``
+    seconds of becoming stale is refreshed in the background.
+
+    Args:
+        installation_id: the installation id of the app.
+        jwt_factory: A function that returns a valid JWT token. Only called
+            if a new installation access token must be generated.
+    Returns:
+        An installation access token for the installation.
+    """
+
+    def fetch() -> str:
+        token, expires_at = _request_installation_access_token(
+            jwt_factory(), installation_id
+        )
+        TOKEN_CACHE.put(installation_id, token, expires_at)
+        return token
+
+    token = TOKEN_CACHE.get(installation_id)
+    if token is None:
+        return TOKEN_FLIGHTS.do(installation_id, fetch)
+    time_to_stale = TOKEN_CACHE.time_to_stale(installation_id)
+    if time_to_stale is not None and time_to_stale < TOKEN_REFRESH_AHEAD:
+        TOKEN_FLIGHTS.refresh(installation_id, fetch)
+    return token
+
+
+@metrics.timed("generate_installation_access_token")
+def _request_installation_access_token(
+    jwt_token: str, installation_id
+) -> Tuple[str, float]:
+    """Request a new installation access token from the GitHub API.
+
+    Returns:
+        A tuple (token, expires_at), where expires_at is the expiry time of the
+        token in seconds since the epoch.
+    """
+    headers = _create_app_auth_headers(jwt_token)
+    url = _access_tokens_url(installation_id)
+    r = github_api._get_session().post(url, headers=headers)
+    return _parse_access_token(r.json())
+
+
+def _create_app_auth_headers(jwt_token: str) -> dict:
+    """Generate headers for authenticating as the app."""
+    return {
         "Authorization": f"Bearer {jwt_token}",
         "Accept": "application/vnd.github.machine-man-preview+json",
         "User-Agent": USER_AGENT,
     }
-    url = f"https://api.github.com/app/installations/{installation_id}/access_tokens"
-    r = requests.post(url, headers=headers)
-    return r.json()["token"]
 
 
-def get_pem(bucket_name: str, bucket_key: str) -> bytes:
+def _access_tokens_url(installation_id) -> str:
+    """Generate the url for creating an installation access token."""
+    return f"{github_api.BASE_URL}/app/installations/{installation_id}/access_tokens"
+
+
+def _parse_access_token(data: dict) -> Tuple[str, float]:
+    """Extract the token and its expiry time in seconds since the epoch from
+    the JSON payload of an access token response.
+    """
+    return data["token"], _parse_expires_at(data.get("expires_at"))
+
+
+def _parse_expires_at(timestamp) -> float:
+    """Convert an ISO 8601 expires_at timestamp from the GitHub API to seconds
+    since the epoch.
+    """
+    if not timestamp:
+        return time.time() + TOKEN_LIFETIME
+    expires_at = datetime.datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")
+    return expires_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+@metrics.timed("get_pem")
+def get_pem(
+    bucket_name: str,
+    bucket_key: str,
+    revalidate_interval: float = PEM_REVALIDATE_INTERVAL,
+) -> bytes:
     """Reads a private PEM file from an S3 bucket.
 
+    The file is downloaded on first use and then kept in memory. It is only
+    downloaded again if it has changed in S3, which is checked at most once
+    every ``revalidate_interval`` seconds.
+
     Args:
         bucket_name: Name of the S3 bucket.
         bucket_key: Bucket key for the PEM file.
+        revalidate_interval: Minimum amount of seconds between checks for a
+            changed PEM file.
     Returns:
         Contents of the PEM file.
     """
-    s3 = boto3.resource("s3")
-    s3.Bucket(bucket_name).download_file(bucket_key, "/tmp/key.pem")
-    with open("/tmp/key.pem", "rb") as f:
-        return f.read()
+    key = (bucket_name, bucket_key)
+    with _pem_loaders_lock:
+        if key not in _pem_loaders:
+            _pem_loaders[key] = PemLoader(bucket_name, bucket_key, revalidate_interval)
+        loader = _pem_loaders[key]
+    return loader.get()
+
+
+class PemLoader:
+    """Keeps a private PEM file from an S3 bucket in memory, and revalidates
+    it with a conditional request (using the ETag of the object) at most once
+    per revalidation interval.
+    """
+
+    def __init__(
+        self,
+        bucket_name: str,
+        bucket_key: str,
+        revalidate_interval: float = PEM_REVALIDATE_INTERVAL,
+        s3_client=None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            bucket_name: Name of the S3 bucket.
+            bucket_key: Bucket key for the PEM file.
+            revalidate_interval: Minimum amount of seconds between checks for
+                a changed PEM file.
+            s3_client: The S3 client to use. Defaults to a client shared by
+                all loaders.
+            clock: Function returning a monotonic time in seconds.
+        """
+        self._bucket_name = bucket_name
+        self._bucket_key = bucket_key
+        self._revalidate_interval = revalidate_interval
+        self._s3_client = s3_client
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pem = None  # type: Optional[bytes]
+        self._etag = None  # type: Optional[str]
+        self._checked_at = 0.0
+
+    def get(self) -> bytes:
+        """Return the PEM file, fetching it from S3 if it is not in memory or
+        if it is due for revalidation.
+
+        Returns:
+            Contents of the PEM file.
+        """
+        with self._lock:
+            now = self._clock()
+            if self._pem is None or now - self._checked_at >= self._revalidate_interval:
+                self._fetch()
+                self._checked_at = now
+            return self._pem
+
+    def _fetch(self) -> None:
+        import botocore.exceptions
+
+        s3_client = self._s3_client or _get_s3_client()
+        kwargs = {"Bucket": self._bucket_name, "Key": self._bucket_key}
+        if self._pem is not None and self._etag is not None:
+            kwargs["IfNoneMatch"] = self._etag
+        try:
+            response = s3_client.get_object(**kwargs)
+        except botocore.exceptions.ClientError as exc:
+            if _is_not_modified(exc):
+                return
+            raise
+        self._pem = response["Body"].read()
+        self._etag = response.get("ETag")
+
+
+def _is_not_modified(exc: "botocore.exceptions.ClientError") -> bool:
+    """Check if a client error is an HTTP 304 Not Modified response."""
+    status = exc.response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    code = exc.response.get("Error", {}).get("Code")
+    return status == 304 or code in ("304", "NotModified")
+
+
+def _get_s3_client():
+    """Return an S3 client that is shared by all S3 calls in the process."""
+    global _s3_client
+    with _pem_loaders_lock:
+        if _s3_client is None:
+            import boto3
+
+            _s3_client = boto3.client("s3")
+        return _s3_client
+
+
+_s3_client = None
+_pem_loaders = {}  # type: Dict[Tuple[str, str], PemLoader]
+_pem_loaders_lock = threading.Lock()
 
 
 def authenticate_request(shared_secret: str, body: str, signature: str) -> bool:
@@ -84,9 +320,93 @@ def authenticate_request(shared_secret: str, body: str, signature: str) -> bool:
     """
     if signature is None:
         return False
+    return SignatureVerifier([shared_secret]).verify_signature(body, signature)
+
+
+class SignatureVerifier:
+    """Verifies the signatures of webhooks against one or more shared secrets.
+
+    The keyed HMAC state of each secret is computed once, and copied for each
+    request, so that verifying a signature only hashes the body. Several
+    secrets can be active at once, which allows rotating the secret by adding
+    the new one, updating the webhook on GitHub, and then removing the old
+    one.
+    """
+
+    def __init__(self, shared_secrets: Iterable[str]):
+        """
+        Args:
+            shared_secrets: Secrets shared between GitHub and the bot.
+        """
+        keys = [secret.encode("utf8") for secret in shared_secrets if secret]
+        # signature prefix -> keyed HMAC state of each secret
+        self._macs = {
+            prefix: [hmac.new(key, digestmod=digest) for key in keys]
+            for _, prefix, digest in SIGNATURE_HEADERS
+        }
+
+    def verify(self, body: Union[str, bytes], headers: Mapping[str, str]) -> bool:
+        """Verify the signature of a webhook, using the strongest signature
+        header that it has.
+
+        Args:
+            body: The raw body of the webhook.
+            headers: The headers of the webhook.
+        Returns:
+            True iff the signature was computed with the body and one of the
+            shared secrets.
+        """
+        for header, _, _ in SIGNATURE_HEADERS:
+            signature = headers.get(header)
+            if signature is not None:
+                return self.verify_signature(body, signature)
+        return False
+
+    def verify_signature(self, body: Union[str, bytes], signature: str) -> bool:
+        """Verify a signature header value, such as ``sha256=<hex digest>``.
+
+        Args:
+            body: The raw body of the webhook.
+            signature: The value of a signature header.
+        Returns:
+            True iff the signature was computed with the body and one of the
+            shared secrets.
+        """
+        prefix, _, hex_digest = signature.partition("=")
+        macs = self._macs.get(prefix)
+        if not macs:
+            return False
+        try:
+            expected = bytes.fromhex(hex_digest)
+        except ValueError:
+            return False
+        if len(expected) != macs[0].digest_size:
+            return False
+
+        if isinstance(body, str):
+            body = body.encode("utf8")
+        for keyed_mac in macs:
+            mac = keyed_mac.copy()
+            mac.update(body)
+            if hmac.compare_digest(mac.digest(), expected):
+                return True
+        return False
 
-    sha_body = hmac.new(
-        shared_secret.encode("utf8"), body.encode("utf8"), hashlib.sha1
-    ).hexdigest()
-    _, sha_github = signature.split("=")
-    return hmac.compare_digest(sha_body, sha_github)
+
+@functools.lru_cache(maxsize=4)
+def get_signature_verifier(
+    shared_secret: str, previous_secret: str = ""
+) -> SignatureVerifier:
+    """Get the verifier for a shared secret, and for the previous shared
+    secret while it is being rotated. The secrets are used literally, as
+    GitHub allows any string as a webhook secret.
+
+    Args:
+        shared_secret: The shared secret, such as the value of the
+            SECRET_KEY environment variable.
+        previous_secret: The previous shared secret, such as the value of the
+            SECRET_KEY_PREVIOUS environment variable, or an empty string if
+            there is none.
+    """
+    secrets = [shared_secret] + ([previous_secret] if previous_secret else [])
+    return SignatureVerifier(secrets)
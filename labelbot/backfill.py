@@ -0,0 +1,248 @@
+"""Command line tool for applying label markup retroactively.
+
+Walks every open issue of a repo, or of every repo an installation has access
+to, and adds the requested labels that are allowed by the repo's
+.allowed-labels file. This is useful after adding a new allowed label, as
+issues that already request it do not trigger any webhooks.
+
+Progress is written to a checkpoint file after each page of issues, so an
+interrupted run can be resumed by running the same command again.
+
+.. module:: backfill
+    :synopsis: Command line tool for applying label markup retroactively.
+"""
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import sys
+from typing import Callable, List, Optional
+
+from labelbot import auth
+from labelbot import bot
+from labelbot import github_api
+from labelbot import ratelimit
+
+LOGGER = logging.getLogger(__name__)
+
+# default maximum amount of concurrent label writes
+DEFAULT_CONCURRENCY = 8
+# a backfill is not bound by a webhook timeout, and may wait out a rate limit
+MAX_RATE_LIMIT_WAIT = 60 * 60
+
+
+class Checkpoint:
+    """Progress of a backfill run, persisted as a JSON file.
+
+    For each repo, the checkpoint stores the highest issue number of the
+    last completed page of issues, and whether the repo is done. As issues
+    are listed oldest first, issues up to that number are skipped on resume.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Args:
+            path: Path to the checkpoint file. If None, progress is only kept
+                in memory.
+        """
+        self._path = path
+        self._progress = {}
+        if path is not None and os.path.exists(path):
+            with open(path, mode="r", encoding="utf8") as f:
+                self._progress = json.load(f)
+
+    def is_done(self, owner: str, repo: str) -> bool:
+        return self._progress.get(f"{owner}/{repo}", {}).get("done", False)
+
+    def last_issue_nr(self, owner: str, repo: str) -> int:
+        return self._progress.get(f"{owner}/{repo}", {}).get("last_issue", 0)
+
+    def update(
+        self, owner: str, repo: str, last_issue_nr: int, done: bool = False
+    ) -> None:
+        self._progress[f"{owner}/{repo}"] = {"last_issue": last_issue_nr, "done": done}
+        if self._path is not None:
+            tmp_path = f"{self._path}.tmp"
+            with open(tmp_path, mode="w", encoding="utf8") as f:
+                json.dump(self._progress, f)
+            os.replace(tmp_path, self._path)
+
+
+def backfill_repo(
+    owner: str,
+    repo: str,
+    token_factory: Callable[[], str],
+    checkpoint: Checkpoint,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    dry_run: bool = False,
+) -> int:
+    """Add allowed, requested labels to all open issues of a repo.
+
+    The .allowed-labels file and the labels of the repo are fetched once, and
+    labels are only written to issues where they change. Allowed labels that
+    do not exist in the repo are skipped.
+
+    Args:
+        owner: User/Organization that owns the repo.
+        repo: Name of the repo.
+        token_factory: Function that returns an installation access token.
+        checkpoint: Checkpoint to resume from and record progress in.
+        concurrency: Maximum amount of concurrent label writes.
+        dry_run: If True, only report which issues would be labeled.
+    Returns:
+        The amount of issues that were labeled.
+    Raises:
+        github_api.APIError: If a request fails. Repos without an
+            .allowed-labels file are skipped and marked done instead.
+    """
+    if checkpoint.is_done(owner, repo):
+        LOGGER.info("%s/%s: already done, skipping", owner, repo)
+        return 0
+
+    try:
+        allowed_labels = github_api.get_allowed_labels(owner, repo, token_factory())
+    except github_api.APIError as exc:
+        # any other error may be transient, and must not mark the repo done
+        if exc.status_code != 404:
+            raise
+        LOGGER.info("%s/%s: no %s file", owner, repo, github_api.ALLOWED_LABELS_FILE)
+        checkpoint.update(owner, repo, 0, done=True)
+        return 0
+    catalog = github_api.get_label_catalog(owner, repo, token_factory())
+
+    last_issue_nr = checkpoint.last_issue_nr(owner, repo)
+    processed = labeled = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for page in github_api.iter_open_issue_pages(owner, repo, token_factory()):
+            futures = []
+            for issue in page:
+                if issue["number"] <= last_issue_nr:
+                    continue
+                labels_to_add = catalog.filter(
+                    github_api.select_labels_to_add(
+                        allowed_labels,
+                        issue.get("body") or "",
+                        [label["name"] for label in issue["labels"]],
+                    )
+                )
+                processed += 1
+                if not labels_to_add:
+                    continue
+                LOGGER.debug(
+                    "%s/%s#%d: adding %s",
+                    owner,
+                    repo,
+                    issue["number"],
+                    sorted(labels_to_add),
+                )
+                if not dry_run:
+                    futures.append(
+                        executor.submit(
+                            github_api.add_labels,
+                            labels_to_add,
+                            owner,
+                            repo,
+                            issue["number"],
+                            token_factory(),
+                        )
+                    )
+                labeled += 1
+
+            for future in futures:
+                if not future.result():
+                    raise github_api.APIError(f"could not add labels in {owner}/{repo}")
+            if page:
+                last_issue_nr = max(last_issue_nr, page[-1]["number"])
+                checkpoint.update(owner, repo, last_issue_nr)
+            LOGGER.info(
+                "%s/%s: %d issues processed, %d labeled",
+                owner,
+                repo,
+                processed,
+                labeled,
+            )
+
+    checkpoint.update(owner, repo, last_issue_nr, done=True)
+    return labeled
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Entry point of the labelbot-backfill command."""
+    args = _parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(message)s",
+    )
+
+    if args.private_key:
+        with open(args.private_key, mode="rb") as f:
+            pem = f.read()
+    else:
+        pem = bot.load_private_key()
+
+    def token_factory():
+        return auth.get_installation_access_token(
+            args.installation_id, lambda: auth.get_jwt_token(pem, args.app_id)
+        )
+
+    if args.repo:
+        owner, _, repo = args.repo.partition("/")
+        repos = [(owner, repo)]
+    else:
+        repos = list(github_api.list_installation_repos(token_factory()))
+
+    ratelimit.LIMITER.max_wait = MAX_RATE_LIMIT_WAIT
+    checkpoint = Checkpoint(args.checkpoint)
+    total = 0
+    for owner, repo in repos:
+        total += backfill_repo(
+            owner, repo, token_factory, checkpoint, args.concurrency, args.dry_run
+        )
+    LOGGER.info("done, %d issues labeled in %d repos", total, len(repos))
+
+
+def _parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="labelbot-backfill",
+        description="Apply label markup retroactively to all open issues.",
+    )
+    parser.add_argument(
+        "--app-id",
+        type=int,
+        default=os.getenv("APP_ID"),
+        required=not os.getenv("APP_ID"),
+        help="App ID of the GitHub App (defaults to $APP_ID)",
+    )
+    parser.add_argument(
+        "--installation-id", type=int, required=True, help="Installation ID"
+    )
+    parser.add_argument(
+        "--repo",
+        help="Repo to backfill as OWNER/NAME (defaults to all installation repos)",
+    )
+    parser.add_argument(
+        "--private-key",
+        help="Path to the private key (defaults to $PRIVATE_KEY or the S3 bucket)",
+    )
+    parser.add_argument(
+        "--checkpoint", help="Checkpoint file for resuming an interrupted run"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="Maximum amount of concurrent label writes",
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only report what would be labeled"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+    if args.repo and "/" not in args.repo:
+        parser.error("--repo must be on the form OWNER/NAME")
+    return args
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -8,38 +8,260 @@ functionality that needs to be changed.
     :synopsis: Event handler for AWS lambda.
 .. moduleauthor:: Simon Larsén <slarse@kth.se> & Joakim Croona <jcroona@kth.se>
 """
+import collections
 import json
 import os
+from typing import Callable, List, Optional, Tuple
+
 from labelbot import auth
 from labelbot import github_api
+from labelbot import graphql
+from labelbot import metrics
+from labelbot import parse
+from labelbot import payload
+from labelbot import ratelimit
+
+
+# issue actions that may add label markup to an issue
+HANDLED_ACTIONS = ("opened", "edited", "reopened")
+# the event of webhooks sent when a label of a repo is created, edited or deleted
+LABEL_EVENT = "label"
+
+IssueEvent = collections.namedtuple(
+    "IssueEvent",
+    "installation_id owner repo issue_nr issue_body current_labels",
+)
 
 
 def lambda_handler(event, context):
-    body = json.loads(event["body"])
-    installation_id = body["installation"]["id"]
-    owner = body["repository"]["owner"]["login"]
-    repo = body["repository"]["name"]
-    issue_nr = body["issue"]["number"]
-    issue_body = body["issue"]["body"]
-    current_labels = [label["name"] for label in body["issue"]["labels"]]
+    with metrics.event("webhook"), ratelimit.wait_budget():
+        response = _handle_event(event)
+        metrics.set_property("status_code", _status_code(response))
+        return response
+
+
+def _handle_event(event) -> dict:
+    issue_event, response = triage(event)
+    if issue_event is None:
+        return response
+
+    success = process_issue_event(issue_event)
+    return _response(200 if success else 403, "labels set" if success else "failed")
 
-    app_id = int(os.getenv("APP_ID"))
-    secret_key = os.getenv("SECRET_KEY")
-    authenticated = auth.authenticate_request(
-        secret_key, event["body"], event["headers"]["X-Hub-Signature"]
+
+def process_queued_event(payload: dict) -> bool:
+    """Process an event that was enqueued by a handler created with
+    :py:func:`make_queued_handler`.
+
+    Args:
+        payload: A payload from the queue.
+    Returns:
+        True if the labels were set, or there were none to set.
+    """
+    with metrics.event("queued_event"):
+        success = process_issue_event(IssueEvent(**payload))
+        metrics.set_property("success", success)
+        return success
+
+
+def process_issue_event(issue_event: IssueEvent) -> bool:
+    """Add the allowed, requested labels of a triaged event to its issue, with
+    the REST or GraphQL API as selected by ``github_api.API``.
+
+    Args:
+        issue_event: An event returned by :py:func:`triage`.
+    Returns:
+        True if the labels were set, or there were none to set.
+    """
+    access_token = auth.get_installation_access_token(
+        issue_event.installation_id, generate_jwt_token
+    )
+    set_allowed_labels = (
+        graphql.set_allowed_labels
+        if github_api.API == "graphql"
+        else github_api.set_allowed_labels
     )
-    if not authenticated:
-        return {"statuscode": 403}
+    return set_allowed_labels(
+        issue_event.owner,
+        issue_event.repo,
+        issue_event.issue_nr,
+        issue_event.issue_body,
+        issue_event.current_labels,
+        access_token,
+    )
+
+
+def make_queued_handler(event_queue) -> Callable[[dict], dict]:
+    """Create an event handler that only triages events, and enqueues the
+    ones that need processing instead of processing them. The webhook is
+    acknowledged with 202 Accepted as soon as the event is enqueued, or
+    rejected with 503 Service Unavailable if the queue is full.
+
+    Args:
+        event_queue: A :py:mod:`labelbot.work_queue` queue.
+    Returns:
+        A function that takes an API Gateway proxy event and returns a proxy
+        response.
+    """
+
+    from labelbot import work_queue
+
+    coalescing = isinstance(event_queue, work_queue.CoalescingQueue)
 
-    bucket_name = os.getenv("BUCKET_NAME")
-    bucket_key = os.getenv("BUCKET_KEY")
-    pem = auth.get_pem(bucket_name, bucket_key)
+    def enqueue(event: dict) -> dict:
+        webhook, issue_event, response = _triage(event)
+        if issue_event is None:
+            if coalescing and _is_handled_issue_event(webhook):
+                _supersede_pending(event_queue, webhook)
+            return response
+        try:
+            event_queue.put(issue_event._asdict())
+        except work_queue.QueueFull:
+            return _response(503, "queue full")
+        return _response(202, "queued")
 
-    jwt_token = auth.generate_jwt_token(pem, app_id)
-    access_token = auth.generate_installation_access_token(jwt_token, installation_id)
+    def handler(event: dict) -> dict:
+        with metrics.event("webhook"):
+            response = enqueue(event)
+            metrics.set_property("status_code", _status_code(response))
+            return response
 
-    success = github_api.set_allowed_labels(
-        owner, repo, issue_nr, issue_body, current_labels, access_token
+    return handler
+
+
+def triage(event) -> Tuple[Optional[IssueEvent], Optional[dict]]:
+    """Decide if an event needs to be processed, without doing any I/O. The
+    signature of the webhook is verified before its body is parsed, and only
+    the fields that are needed are read from it. ``label`` events invalidate
+    the cached labels of their repo.
+
+    Args:
+        event: An API Gateway proxy event with a GitHub webhook.
+    Returns:
+        A tuple (issue_event, response). If the event requests labels that are
+        not already set, issue_event holds the relevant fields of the event.
+        Otherwise, issue_event is None and response is the response to return.
+    """
+    _, issue_event, response = _triage(event)
+    return issue_event, response
+
+
+@metrics.timed("triage")
+def _triage(
+    event,
+) -> Tuple[Optional[payload.WebhookPayload], Optional[IssueEvent], Optional[dict]]:
+    """Like :py:func:`triage`, but also returns the webhook payload, or None
+    if the signature of the webhook is invalid.
+    """
+    verifier = auth.get_signature_verifier(
+        os.getenv("SECRET_KEY", ""), os.getenv("SECRET_KEY_PREVIOUS") or ""
     )
+    if not verifier.verify(event["body"], event["headers"]):
+        return None, None, {"statuscode": 403}
+
+    webhook = payload.WebhookPayload(event["body"])
+    if event["headers"].get("X-GitHub-Event") == LABEL_EVENT:
+        github_api.LABEL_CATALOG_CACHE.invalidate(webhook.owner, webhook.repo)
+        return webhook, None, _response(200, "label catalog invalidated")
+    if not _is_handled_issue_event(webhook):
+        return webhook, None, _response(200, "ignored event")
 
-    return {"statusCode": 200 if success else 403, "body": json.dumps("temp")}
+    if webhook.action == "edited" and not _wanted_labels_changed(webhook):
+        return webhook, None, _response(200, "requested labels unchanged")
+
+    issue_event = _issue_event(webhook)
+    if not _has_new_wanted_labels(issue_event.issue_body, issue_event.current_labels):
+        return webhook, None, _response(200, "no new labels requested")
+    return webhook, issue_event, None
+
+
+def _is_handled_issue_event(webhook: Optional[payload.WebhookPayload]) -> bool:
+    return (
+        webhook is not None
+        and webhook.action in HANDLED_ACTIONS
+        and webhook.is_issue_event
+    )
+
+
+def _issue_event(webhook: payload.WebhookPayload) -> IssueEvent:
+    return IssueEvent(
+        installation_id=webhook.installation_id,
+        owner=webhook.owner,
+        repo=webhook.repo,
+        issue_nr=webhook.issue_nr,
+        issue_body=webhook.issue_body,
+        current_labels=webhook.label_names,
+    )
+
+
+def _supersede_pending(event_queue, webhook: payload.WebhookPayload) -> None:
+    """Make an event that needs no processing of its own supersede a pending
+    event for the same issue in a coalescing queue, as the pending event has
+    an older issue body. The pending event is replaced if the issue still
+    requests new labels, and cancelled otherwise.
+    """
+    issue_event = _issue_event(webhook)
+    if _has_new_wanted_labels(issue_event.issue_body, issue_event.current_labels):
+        event_queue.replace_pending(issue_event._asdict())
+    else:
+        event_queue.cancel_pending(issue_event._asdict())
+
+
+def generate_jwt_token() -> str:
+    """Generate (or reuse) a JWT for the app given by the APP_ID environment
+    variable.
+    """
+    return auth.get_jwt_token(load_private_key(), int(os.getenv("APP_ID")))
+
+
+def _has_new_wanted_labels(issue_body: str, current_labels: List[str]) -> bool:
+    """Check if the issue body requests any label that is not already set,
+    without doing any I/O.
+    """
+    wanted_labels = parse.parse_wanted_labels(issue_body)
+    return not set(wanted_labels).issubset(current_labels)
+
+
+def _wanted_labels_changed(webhook: payload.WebhookPayload) -> bool:
+    """Check if an edit changed the labels requested by the issue body, by
+    comparing with the previous body in the changes of an ``edited`` event.
+    Edits that do not touch the body, such as title edits, change nothing.
+    """
+    if not webhook.has_changes:
+        return True
+    issue_body = webhook.issue_body
+    previous_body = webhook.previous_issue_body
+    if previous_body == issue_body:
+        return False
+    return set(parse.parse_wanted_labels(previous_body)) != set(
+        parse.parse_wanted_labels(issue_body)
+    )
+
+
+def _response(status_code: int, message: str) -> dict:
+    return {"statusCode": status_code, "body": json.dumps(message)}
+
+
+def _status_code(response: dict) -> Optional[int]:
+    return response.get("statusCode", response.get("statuscode"))
+
+
+def load_private_key() -> bytes:
+    """Get the private key of the app. It is taken from the PRIVATE_KEY
+    environment variable if set, and otherwise from the S3 bucket given by the
+    BUCKET_NAME and BUCKET_KEY environment variables.
+    """
+    private_key = os.getenv("PRIVATE_KEY")
+    if private_key:
+        return private_key.encode("utf8")
+
+    revalidate_interval = os.getenv("PEM_REVALIDATE_INTERVAL")
+    return auth.get_pem(
+        os.getenv("BUCKET_NAME"),
+        os.getenv("BUCKET_KEY"),
+        (
+            float(revalidate_interval)
+            if revalidate_interval
+            else auth.PEM_REVALIDATE_INTERVAL
+        ),
+    )
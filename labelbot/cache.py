@@ -0,0 +1,182 @@
+"""Caches for values that are expensive to obtain, such as access tokens.
+
+The caches live at module scope in the modules that use them, so they are
+shared by all invocations that run in the same process (e.g. a warm AWS
+Lambda container or a long-running server).
+
+.. module:: cache
+    :synopsis: Caches for values that are expensive to obtain.
+"""
+import collections
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class ExpiringCache:
+    """A thread safe mapping from keys to values that expire at a given point
+    in time.
+
+    An entry is considered stale ``margin`` seconds before it actually
+    expires, so a value returned from the cache is never about to expire
+    while it is still in use.
+    """
+
+    def __init__(self, margin: float = 0, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            margin: Seconds before expiry at which an entry is considered stale.
+            clock: Function returning the current time in seconds since the
+                epoch.
+        """
+        self._entries = {}  # type: Dict[Hashable, Tuple[Any, float]]
+        self._margin = margin
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the value for the key, or None if there is no fresh value.
+
+        Args:
+            key: The key to look up.
+        Returns:
+            The cached value, or None if it is missing or stale.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._clock() >= entry[1] - self._margin:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def time_to_stale(self, key: Hashable) -> Optional[float]:
+        """Return the amount of seconds until the entry for the key becomes
+        stale, which is negative if it already is, or None if there is no
+        entry. Lookups with this method do not count as hits or misses.
+
+        Args:
+            key: The key to look up.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return entry[1] - self._margin - self._clock()
+
+    def put(self, key: Hashable, value: Any, expires_at: float) -> None:
+        """Store a value in the cache.
+
+        Args:
+            key: The key to store the value under.
+            value: The value to store.
+            expires_at: Time in seconds since the epoch at which the value
+                expires.
+        """
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Remove a single entry, or all entries if no key is given.
+
+        Args:
+            key: The key to remove.
+        """
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counts and the amount of cached entries."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
+
+
+class LRUCache:
+    """A thread safe mapping that is bounded by the total size of its values,
+    and evicts the least recently used entries when it is full.
+    """
+
+    def __init__(self, max_size: int, sizeof: Callable[[Any], int]):
+        """
+        Args:
+            max_size: Maximum total size of the cached values.
+            sizeof: Function that returns the size of a value, typically an
+                estimate of its memory usage in bytes.
+        """
+        self.max_size = max_size
+        self._sizeof = sizeof
+        # key -> (value, size), least recently used first
+        self._entries = collections.OrderedDict()  # type: Dict[Hashable, Tuple]
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the value for the key, or None if it is not cached.
+
+        Args:
+            key: The key to look up.
+        Returns:
+            The cached value, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Store a value in the cache, evicting the least recently used
+        entries if the cache is full. Values larger than the cache are not
+        stored.
+
+        Args:
+            key: The key to store the value under.
+            value: The value to store.
+        """
+        size = self._sizeof(value)
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self._size -= old_entry[1]
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/eviction counts, the amount of cached entries and
+        their total size.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "bytes": self._size,
+            }
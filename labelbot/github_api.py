@@ -4,19 +4,66 @@
     :synopsis: Functions for interacting with the GitHub API.
 """
 import json
+import os
 import sys
 import base64
-from typing import Iterable, List
-import requests
+import threading
+import time
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
+from labelbot import metrics
 from labelbot import parse
+from labelbot import singleflight
 
 BASE_URL = "https://api.github.com"
+USER_AGENT = "label-bot"
 ALLOWED_LABELS_FILE = ".allowed-labels"
+# maximum amount of items per page for paginated resources
+PER_PAGE = 100
+# seconds during which a cached .allowed-labels file is used without revalidation
+ALLOWED_LABELS_TTL = 60
+# cached .allowed-labels files are revalidated in the background when they are
+# used this many seconds before they must be revalidated
+ALLOWED_LABELS_REFRESH_AHEAD = 15
+# if true, requested labels are matched against .allowed-labels regardless of case
+CASE_INSENSITIVE_LABELS = os.getenv("CASE_INSENSITIVE_LABELS", "").lower() == "true"
+# seconds during which the cached labels of a repo are used, unless a label
+# webhook for the repo invalidates them earlier
+LABEL_CATALOG_TTL = 10 * 60
+# the API that the event handler sets labels with, "rest" or "graphql"
+API = os.getenv("LABELBOT_API", "rest").lower()
 
 
 class APIError(Exception):
-    """Raise when something goes wrong with the api."""
+    """Raise when something goes wrong with the api.
+
+    Attributes:
+        status_code: The status code of the failed response, if there was one.
+    """
+
+    def __init__(self, message: str = "", status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _get_session():
+    """Return the session shared by all GitHub API calls. The transport, and
+    with it requests, is imported on first use.
+    """
+    from labelbot import transport
+
+    return transport.get_session()
 
 
 def _create_auth_headers(access_token):
@@ -29,8 +76,390 @@ def _issue_url(owner, repo, issue_nr):
     return f"{BASE_URL}/repos/{owner}/{repo}/issues/{issue_nr}"
 
 
+def _issue_labels_url(owner, repo, issue_nr):
+    """Generate the url for the labels of an issue."""
+    return f"{_issue_url(owner, repo, issue_nr)}/labels"
+
+
+def _contents_url(owner, repo, filepath):
+    """Generate the url for a file in a repo."""
+    return f"{BASE_URL}/repos/{owner}/{repo}/contents/{filepath}"
+
+
+def _repo_labels_url(owner, repo):
+    """Generate the url for the labels of a repo."""
+    return f"{BASE_URL}/repos/{owner}/{repo}/labels"
+
+
 def _allowed_labels_url(owner, repo):
-    return f"{BASE_URL}/repos/{owner}/{repo}/contents/{ALLOWED_LABELS_FILE}"
+    return _contents_url(owner, repo, ALLOWED_LABELS_FILE)
+
+
+class AllowedLabelsCache:
+    """A per-repo cache of compiled .allowed-labels files.
+
+    Entries are used as-is for ``ttl`` seconds, after which they are
+    revalidated with a conditional request. A 304 Not Modified response does
+    not count against the rate limit, and reuses the cached labels. Entries
+    that are used during the last ``refresh_ahead`` seconds of their ``ttl``
+    are revalidated in the background, so frequently used entries are
+    revalidated without making any request wait for it. Concurrent requests
+    for the same repo share a single fetch.
+    """
+
+    def __init__(
+        self,
+        ttl: float = ALLOWED_LABELS_TTL,
+        clock: Callable[[], float] = time.monotonic,
+        case_insensitive: bool = False,
+        refresh_ahead: float = ALLOWED_LABELS_REFRESH_AHEAD,
+    ):
+        """
+        Args:
+            ttl: Seconds during which an entry is used without revalidation.
+            clock: Function returning a monotonic time in seconds.
+            case_insensitive: If True, labels are matched against the
+                allow-lists regardless of case.
+            refresh_ahead: Seconds before the end of the ttl during which a
+                used entry is revalidated in the background.
+        """
+        self.ttl = ttl
+        self.case_insensitive = case_insensitive
+        self.refresh_ahead = refresh_ahead
+        # shared fetches of the same repo, for threads and for asyncio tasks
+        self.flights = singleflight.SingleFlight()
+        self.async_flights = singleflight.AsyncSingleFlight()
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (owner, repo) -> (matcher, etag, last_modified, validated_at)
+        self._entries = {}  # type: Dict[Tuple[str, str], tuple]
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    def get(self, owner: str, repo: str, access_token: str) -> parse.AllowListMatcher:
+        """Get the allowed labels of a repo, fetching the .allowed-labels file
+        only if there is no cached entry or if it has changed.
+
+        Args:
+            owner: User/Organization that owns the repo.
+            repo: Name of the repo.
+            access_token: An installation access token for the repo.
+        Returns:
+            A matcher for the allowed labels.
+        """
+        labels, etag, last_modified = self.lookup(owner, repo)
+
+        def fetch() -> parse.AllowListMatcher:
+            req = _get_contents(
+                owner, repo, ALLOWED_LABELS_FILE, access_token, etag, last_modified
+            )
+            data = req.json() if req.status_code == 200 else None
+            return self.update(owner, repo, req.status_code, req.headers, data)
+
+        if labels is None:
+            return self.flights.do((owner, repo), fetch)
+        if self.needs_refresh(owner, repo):
+            self.flights.refresh((owner, repo), fetch)
+        return labels
+
+    def lookup(
+        self, owner: str, repo: str
+    ) -> Tuple[Optional[parse.AllowListMatcher], Optional[str], Optional[str]]:
+        """Look up the allowed labels of a repo.
+
+        Args:
+            owner: User/Organization that owns the repo.
+            repo: Name of the repo.
+        Returns:
+            A tuple (labels, etag, last_modified). labels is None if the entry
+            is missing or must be revalidated, in which case etag and
+            last_modified should be used for the conditional request.
+        """
+        with self._lock:
+            entry = self._entries.get((owner, repo))
+            if entry is None:
+                return None, None, None
+            labels, etag, last_modified, validated_at = entry
+            if self._clock() - validated_at < self.ttl:
+                self.hits += 1
+                return labels, etag, last_modified
+            return None, etag, last_modified
+
+    def needs_refresh(self, owner: str, repo: str) -> bool:
+        """Check if the entry of a repo is fresh, but should be revalidated in
+        the background as it is within ``refresh_ahead`` seconds of the end
+        of its ttl.
+        """
+        with self._lock:
+            entry = self._entries.get((owner, repo))
+            if entry is None:
+                return False
+            age = self._clock() - entry[3]
+            return self.ttl - self.refresh_ahead <= age < self.ttl
+
+    def update(
+        self,
+        owner: str,
+        repo: str,
+        status_code: int,
+        headers: Mapping[str, str],
+        data: Optional[dict],
+    ) -> parse.AllowListMatcher:
+        """Update the cache with the response to a (conditional) request for
+        the .allowed-labels file of a repo.
+
+        Args:
+            owner: User/Organization that owns the repo.
+            repo: Name of the repo.
+            status_code: Status code of the response.
+            headers: Headers of the response.
+            data: The JSON payload of the response, or None for a 304 response.
+        Returns:
+            A matcher for the allowed labels.
+        Raises:
+            APIError: If the response is an error, such as a 404 for a repo
+                without a .allowed-labels file.
+        """
+        key = (owner, repo)
+        with self._lock:
+            entry = self._entries.get(key)
+            if status_code >= 400:
+                raise APIError(
+                    f"could not fetch {ALLOWED_LABELS_FILE} from {owner}/{repo}: "
+                    f"{status_code}",
+                    status_code,
+                )
+            if status_code == 304 and entry is not None:
+                self.revalidations += 1
+                labels, etag, last_modified, _ = entry
+            else:
+                self.misses += 1
+                labels = self._compile(data, owner, repo)
+                etag = headers.get("ETag")
+                last_modified = headers.get("Last-Modified")
+            self._entries[key] = (labels, etag, last_modified, self._clock())
+            return labels
+
+    def _compile(
+        self, data: Optional[dict], owner: str, repo: str
+    ) -> parse.AllowListMatcher:
+        """Compile the .allowed-labels file in a contents API payload. If a
+        file with the same git blob SHA has already been compiled, for this
+        or any other repo, it is reused without decoding the contents.
+        """
+        sha = data.get("sha") if isinstance(data, dict) else None
+        if not sha:
+            text = _decode_contents(data, owner, repo, ALLOWED_LABELS_FILE)
+            return parse.compile_allowed_labels(text, self.case_insensitive)
+        return parse.compile_allowed_labels_by_sha(
+            sha,
+            lambda: _decode_contents(data, owner, repo, ALLOWED_LABELS_FILE),
+            self.case_insensitive,
+        )
+
+    def invalidate(self) -> None:
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the amount of hits, revalidations and misses."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "revalidations": self.revalidations,
+                "misses": self.misses,
+            }
+
+
+ALLOWED_LABELS_CACHE = AllowedLabelsCache(case_insensitive=CASE_INSENSITIVE_LABELS)
+
+
+class LabelCatalog:
+    """The labels that exist in a repo. Label names are unique regardless of
+    case on GitHub, so labels are looked up by their casefolded name, with a
+    single hash lookup.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        """
+        Args:
+            names: Names of the labels in the repo.
+        """
+        # casefolded name -> name as spelled in the repo
+        self._names = {name.casefold(): name for name in names}
+
+    def match(self, label: str) -> Optional[str]:
+        """Return the label as spelled in the repo, or None if it does not
+        exist.
+        """
+        return self._names.get(label.casefold())
+
+    def filter(self, labels: Iterable[str]) -> Set[str]:
+        """Return the labels that exist in the repo, as spelled in the repo."""
+        matches = (self.match(label) for label in labels)
+        return {label for label in matches if label is not None}
+
+    def __contains__(self, label: str) -> bool:
+        return label.casefold() in self._names
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names.values())
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
+class LabelCatalogCache:
+    """A per-repo cache of the labels that exist in each repo.
+
+    Entries are used for ``ttl`` seconds, or until they are invalidated by a
+    ``label`` webhook of the repo. As only the process that receives a label
+    webhook can act on it, the ttl bounds how long other processes use
+    outdated labels. Concurrent requests for the same repo share a single
+    fetch.
+    """
+
+    def __init__(
+        self,
+        ttl: float = LABEL_CATALOG_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            ttl: Seconds during which an entry is used.
+            clock: Function returning a monotonic time in seconds.
+        """
+        self.ttl = ttl
+        self.flights = singleflight.SingleFlight()
+        self.async_flights = singleflight.AsyncSingleFlight()
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (owner, repo) -> (catalog, fetched_at)
+        self._entries = {}  # type: Dict[Tuple[str, str], Tuple[LabelCatalog, float]]
+        # incremented by each invalidation, so that fetches that started
+        # before an invalidation do not store outdated labels
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, owner: str, repo: str, access_token: str) -> LabelCatalog:
+        """Get the labels of a repo, fetching them if they are not cached.
+
+        Args:
+            owner: User/Organization that owns the repo.
+            repo: Name of the repo.
+            access_token: An installation access token for the repo.
+        Returns:
+            The labels of the repo.
+        """
+        catalog = self.lookup(owner, repo)
+        if catalog is not None:
+            return catalog
+
+        def fetch() -> LabelCatalog:
+            generation = self.generation
+            catalog = LabelCatalog(
+                label["name"]
+                for page in _paginate(
+                    _repo_labels_url(owner, repo), access_token, {"per_page": PER_PAGE}
+                )
+                for label in page
+            )
+            self.put(owner, repo, catalog, generation)
+            return catalog
+
+        return self.flights.do((owner, repo), fetch)
+
+    @property
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def lookup(self, owner: str, repo: str) -> Optional[LabelCatalog]:
+        """Return the cached labels of a repo, or None if they are missing or
+        expired.
+        """
+        with self._lock:
+            entry = self._entries.get((owner, repo))
+            if entry is None or self._clock() - entry[1] >= self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def put(
+        self, owner: str, repo: str, catalog: LabelCatalog, generation: int
+    ) -> None:
+        """Store the labels of a repo, unless the cache has been invalidated
+        since they were fetched.
+
+        Args:
+            owner: User/Organization that owns the repo.
+            repo: Name of the repo.
+            catalog: The labels of the repo.
+            generation: The :py:attr:`generation` of the cache when the fetch
+                of the labels started.
+        """
+        with self._lock:
+            if generation == self._generation:
+                self._entries[(owner, repo)] = (catalog, self._clock())
+
+    def invalidate(self, owner: Optional[str] = None, repo: Optional[str] = None):
+        """Remove the labels of a single repo, or of all repos if no repo is
+        given.
+        """
+        with self._lock:
+            self._generation += 1
+            if owner is None or repo is None:
+                self._entries.clear()
+            else:
+                self._entries.pop((owner, repo), None)
+
+    def stats(self) -> Dict[str, int]:
+        """Return the amount of hits and misses, and of cached repos."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
+
+
+LABEL_CATALOG_CACHE = LabelCatalogCache()
+
+
+@metrics.timed("get_label_catalog")
+def get_label_catalog(owner: str, repo: str, access_token: str) -> LabelCatalog:
+    """Get the labels that exist in a repo. They are cached in
+    LABEL_CATALOG_CACHE.
+
+    Args:
+        owner: User/Organization that owns the repo.
+        repo: Name of the repo.
+        access_token: An installation access token for the repo.
+    Returns:
+        The labels of the repo.
+    """
+    return LABEL_CATALOG_CACHE.get(owner, repo, access_token)
+
+
+@metrics.timed("get_allowed_labels")
+def get_allowed_labels(
+    owner: str, repo: str, access_token: str
+) -> parse.AllowListMatcher:
+    """Get the labels in the .allowed-labels file of a repo. The compiled file
+    is cached in ALLOWED_LABELS_CACHE.
+
+    Args:
+        owner: User/Organization that owns the repo.
+        repo: Name of the repo.
+        access_token: An installation access token for the repo.
+    Returns:
+        A matcher for the allowed labels.
+    """
+    return ALLOWED_LABELS_CACHE.get(owner, repo, access_token)
 
 
 def set_allowed_labels(
@@ -41,24 +470,83 @@ def set_allowed_labels(
     current_labels: List[str],
     access_token: str,
 ) -> bool:
-    """Set the current labels plus any requested labels in the issue body that
-    are also allowed by the .allowed-labels file.
+    """Add any requested labels in the issue body that are allowed by the
+    .allowed-labels file, exist in the repo and are not already set on the
+    issue. Nothing is written if there are no such labels, so allowed labels
+    that do not exist in the repo are never created.
 
     Args:
         owner: User/Organization that owns the repo.
         repo: Name of the repo.
         issue_nr: Number of the issue.
+        issue_body: Body of the issue, possibly containing label markup.
+        current_labels: Labels that are currently set on the issue.
         access_token: An installation access token for the repo.
+    Returns:
+        True if the labels were added or there were none to add.
+    """
+    allowed_labels = get_allowed_labels(owner, repo, access_token)
+    labels_to_add = select_labels_to_add(allowed_labels, issue_body, current_labels)
+    if labels_to_add:
+        labels_to_add = get_label_catalog(owner, repo, access_token).filter(
+            labels_to_add
+        )
+    if not labels_to_add:
+        return True
+    return add_labels(labels_to_add, owner, repo, issue_nr, access_token)
 
+
+def select_labels_to_add(
+    allowed_labels: Union[parse.AllowListMatcher, Iterable[str]],
+    issue_body: str,
+    current_labels: Iterable[str],
+) -> Set[str]:
+    """Select the labels requested in the issue body that are allowed and not
+    already set on the issue.
+
+    Args:
+        allowed_labels: A matcher for the .allowed-labels file, or the labels
+            allowed by it.
+        issue_body: Body of the issue, possibly containing label markup.
+        current_labels: Labels that are currently set on the issue.
+    Returns:
+        A set of labels to add to the issue.
     """
-    allowed_labels = parse.parse_allowed_labels(
-        get_file_contents(owner, repo, ALLOWED_LABELS_FILE, access_token)
-    )
-    wanted_labels = parse.parse_wanted_labels(issue_body)
-    labels_to_set = set(current_labels) | (set(allowed_labels) & set(wanted_labels))
-    return set_labels(labels_to_set, owner, repo, issue_nr, access_token)
+    if not isinstance(allowed_labels, parse.AllowListMatcher):
+        allowed_labels = parse.AllowListMatcher(allowed_labels)
+    current = {allowed_labels.normalize(label) for label in current_labels}
+    labels_to_add = set()
+    for wanted_label in parse.parse_wanted_labels(issue_body):
+        label = allowed_labels.match(wanted_label)
+        if label is not None and allowed_labels.normalize(label) not in current:
+            labels_to_add.add(label)
+    return labels_to_add
+
+
+@metrics.timed("add_labels")
+def add_labels(
+    labels: Iterable[str], owner: str, repo: str, issue_nr: int, access_token: str
+) -> bool:
+    """Add the provided labels to a repository issue, keeping any labels that
+    are already set.
 
+    Args:
+        labels: A sequence of labels to add.
+        owner: User/Organization that owns the repo.
+        repo: Name of the repo.
+        issue_nr: Number of the issue.
+        access_token: An installation access token for the repo.
+    Returns:
+        True if the API request was succesful
+    """
+    headers = _create_auth_headers(access_token)
+    payload = json.dumps({"labels": list(labels)})
+    url = _issue_labels_url(owner, repo, issue_nr)
+    req = _get_session().post(url, headers=headers, data=payload)
+    return req.status_code == 200
 
+
+@metrics.timed("set_labels")
 def set_labels(
     labels: Iterable[str], owner: str, repo: str, issue_nr: int, access_token: str
 ) -> bool:
@@ -76,7 +564,7 @@ def set_labels(
     headers = _create_auth_headers(access_token)
     payload = json.dumps({"labels": list(labels)})
     url = _issue_url(owner, repo, issue_nr)
-    req = requests.patch(url, headers=headers, data=payload)
+    req = _get_session().patch(url, headers=headers, data=payload)
     return req.status_code == 200
 
 
@@ -93,7 +581,7 @@ def get_labels(owner: str, repo: str, issue_nr: int, access_token: str) -> List[
     """
     headers = _create_auth_headers(access_token)
     url = _issue_url(owner, repo, issue_nr)
-    req = requests.get(url, headers=headers)
+    req = _get_session().get(url, headers=headers)
     try:
         labels = [lab["name"] for lab in req.json()["labels"]]
     except KeyError:
@@ -101,6 +589,63 @@ def get_labels(owner: str, repo: str, issue_nr: int, access_token: str) -> List[
     return labels
 
 
+def iter_open_issue_pages(
+    owner: str, repo: str, access_token: str
+) -> Iterator[List[dict]]:
+    """Iterate over pages of open issues of a repo, oldest first. Pull
+    requests are skipped.
+
+    Args:
+        owner: User/Organization that owns the repo.
+        repo: Name of the repo.
+        access_token: An installation access token for the repo.
+    Returns:
+        An iterator of lists of issue JSON objects.
+    """
+    url = f"{BASE_URL}/repos/{owner}/{repo}/issues"
+    params = {
+        "state": "open",
+        "sort": "created",
+        "direction": "asc",
+        "per_page": PER_PAGE,
+    }
+    for page in _paginate(url, access_token, params):
+        yield [issue for issue in page if "pull_request" not in issue]
+
+
+def list_installation_repos(access_token: str) -> Iterator[Tuple[str, str]]:
+    """Iterate over the repos that an installation has access to.
+
+    Args:
+        access_token: An installation access token.
+    Returns:
+        An iterator of (owner, repo) tuples.
+    """
+    url = f"{BASE_URL}/installation/repositories"
+    for page in _paginate(url, access_token, {"per_page": PER_PAGE}):
+        for repo in page["repositories"]:
+            yield repo["owner"]["login"], repo["name"]
+
+
+def _paginate(url: str, access_token: str, params: dict) -> Iterator:
+    """Iterate over the JSON payloads of all pages of a paginated resource,
+    following the next links in the Link headers of the responses.
+    """
+    headers = {
+        **_create_auth_headers(access_token),
+        "Accept": "application/vnd.github.machine-man-preview+json",
+    }
+    while url:
+        req = _get_session().get(url, headers=headers, params=params)
+        if req.status_code != 200:
+            raise APIError(f"could not list {url}: {req.status_code}", req.status_code)
+        yield req.json()
+        url = req.links.get("next", {}).get("url")
+        # the next link already contains the query parameters
+        params = None
+
+
+@metrics.timed("get_file_contents")
 def get_file_contents(owner: str, repo: str, filepath: str, access_token: str) -> str:
     """Fetch the contents of a file in the repo.
 
@@ -112,14 +657,37 @@ def get_file_contents(owner: str, repo: str, filepath: str, access_token: str) -
     Returns:
         The contents of the the specified file.
     """
+    req = _get_contents(owner, repo, filepath, access_token)
+    return _decode_contents(req.json(), owner, repo, filepath)
+
+
+def _get_contents(
+    owner: str,
+    repo: str,
+    filepath: str,
+    access_token: str,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+):
+    """Request the contents of a file in the repo, conditionally on the file
+    having changed if an ETag or Last-Modified timestamp is given.
+    """
     headers = {
         **_create_auth_headers(access_token),
         "Content-Type": "application/vnd.github.VERSION.raw",
     }
-    url = _allowed_labels_url(owner, repo)
-    req = requests.get(url, headers=headers)
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    url = _contents_url(owner, repo, filepath)
+    return _get_session().get(url, headers=headers)
+
+
+def _decode_contents(data: Optional[dict], owner: str, repo: str, filepath: str) -> str:
+    """Decode the file contents in a JSON payload from the contents API."""
     try:
-        content = req.json()["content"]
-    except KeyError:
+        content = data["content"]
+    except (KeyError, TypeError):
         raise APIError(f"could not fetch {filepath} from {owner}/{repo}")
     return base64.b64decode(content).decode(encoding=sys.getdefaultencoding())
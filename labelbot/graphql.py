@@ -0,0 +1,229 @@
+"""Setting labels with the GitHub GraphQL API.
+
+With the REST API, labeling an issue takes a request for the .allowed-labels
+file and one to add the labels. With the GraphQL API, the .allowed-labels
+blob, the current labels of the issue and the ids of the requested labels
+are fetched with a single query, and the labels are added with a single
+mutation. The GraphQL API is used by the event handler if the
+``LABELBOT_API`` environment variable is set to ``graphql``.
+
+GraphQL can only add labels that already exist in a repo. As the query
+resolves the requested labels in the repo, it serves as the label catalog of
+:py:mod:`labelbot.github_api`, and allowed labels that do not exist in the
+repo are skipped.
+
+.. module:: graphql
+    :synopsis: Setting labels with the GitHub GraphQL API.
+"""
+import collections
+import functools
+import json
+from typing import Dict, Iterable, List
+
+from labelbot import github_api
+from labelbot import metrics
+from labelbot import parse
+
+# revision expression of the .allowed-labels file on the default branch
+ALLOWED_LABELS_EXPRESSION = f"HEAD:{github_api.ALLOWED_LABELS_FILE}"
+
+_QUERY = """query($owner: String!, $repo: String!, $number: Int!, $expression: String!%s) {
+  repository(owner: $owner, name: $repo) {
+    allowedLabels: object(expression: $expression) {
+      ... on Blob { oid text }
+    }
+    issue(number: $number) {
+      id
+      labels(first: %d) { nodes { name } }
+    }%s
+  }
+}"""
+
+_ADD_LABELS_MUTATION = """mutation($labelableId: ID!, $labelIds: [ID!]!) {
+  addLabelsToLabelable(input: {labelableId: $labelableId, labelIds: $labelIds}) {
+    clientMutationId
+  }
+}"""
+
+IssueLabelState = collections.namedtuple(
+    "IssueLabelState", "allowed_labels issue_id current_labels label_ids"
+)
+IssueLabelState.__doc__ = """The labeling state of an issue.
+
+Attributes:
+    allowed_labels: A matcher for the .allowed-labels file of the repo.
+    issue_id: The GraphQL node id of the issue.
+    current_labels: The labels that are currently set on the issue.
+    label_ids: Casefolded label name -> node id, for the requested labels
+        that exist in the repo.
+"""
+
+
+def set_allowed_labels(
+    owner: str,
+    repo: str,
+    issue_nr: int,
+    issue_body: str,
+    current_labels: List[str],
+    access_token: str,
+) -> bool:
+    """GraphQL variant of :py:func:`labelbot.github_api.set_allowed_labels`.
+
+    The labels currently set on the issue are taken from the GraphQL query,
+    which is more recent than ``current_labels``. The latter is only used to
+    skip looking up labels that are already set. Allowed labels that do not
+    exist in the repo are skipped.
+
+    Args:
+        owner: User/Organization that owns the repo.
+        repo: Name of the repo.
+        issue_nr: Number of the issue.
+        issue_body: Body of the issue, possibly containing label markup.
+        current_labels: Labels that are set on the issue according to the
+            webhook.
+        access_token: An installation access token for the repo.
+    Returns:
+        True if the labels were added or there were none to add.
+    """
+    wanted_labels = [
+        label
+        for label in parse.parse_wanted_labels(issue_body)
+        if label not in current_labels
+    ]
+    if not wanted_labels:
+        return True
+
+    state = get_issue_label_state(owner, repo, issue_nr, wanted_labels, access_token)
+    labels_to_add = github_api.select_labels_to_add(
+        state.allowed_labels, issue_body, state.current_labels
+    )
+    if not labels_to_add:
+        return True
+
+    label_ids = [
+        state.label_ids[label.casefold()]
+        for label in sorted(labels_to_add)
+        if label.casefold() in state.label_ids
+    ]
+    if not label_ids:
+        return True
+    return add_labels_by_id(state.issue_id, label_ids, access_token)
+
+
+@metrics.timed("graphql_query")
+def get_issue_label_state(
+    owner: str, repo: str, issue_nr: int, labels: Iterable[str], access_token: str
+) -> IssueLabelState:
+    """Fetch the .allowed-labels file of a repo, the current labels of an
+    issue and the ids of the given labels with a single query.
+
+    Args:
+        owner: User/Organization that owns the repo.
+        repo: Name of the repo.
+        issue_nr: Number of the issue.
+        labels: Names of the labels to look up the ids of.
+        access_token: An installation access token for the repo.
+    Returns:
+        The labeling state of the issue.
+    Raises:
+        github_api.APIError: If the query fails, or the repo has no
+            .allowed-labels file.
+    """
+    labels = list(labels)
+    variables = {
+        "owner": owner,
+        "repo": repo,
+        "number": issue_nr,
+        "expression": ALLOWED_LABELS_EXPRESSION,
+    }
+    variables.update((f"label{i}", label) for i, label in enumerate(labels))
+    repository = _post(_query(len(labels)), variables, access_token)["repository"]
+
+    blob = repository["allowedLabels"]
+    if not blob or blob.get("text") is None:
+        raise github_api.APIError(
+            f"could not fetch {github_api.ALLOWED_LABELS_FILE} from {owner}/{repo}"
+        )
+    allowed_labels = parse.compile_allowed_labels_by_sha(
+        blob["oid"],
+        lambda: blob["text"],
+        github_api.ALLOWED_LABELS_CACHE.case_insensitive,
+    )
+
+    label_ids = {}  # type: Dict[str, str]
+    for i in range(len(labels)):
+        node = repository.get(f"label{i}")
+        if node is not None:
+            label_ids[node["name"].casefold()] = node["id"]
+
+    issue = repository["issue"]
+    if issue is None:
+        raise github_api.APIError(f"could not find {owner}/{repo}#{issue_nr}")
+    return IssueLabelState(
+        allowed_labels=allowed_labels,
+        issue_id=issue["id"],
+        current_labels=[node["name"] for node in issue["labels"]["nodes"]],
+        label_ids=label_ids,
+    )
+
+
+@metrics.timed("graphql_add_labels")
+def add_labels_by_id(
+    labelable_id: str, label_ids: List[str], access_token: str
+) -> bool:
+    """Add labels to an issue with a single mutation, keeping any labels that
+    are already set.
+
+    Args:
+        labelable_id: The GraphQL node id of the issue.
+        label_ids: The node ids of the labels to add.
+        access_token: An installation access token for the repo.
+    Returns:
+        True if the labels were added.
+    """
+    variables = {"labelableId": labelable_id, "labelIds": label_ids}
+    try:
+        _post(_ADD_LABELS_MUTATION, variables, access_token)
+    except github_api.APIError:
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=32)
+def _query(label_count: int) -> str:
+    """Return the query for the labeling state of an issue, with one aliased
+    label lookup per requested label.
+    """
+    declarations = "".join(f", $label{i}: String!" for i in range(label_count))
+    lookups = "".join(
+        f"\n    label{i}: label(name: $label{i}) {{ id name }}"
+        for i in range(label_count)
+    )
+    return _QUERY % (declarations, github_api.PER_PAGE, lookups)
+
+
+def _graphql_url() -> str:
+    return f"{github_api.BASE_URL}/graphql"
+
+
+def _post(query: str, variables: dict, access_token: str) -> dict:
+    """Send a GraphQL request, and return the data of the response.
+
+    Raises:
+        github_api.APIError: If the request fails or the response has errors.
+    """
+    headers = github_api._create_auth_headers(access_token)
+    payload = json.dumps({"query": query, "variables": variables})
+    req = github_api._get_session().post(_graphql_url(), headers=headers, data=payload)
+    try:
+        data = req.json()
+    except ValueError:
+        data = None
+    if req.status_code != 200 or not isinstance(data, dict):
+        raise github_api.APIError(f"GraphQL request failed with {req.status_code}")
+    if data.get("errors") or not data.get("data"):
+        messages = "; ".join(
+            error.get("message", "unknown error") for error in data.get("errors", [])
+        )
+        raise github_api.APIError(f"GraphQL request failed: {messages}")
+    return data["data"]
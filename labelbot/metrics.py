@@ -0,0 +1,317 @@
+"""Per-event timing instrumentation and structured metrics.
+
+Each handled webhook is wrapped in an :py:func:`event`, during which the
+time spent in each stage of the pipeline (see :py:func:`stage` and
+:py:func:`timed`) and counters such as the amount of GitHub API calls and
+bytes transferred are recorded. When the event ends, one record is emitted
+as a single line on stdout, either as plain JSON or in the CloudWatch
+Embedded Metric Format, which CloudWatch turns into metrics when it is
+written to the log of a Lambda function.
+
+Output is selected with the ``LABELBOT_METRICS`` environment variable
+(``json`` or ``emf``), and is disabled by default. When disabled, and no
+tracers are registered, instrumented functions only pay for a single
+context variable lookup.
+
+The first record of each process is marked as a cold start, and includes
+the time from the start of the import of labelbot to the event.
+
+Tracing spans can be added with :py:func:`add_tracer`, which takes a function
+that returns a context manager for a span name. For example, with
+OpenTelemetry: ``metrics.add_tracer(tracer.start_as_current_span)``.
+
+.. module:: metrics
+    :synopsis: Per-event timing instrumentation and structured metrics.
+"""
+import collections
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, ContextManager, Dict, List, Optional
+
+import labelbot
+
+try:
+    import contextvars
+except ImportError:  # Python 3.6
+    contextvars = None
+
+NAMESPACE = "labelbot"
+OUTPUT_FORMATS = ("json", "emf")
+
+
+class EventRecord:
+    """Timings, counters and properties recorded during a single event."""
+
+    def __init__(self, name: str, dimensions: Dict[str, str]):
+        """
+        Args:
+            name: Name of the event.
+            dimensions: Dimensions to group the metrics of the event by.
+        """
+        self.name = name
+        self.dimensions = dimensions
+        self.properties = {}  # type: Dict[str, Any]
+        # stage -> [calls, seconds]
+        self.stages = collections.OrderedDict()  # type: Dict[str, List]
+        self.counters = collections.Counter()
+        self.timestamp = time.time()
+        self.duration = 0.0
+        # seconds from the start of the package import to the event, if the
+        # event is the first one in the process
+        self.init_duration = None  # type: Optional[float]
+        self._start = time.perf_counter()
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        calls_and_seconds = self.stages.setdefault(name, [0, 0.0])
+        calls_and_seconds[0] += 1
+        calls_and_seconds[1] += seconds
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self._start
+
+    def to_json(self) -> dict:
+        """Return the record as a plain JSON object."""
+        data = {
+            "event": self.name,
+            "timestamp": self.timestamp,
+            "duration_ms": self.duration * 1000,
+            "cold_start": self.init_duration is not None,
+        }
+        if self.init_duration is not None:
+            data["init_ms"] = self.init_duration * 1000
+        data.update(self.dimensions)
+        data.update(self.properties)
+        data["stages"] = {
+            name: {"calls": calls, "ms": seconds * 1000}
+            for name, (calls, seconds) in self.stages.items()
+        }
+        data["counters"] = dict(self.counters)
+        return data
+
+    def to_emf(self) -> dict:
+        """Return the record in the CloudWatch Embedded Metric Format."""
+        values = {
+            "duration": self.duration * 1000,
+            "cold_start": int(self.init_duration is not None),
+        }
+        units = {"duration": "Milliseconds", "cold_start": "Count"}
+        if self.init_duration is not None:
+            values["init_time"] = self.init_duration * 1000
+            units["init_time"] = "Milliseconds"
+        for name, (_, seconds) in self.stages.items():
+            values[f"{name}_time"] = seconds * 1000
+            units[f"{name}_time"] = "Milliseconds"
+        for name, value in self.counters.items():
+            values[name] = value
+            units[name] = "Bytes" if name.endswith("_bytes") else "Count"
+
+        dimensions = {"Event": self.name, **self.dimensions}
+        return {
+            "_aws": {
+                "Timestamp": int(self.timestamp * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": NAMESPACE,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": [
+                            {"Name": name, "Unit": unit} for name, unit in units.items()
+                        ],
+                    }
+                ],
+            },
+            **dimensions,
+            **self.properties,
+            **values,
+        }
+
+
+class _ThreadLocalVar:
+    """A minimal stand-in for a context variable on Python 3.6, where
+    asyncio tasks in the same thread share the current record.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self):
+        return getattr(self._local, "value", None)
+
+    def set(self, value):
+        token = self.get()
+        self._local.value = value
+        return token
+
+    def reset(self, token):
+        self._local.value = token
+
+
+def _write_line(line: str) -> None:
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+_current = (
+    contextvars.ContextVar("labelbot_metrics_record", default=None)
+    if contextvars is not None
+    else _ThreadLocalVar()
+)
+_cold_start = True
+_output_format = None  # type: Optional[str]
+_sink = _write_line
+_tracers = []  # type: List[Callable[[str], ContextManager]]
+
+
+def configure(
+    output_format: Optional[str], sink: Optional[Callable[[str], None]] = None
+) -> None:
+    """Select the output format of the metrics records.
+
+    Args:
+        output_format: ``json``, ``emf``, or None to disable the records.
+        sink: Function that writes a record line. Defaults to writing to
+            stdout.
+    """
+    global _output_format, _sink
+    if output_format is not None and output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"unknown metrics format: {output_format}")
+    _output_format = output_format
+    _sink = sink or _write_line
+
+
+def add_tracer(tracer: Callable[[str], ContextManager]) -> None:
+    """Register a tracer, which is called with the name of each event and
+    stage, and returns a context manager that spans it.
+    """
+    _tracers.append(tracer)
+
+
+def remove_tracer(tracer: Callable[[str], ContextManager]) -> None:
+    _tracers.remove(tracer)
+
+
+@contextlib.contextmanager
+def event(name: str, **dimensions: str):
+    """Record the metrics of an event, and emit them when the event ends.
+
+    Args:
+        name: Name of the event.
+        dimensions: Dimensions to group the metrics of the event by.
+    Yields:
+        The record of the event, or None if output is disabled.
+    """
+    if _output_format is None and not _tracers:
+        yield None
+        return
+
+    global _cold_start
+    record = EventRecord(name, dimensions) if _output_format is not None else None
+    if record is not None and _cold_start:
+        _cold_start = False
+        record.init_duration = record._start - labelbot.IMPORT_STARTED_AT
+    token = _current.set(record)
+    try:
+        with _spans(name):
+            yield record
+    finally:
+        _current.reset(token)
+        if record is not None:
+            record.finish()
+            _emit(record)
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Time a stage of the current event.
+
+    Args:
+        name: Name of the stage.
+    """
+    record = _current.get()
+    if record is None and not _tracers:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        with _spans(name):
+            yield
+    finally:
+        if record is not None:
+            record.add_stage(name, time.perf_counter() - start)
+
+
+def timed(name: str) -> Callable:
+    """Decorate a function to time each call as a stage of the current
+    event.
+
+    Args:
+        name: Name of the stage.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None and not _tracers:
+                return func(*args, **kwargs)
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def increment(name: str, value: int = 1) -> None:
+    """Increment a counter of the current event, if any."""
+    record = _current.get()
+    if record is not None:
+        record.counters[name] += value
+
+
+def set_property(name: str, value: Any) -> None:
+    """Set a property of the current event, if any. Properties are included
+    in the record, but are not metrics.
+    """
+    record = _current.get()
+    if record is not None:
+        record.properties[name] = value
+
+
+def record_request(status_code: int, bytes_sent: int, bytes_received: int) -> None:
+    """Count a GitHub API request in the current event, if any.
+
+    Args:
+        status_code: Status code of the response.
+        bytes_sent: Size of the request body.
+        bytes_received: Size of the response body.
+    """
+    record = _current.get()
+    if record is None:
+        return
+    record.counters["github_calls"] += 1
+    record.counters["github_sent_bytes"] += bytes_sent
+    record.counters["github_received_bytes"] += bytes_received
+    if status_code >= 400:
+        record.counters["github_errors"] += 1
+
+
+@contextlib.contextmanager
+def _spans(name: str):
+    with contextlib.ExitStack() as stack:
+        for tracer in _tracers:
+            stack.enter_context(tracer(name))
+        yield
+
+
+def _emit(record: EventRecord) -> None:
+    data = record.to_emf() if _output_format == "emf" else record.to_json()
+    _sink(json.dumps(data, separators=(",", ":"), default=str))
+
+
+_configured_format = os.getenv("LABELBOT_METRICS", "").lower()
+configure(_configured_format if _configured_format in OUTPUT_FORMATS else None)
@@ -3,14 +3,58 @@
 .. module:: parse
     :synopsis: Functions for extracting info from files.
 """
+import fnmatch
+import hashlib
 import re
+import sys
 
-from typing import List
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Pattern,
+    Tuple,
+    Union,
+)
+
+from labelbot import cache
 
 COMMENT_CHAR = "#"
 # maybe need an OS independent match here
 ALLOWED_LABEL_SEP = "\n"
 
+# GitHub caps issue bodies at 65536 characters
+MAX_SCAN_LENGTH = 65536
+# maximum amount of label tokens to scan for in a single text
+MAX_LABEL_TOKENS = 100
+# approximate maximum amount of bytes used by cached, compiled allow-lists
+MATCHER_CACHE_SIZE = 8 * 1024 * 1024
+
+# a label token cannot span lines, so a scan for the closing backtick never
+# runs past the end of the line
+_LABEL_TOKEN = r":label:`([^`\n]*)`"
+# fences of code blocks, which may be indented by up to three spaces
+_FENCE_AT_START = r" {0,3}(```|~~~)"
+_FENCE = r"\n" + _FENCE_AT_START
+
+
+def _compile(pattern: str) -> Dict[type, Pattern]:
+    return {str: re.compile(pattern), bytes: re.compile(pattern.encode("ascii"))}
+
+
+_LABEL_TOKEN_PATTERNS = _compile(_LABEL_TOKEN)
+_FENCE_AT_START_PATTERNS = _compile(_FENCE_AT_START)
+_FENCE_PATTERNS = _compile(_FENCE)
+_GLOB_CHARS = re.compile(r"[*?[]")
+# prefix of .allowed-labels entries that are glob patterns
+GLOB_PREFIX = "glob:"
+_CLOSING_FENCE_PATTERNS = {
+    fence: _compile(r"\n {0,3}" + fence) for fence in ("```", "~~~")
+}
+
 
 def parse_wanted_labels(text: str) -> List[str]:
     """Extract the labels defined by :label:`LABEL` tokens in a string.
@@ -18,10 +62,73 @@ def parse_wanted_labels(text: str) -> List[str]:
     Args:
         text: Typically an issue body with label markup.
     Returns:
-        A list of extracted labels.
+        A list of extracted labels, without duplicates.
+    """
+    return scan_wanted_labels(text)
+
+
+def scan_wanted_labels(
+    text: Union[str, bytes],
+    skip_code_blocks: bool = False,
+    max_tokens: int = MAX_LABEL_TOKENS,
+    max_length: int = MAX_SCAN_LENGTH,
+) -> List[str]:
+    """Extract the labels defined by :label:`LABEL` tokens in a single pass
+    over a string.
+
+    The scan runs in linear time in the length of the text, and stops after
+    ``max_tokens`` tokens or ``max_length`` characters, whichever comes
+    first.
+
+    Args:
+        text: Typically an issue body with label markup, as a str or as UTF-8
+            encoded bytes.
+        skip_code_blocks: If True, tokens in fenced code blocks are ignored.
+        max_tokens: Maximum amount of tokens to scan for.
+        max_length: Maximum amount of characters (or bytes) to scan.
+    Returns:
+        A list of extracted labels in order of first occurrence, without
+        duplicates.
+    """
+    kind = bytes if isinstance(text, bytes) else str
+    code_blocks = _code_block_spans(text, max_length) if skip_code_blocks else iter(())
+    code_block = next(code_blocks, None)
+    labels = {}  # type: Dict[str, None]
+    tokens = 0
+    for match in _LABEL_TOKEN_PATTERNS[kind].finditer(text, 0, max_length):
+        while code_block is not None and code_block[1] <= match.start():
+            code_block = next(code_blocks, None)
+        if code_block is not None and code_block[0] <= match.start():
+            continue
+        label = match.group(1)
+        labels.setdefault(label.decode("utf8") if kind is bytes else label, None)
+        tokens += 1
+        if tokens >= max_tokens:
+            break
+    return list(labels)
+
+
+def _code_block_spans(text: Union[str, bytes], end: int) -> Iterator[Tuple[int, int]]:
+    """Lazily yield the (start, end) spans of the fenced code blocks in a
+    text, in order. An unclosed code block runs to the end of the text.
+
+    Fences are searched for with patterns that start with a literal, which
+    lets the regex engine skip ahead quickly over text without code blocks.
     """
-    label_pattern = ":label:`(.*?)`"
-    return re.findall(label_pattern, text, re.MULTILINE)
+    kind = bytes if isinstance(text, bytes) else str
+    opening = _FENCE_AT_START_PATTERNS[kind].match(text, 0, end)
+    if opening is None:
+        opening = _FENCE_PATTERNS[kind].search(text, 0, end)
+    while opening is not None:
+        fence = opening.group(1)
+        if kind is bytes:
+            fence = fence.decode("ascii")
+        closing = _CLOSING_FENCE_PATTERNS[fence][kind].search(text, opening.end(), end)
+        if closing is None:
+            yield opening.start(), end
+            return
+        yield opening.start(), closing.end()
+        opening = _FENCE_PATTERNS[kind].search(text, closing.end(), end)
 
 
 def parse_allowed_labels(text: str) -> List[str]:
@@ -39,3 +146,140 @@ def parse_allowed_labels(text: str) -> List[str]:
         for stripped_line in (line.strip() for line in text.split(ALLOWED_LABEL_SEP))
         if not stripped_line.startswith(COMMENT_CHAR) and stripped_line
     ]
+
+
+class AllowListMatcher:
+    """A compiled .allowed-labels file, for matching requested labels against.
+
+    Every entry is matched exactly with a hash lookup, so labels that contain
+    glob characters mean what they always have. Entries that start with
+    ``glob:`` are also glob patterns (see :py:mod:`fnmatch`). Patterns of the
+    form ``glob:prefix*`` are matched with a hash lookup per prefix length,
+    and all other patterns are combined into a single regex. Matching a label
+    therefore costs a constant amount of lookups in the size of the
+    allow-list, unless it contains general glob patterns.
+    """
+
+    def __init__(self, entries: Iterable[str], case_insensitive: bool = False):
+        """
+        Args:
+            entries: Allowed labels, and glob patterns prefixed with
+                ``glob:``.
+            case_insensitive: If True, labels are matched regardless of case.
+        """
+        self.entries = list(entries)
+        self.case_insensitive = case_insensitive
+        # normalized label -> label as spelled in the allow-list
+        self._exact = {}  # type: Dict[str, str]
+        self._prefixes = set()
+        patterns = []
+        for entry in self.entries:
+            self._exact.setdefault(self.normalize(entry), entry)
+            if not entry.startswith(GLOB_PREFIX):
+                continue
+            pattern = self.normalize(entry[len(GLOB_PREFIX) :])
+            if pattern.endswith("*") and not _GLOB_CHARS.search(pattern[:-1]):
+                self._prefixes.add(pattern[:-1])
+            else:
+                patterns.append(fnmatch.translate(pattern))
+        self._prefix_lengths = sorted({len(prefix) for prefix in self._prefixes})
+        self._pattern = re.compile("|".join(patterns)) if patterns else None
+        self.memory_size = self._estimate_memory_size()
+
+    def _estimate_memory_size(self) -> int:
+        """Estimate the memory used by the matcher in bytes. Strings shared
+        between the containers are counted once per container, and the
+        compiled regex is estimated from the length of its source.
+        """
+        size = sys.getsizeof(self) + sys.getsizeof(self.entries)
+        size += sum(sys.getsizeof(entry) for entry in self.entries)
+        size += sys.getsizeof(self._exact) + sum(map(sys.getsizeof, self._exact))
+        size += sys.getsizeof(self._prefixes) + sum(map(sys.getsizeof, self._prefixes))
+        if self._pattern is not None:
+            size += 4 * sys.getsizeof(self._pattern.pattern)
+        return size
+
+    def normalize(self, label: str) -> str:
+        """Return the form of a label that is used for comparisons."""
+        return label.casefold() if self.case_insensitive else label
+
+    def match(self, label: str) -> Optional[str]:
+        """Match a label against the allow-list.
+
+        Args:
+            label: A requested label.
+        Returns:
+            The label as spelled in the allow-list if it is allowed by an
+            exact entry, the label itself if it is allowed by a glob pattern,
+            or None if it is not allowed.
+        """
+        normalized = self.normalize(label)
+        allowed = self._exact.get(normalized)
+        if allowed is not None:
+            return allowed
+        for length in self._prefix_lengths:
+            if length > len(normalized):
+                break
+            if normalized[:length] in self._prefixes:
+                return label
+        if self._pattern is not None and self._pattern.match(normalized):
+            return label
+        return None
+
+    def __contains__(self, label: str) -> bool:
+        return self.match(label) is not None
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def blob_sha(content: bytes) -> str:
+    """Return the git blob SHA of file contents, which is the ``sha`` that the
+    GitHub contents API returns for a file.
+    """
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+MATCHER_CACHE = cache.LRUCache(MATCHER_CACHE_SIZE, sizeof=lambda m: m.memory_size)
+
+
+def compile_allowed_labels(
+    text: str, case_insensitive: bool = False
+) -> AllowListMatcher:
+    """Compile the contents of a .allowed-labels file into a matcher, or
+    reuse the matcher of an identical file from MATCHER_CACHE.
+
+    Args:
+        text: The contents of a .allowed-labels file.
+        case_insensitive: If True, labels are matched regardless of case.
+    Returns:
+        A matcher for the allowed labels.
+    """
+    sha = blob_sha(text.encode("utf8"))
+    return compile_allowed_labels_by_sha(sha, lambda: text, case_insensitive)
+
+
+def compile_allowed_labels_by_sha(
+    sha: str, load_text: Callable[[], str], case_insensitive: bool = False
+) -> AllowListMatcher:
+    """Get the compiled .allowed-labels file with the given git blob SHA.
+    Compiled matchers are cached in MATCHER_CACHE by SHA, so repos with
+    identical allow-lists share a single matcher, and the contents of a file
+    are only loaded if no identical file has been compiled.
+
+    Args:
+        sha: The git blob SHA of the file.
+        load_text: Function that returns the contents of the file.
+        case_insensitive: If True, labels are matched regardless of case.
+    Returns:
+        A matcher for the allowed labels.
+    """
+    key = (sha, case_insensitive)
+    matcher = MATCHER_CACHE.get(key)
+    if matcher is None:
+        matcher = AllowListMatcher(parse_allowed_labels(load_text()), case_insensitive)
+        MATCHER_CACHE.put(key, matcher)
+    return matcher
@@ -0,0 +1,117 @@
+"""Lazy access to the fields of webhook payloads.
+
+Issue webhooks carry the full issue, repository and sender objects, of which
+labelbot only needs a handful of fields. A :py:class:`WebhookPayload` decodes
+the body on first access to a field, with ``orjson`` if it is installed and
+with the standard library otherwise. The action of a webhook is read without
+decoding the body at all if it is the first key of the payload, as it is in
+the webhooks that GitHub sends, so that ignored events are never decoded.
+
+.. module:: payload
+    :synopsis: Lazy access to the fields of webhook payloads.
+"""
+import json
+import re
+from typing import Callable, List, Optional, Union
+
+# the decoder, selected on first use to keep orjson out of cold starts that
+# never decode a payload
+_loads = None  # type: Optional[Callable[[Union[str, bytes]], dict]]
+
+# matches the action of a payload if it is its first key, and is a plain
+# string without escape sequences
+_LEADING_ACTION = {
+    str: re.compile(r'\s*\{\s*"action"\s*:\s*"([a-z_]*)"'),
+    bytes: re.compile(rb'\s*\{\s*"action"\s*:\s*"([a-z_]*)"'),
+}
+
+
+def decode(body: Union[str, bytes]) -> dict:
+    """Decode a JSON webhook body, with the fastest available decoder."""
+    global _loads
+    if _loads is None:
+        try:
+            import orjson
+
+            _loads = orjson.loads
+        except ImportError:
+            _loads = json.loads
+    return _loads(body)
+
+
+class WebhookPayload:
+    """The body of a webhook, which is decoded on first access to a field
+    other than :py:attr:`action`.
+    """
+
+    def __init__(self, body: Union[str, bytes]):
+        """
+        Args:
+            body: The raw JSON body of the webhook.
+        """
+        self.body = body
+        self._data = None  # type: Optional[dict]
+
+    @property
+    def data(self) -> dict:
+        """The decoded payload."""
+        if self._data is None:
+            self._data = decode(self.body)
+        return self._data
+
+    @property
+    def is_decoded(self) -> bool:
+        return self._data is not None
+
+    @property
+    def action(self) -> Optional[str]:
+        if self._data is None:
+            kind = bytes if isinstance(self.body, bytes) else str
+            match = _LEADING_ACTION[kind].match(self.body)
+            if match is not None:
+                action = match.group(1)
+                return action.decode("ascii") if kind is bytes else action
+        return self.data.get("action")
+
+    @property
+    def is_issue_event(self) -> bool:
+        return "issue" in self.data
+
+    @property
+    def installation_id(self) -> int:
+        return self.data["installation"]["id"]
+
+    @property
+    def owner(self) -> str:
+        return self.data["repository"]["owner"]["login"]
+
+    @property
+    def repo(self) -> str:
+        return self.data["repository"]["name"]
+
+    @property
+    def issue_nr(self) -> int:
+        return self.data["issue"]["number"]
+
+    @property
+    def issue_body(self) -> str:
+        """The body of the issue, or an empty string if it has none."""
+        return self.data["issue"]["body"] or ""
+
+    @property
+    def label_names(self) -> List[str]:
+        """The names of the labels that are set on the issue."""
+        return [label["name"] for label in self.data["issue"]["labels"]]
+
+    @property
+    def has_changes(self) -> bool:
+        return "changes" in self.data
+
+    @property
+    def previous_issue_body(self) -> str:
+        """The body of the issue before an ``edited`` event. It is the same as
+        :py:attr:`issue_body` if the edit did not change the body.
+        """
+        changes = self.data.get("changes") or {}
+        previous = changes.get("body", {}).get("from", self.issue_body)
+        return previous or ""
@@ -0,0 +1,273 @@
+"""Pacing of GitHub API requests based on the rate limit headers.
+
+GitHub reports the remaining request budget of each access token in the
+``X-RateLimit-Remaining`` and ``X-RateLimit-Reset`` headers, and asks clients
+that hit a secondary rate limit to back off with ``Retry-After``. The
+:py:class:`RateLimiter` tracks this per token, and delays requests when the
+budget is close to exhausted instead of letting them fail.
+
+Delays are capped per request, and within a :py:func:`wait_budget` also in
+total, so that a webhook fails fast instead of outliving its timeout.
+
+.. module:: ratelimit
+    :synopsis: Pacing of GitHub API requests based on rate limit headers.
+"""
+import contextlib
+import os
+import threading
+import time
+from typing import Callable, Dict, Hashable, Iterator, Mapping, Optional
+
+from labelbot import metrics
+
+try:
+    import contextvars
+except ImportError:  # Python 3.6
+    contextvars = None
+
+# when the remaining budget drops to this many requests, the remaining
+# requests are spread out evenly until the budget is reset
+RESERVE = 50
+# maximum amount of seconds to delay a single request
+MAX_WAIT = 5.0
+# seconds to back off after a secondary rate limit without a Retry-After header
+SECONDARY_LIMIT_BACKOFF = 60
+# maximum total amount of seconds to delay the requests of a single webhook
+EVENT_WAIT_BUDGET = float(os.getenv("LABELBOT_RATE_LIMIT_WAIT", "5"))
+# seconds between removals of budgets that have been reset, as every new
+# JWT and installation token gets a budget of its own
+SWEEP_INTERVAL = 60
+
+
+class _WaitBudget:
+    """Remaining seconds that requests in a :py:func:`wait_budget` may be
+    delayed.
+    """
+
+    __slots__ = ("remaining",)
+
+    def __init__(self, seconds: float):
+        self.remaining = seconds
+
+
+_wait_budget = (
+    contextvars.ContextVar("labelbot_wait_budget", default=None)
+    if contextvars is not None
+    else metrics._ThreadLocalVar()
+)
+
+
+@contextlib.contextmanager
+def wait_budget(seconds: float = EVENT_WAIT_BUDGET) -> Iterator[None]:
+    """Limit the total amount of seconds that requests made within the
+    context are delayed. Once it is spent, requests are sent without delay
+    and fail if they are rate limited.
+
+    Args:
+        seconds: The total amount of seconds.
+    """
+    token = _wait_budget.set(_WaitBudget(seconds))
+    try:
+        yield
+    finally:
+        _wait_budget.reset(token)
+
+
+class _Budget:
+    """Rate limit state of a single access token."""
+
+    __slots__ = ("remaining", "reset", "blocked_until")
+
+    def __init__(self):
+        self.remaining = None  # type: Optional[int]
+        self.reset = 0.0
+        self.blocked_until = 0.0
+
+
+class RateLimiter:
+    """Tracks the rate limit budget of each access token from response
+    headers, and computes how long requests must be delayed.
+    """
+
+    def __init__(
+        self,
+        reserve: int = RESERVE,
+        max_wait: float = MAX_WAIT,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        Args:
+            reserve: Budget at which requests start being paced.
+            max_wait: Maximum amount of seconds to delay a single request.
+            clock: Function returning the current time in seconds since the
+                epoch.
+            sleep: Function that sleeps for the given amount of seconds.
+        """
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._budgets = {}  # type: Dict[Hashable, _Budget]
+        self._next_sweep = 0.0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.throttled = 0
+
+    def acquire(self, key: Hashable) -> float:
+        """Reserve one request from the budget of the key, and return how long
+        the request must be delayed. The delay is not waited out, see
+        :py:meth:`wait` for that.
+
+        Args:
+            key: The key of the budget, typically the access token.
+        Returns:
+            Seconds to delay the request, at most :py:meth:`max_delay`.
+        """
+        with self._lock:
+            budget = self._budgets.get(key)
+            if budget is None:
+                return 0.0
+
+            now = self._clock()
+            delay = 0.0
+            if budget.blocked_until > now:
+                delay = budget.blocked_until - now
+            elif budget.remaining is not None and budget.reset > now:
+                if budget.remaining <= 0:
+                    delay = budget.reset - now
+                elif budget.remaining <= self.reserve:
+                    delay = (budget.reset - now) / budget.remaining
+                budget.remaining -= 1
+
+            delay = min(delay, self.max_delay())
+            if delay > 0:
+                self.waits += 1
+                self.wait_seconds += delay
+                event_budget = _wait_budget.get()
+                if event_budget is not None:
+                    event_budget.remaining -= delay
+            return delay
+
+    def max_delay(self) -> float:
+        """Return the maximum amount of seconds to delay the next request,
+        which is ``max_wait`` or what remains of the current
+        :py:func:`wait_budget`, whichever is less.
+        """
+        event_budget = _wait_budget.get()
+        if event_budget is None:
+            return self.max_wait
+        return max(0.0, min(self.max_wait, event_budget.remaining))
+
+    def wait(self, key: Hashable) -> float:
+        """Reserve one request from the budget of the key, and sleep for as
+        long as the request must be delayed.
+
+        Args:
+            key: The key of the budget, typically the access token.
+        Returns:
+            The amount of seconds slept.
+        """
+        delay = self.acquire(key)
+        if delay > 0:
+            self._sleep(delay)
+        return delay
+
+    def update(
+        self, key: Hashable, status_code: int, headers: Mapping[str, str]
+    ) -> bool:
+        """Update the budget of the key from the headers of a response.
+
+        Args:
+            key: The key of the budget, typically the access token.
+            status_code: Status code of the response.
+            headers: Headers of the response.
+        Returns:
+            True if the response indicates that the request was rate limited.
+        """
+        remaining = _int_header(headers, "X-RateLimit-Remaining")
+        reset = _int_header(headers, "X-RateLimit-Reset")
+        retry_after = _int_header(headers, "Retry-After")
+        with self._lock:
+            self._sweep()
+            budget = self._budgets.setdefault(key, _Budget())
+            if remaining is not None:
+                budget.remaining = remaining
+            if reset is not None:
+                budget.reset = float(reset)
+
+            throttled = status_code in (403, 429) and (
+                retry_after is not None or remaining == 0 or status_code == 429
+            )
+            if throttled:
+                self.throttled += 1
+                if retry_after is not None:
+                    backoff_until = self._clock() + retry_after
+                elif remaining == 0 and reset is not None:
+                    backoff_until = float(reset)
+                else:
+                    backoff_until = self._clock() + SECONDARY_LIMIT_BACKOFF
+                budget.blocked_until = max(budget.blocked_until, backoff_until)
+            return throttled
+
+    def _sweep(self) -> None:
+        """Remove the budgets that have been reset and are not blocked, as
+        they no longer delay any request. Must be called with the lock held.
+        """
+        now = self._clock()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + SWEEP_INTERVAL
+        expired = [
+            key
+            for key, budget in self._budgets.items()
+            if budget.reset <= now and budget.blocked_until <= now
+        ]
+        for key in expired:
+            del self._budgets[key]
+
+    def backoff(self, key: Hashable) -> float:
+        """Return how many seconds remain until the key may be used again
+        after being rate limited.
+
+        Args:
+            key: The key of the budget, typically the access token.
+        """
+        with self._lock:
+            budget = self._budgets.get(key)
+            if budget is None:
+                return 0.0
+            return max(0.0, budget.blocked_until - self._clock())
+
+    def stats(self) -> Dict[str, float]:
+        """Return the amount of delayed requests, the total time spent
+        waiting, the amount of rate limited responses and of tracked budgets.
+        """
+        with self._lock:
+            return {
+                "waits": self.waits,
+                "wait_seconds": self.wait_seconds,
+                "throttled": self.throttled,
+                "budgets": len(self._budgets),
+            }
+
+
+def _int_header(headers: Mapping[str, str], name: str) -> Optional[int]:
+    value = headers.get(name)
+    if not isinstance(value, str):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def request_key(headers: Optional[Mapping[str, str]]) -> Optional[str]:
+    """Return the rate limit key of a request, which is its Authorization
+    header. Requests without one share a single budget.
+    """
+    return (headers or {}).get("Authorization")
+
+
+LIMITER = RateLimiter()
@@ -0,0 +1,231 @@
+"""Self-hosted webhook server, as an alternative to AWS Lambda.
+
+The server accepts GitHub webhooks over HTTP and passes them to the same
+handler as the Lambda entry point. As it is a long-running process, the
+token, key and allowed labels caches are kept warm across requests.
+Requests are handled on a bounded pool of worker threads, and in-flight
+requests are allowed to finish when the server is stopped with SIGTERM or
+SIGINT.
+
+.. module:: server
+    :synopsis: Self-hosted webhook server.
+"""
+import argparse
+import concurrent.futures
+import http.server
+import json
+import logging
+import signal
+import threading
+from typing import Callable, List, Optional, Tuple
+
+from requests.structures import CaseInsensitiveDict
+
+from labelbot import bot
+from labelbot import singleflight
+from labelbot import work_queue
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_HOST = "0.0.0.0"
+DEFAULT_PORT = 8080
+DEFAULT_WORKERS = 16
+# GitHub caps webhook payloads at 25 MB
+MAX_BODY_SIZE = 25 * 1024 * 1024
+
+
+class WebhookRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Converts an HTTP request into an API Gateway proxy event, and the
+    returned proxy response back into an HTTP response.
+    """
+
+    server_version = "labelbot"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_BODY_SIZE:
+            self._respond(413, json.dumps("payload too large"))
+            return
+
+        event = {
+            "headers": CaseInsensitiveDict(self.headers.items()),
+            # the signature is computed over the raw body
+            "body": self.rfile.read(length),
+        }
+        try:
+            response = self.server.event_handler(event)
+        except Exception:
+            LOGGER.exception("failed to handle event")
+            self._respond(500, json.dumps("internal error"))
+            return
+        status = response.get("statusCode", response.get("statuscode", 500))
+        self._respond(status, response.get("body", ""))
+
+    def _respond(self, status: int, body: str) -> None:
+        data = body.encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        LOGGER.debug("%s - %s", self.address_string(), format % args)
+
+
+class WebhookServer(http.server.HTTPServer):
+    """An HTTP server that handles requests on a bounded pool of worker
+    threads. When all workers are busy, new connections wait in the listen
+    backlog.
+    """
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        workers: int = DEFAULT_WORKERS,
+        event_handler: Optional[Callable[[dict], dict]] = None,
+    ):
+        """
+        Args:
+            address: A (host, port) tuple to listen on.
+            workers: Maximum amount of concurrently handled requests.
+            event_handler: Function that takes an API Gateway proxy event
+                and returns a proxy response. Defaults to the Lambda handler.
+        """
+        super().__init__(address, WebhookRequestHandler)
+        self.event_handler = event_handler or (
+            lambda event: bot.lambda_handler(event, None)
+        )
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(workers)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        self._executor.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        """Stop listening, and wait for in-flight requests to finish."""
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+def serve(server: http.server.HTTPServer) -> None:
+    """Serve until SIGTERM or SIGINT is received, and then shut down
+    gracefully.
+
+    Args:
+        server: The server to run.
+    """
+
+    def stop(signum, frame):
+        LOGGER.info("received signal %d, shutting down", signum)
+        # shutdown blocks until serve_forever returns, so it can't be called
+        # from the thread running serve_forever
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    host, port = server.server_address[:2]
+    LOGGER.info("listening on %s:%d", host, port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def create_queue(spec: str, max_depth: int = work_queue.DEFAULT_MAX_DEPTH):
+    """Create a queue from a specification, which is either ``memory`` or
+    ``sqlite:PATH``.
+    """
+    if spec == "memory":
+        return work_queue.InMemoryQueue(max_depth)
+    if spec.startswith("sqlite:"):
+        return work_queue.SQLiteQueue(spec[len("sqlite:") :], max_depth)
+    raise ValueError(f"unknown queue specification: {spec}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Entry point of the labelbot-server command."""
+    parser = argparse.ArgumentParser(
+        prog="labelbot-server", description="Serve GitHub webhooks over HTTP."
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="Maximum amount of concurrently handled webhooks",
+    )
+    parser.add_argument(
+        "--queue",
+        help="Acknowledge webhooks with 202 and process them from a queue, "
+        "either 'memory' or 'sqlite:PATH'",
+    )
+    parser.add_argument(
+        "--queue-depth",
+        type=int,
+        default=work_queue.DEFAULT_MAX_DEPTH,
+        help="Maximum amount of queued webhooks, beyond which 503 is returned",
+    )
+    parser.add_argument(
+        "--queue-workers",
+        type=int,
+        default=work_queue.DEFAULT_WORKERS,
+        help="Amount of threads processing queued webhooks",
+    )
+    parser.add_argument(
+        "--coalesce-window",
+        type=float,
+        default=0,
+        help="Seconds during which queued webhooks for the same issue are "
+        "merged into one (requires --queue)",
+    )
+    args = parser.parse_args(argv)
+    if args.coalesce_window and not args.queue:
+        parser.error("--coalesce-window requires --queue")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    # the process keeps running between webhooks, so cached tokens and
+    # allow-lists can be refreshed in the background
+    singleflight.BACKGROUND_REFRESH = True
+
+    if not args.queue:
+        serve(WebhookServer((args.host, args.port), args.workers))
+        return
+
+    event_queue = create_queue(args.queue, args.queue_depth)
+    if args.coalesce_window:
+        event_queue = work_queue.CoalescingQueue(event_queue, args.coalesce_window)
+    processor = work_queue.QueueProcessor(
+        event_queue,
+        bot.process_queued_event,
+        args.queue_workers,
+    )
+    processor.start()
+    try:
+        serve(
+            WebhookServer(
+                (args.host, args.port),
+                args.workers,
+                bot.make_queued_handler(event_queue),
+            )
+        )
+    finally:
+        if args.coalesce_window:
+            event_queue.close()
+            LOGGER.info("coalescing stats: %s", event_queue.stats())
+        processor.stop(drain=args.queue == "memory")
+        LOGGER.info("queue stats: %s", processor.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Deduplication of concurrent fetches of the same value.
+
+When a burst of webhooks for the same installation or repo misses a cache,
+each of them would otherwise fetch the same access token or .allowed-labels
+file in parallel. A :py:class:`SingleFlight` (for threads) or
+:py:class:`AsyncSingleFlight` (for asyncio) makes concurrent calls for the
+same key share a single in-flight call, whose result (or exception) is
+returned to all of them.
+
+Both can also refresh a key in the background, which lets callers refresh a
+cached value that is about to expire without waiting for it. Background
+refreshes are only started if :py:data:`BACKGROUND_REFRESH` is set, which
+long-running processes such as the webhook server do. AWS Lambda freezes the
+process once the handler returns, which would suspend a refresh mid-request
+and leave it in flight for the next webhook to wait for. ``asyncio`` is
+only imported when an :py:class:`AsyncSingleFlight` is used, as it is slow to
+import.
+
+.. module:: singleflight
+    :synopsis: Deduplication of concurrent fetches of the same value.
+"""
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+LOGGER = logging.getLogger(__name__)
+
+# if true, refresh() starts background calls, otherwise it does nothing
+BACKGROUND_REFRESH = False
+
+
+class _Call:
+    """An in-flight call, and its outcome once it is done."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None  # type: BaseException
+
+
+class SingleFlight:
+    """Shares the result of a call among all threads that make a call with
+    the same key while it is in flight.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # type: Dict[Hashable, _Call]
+        self.calls = 0
+        self.shared = 0
+        self.refreshes = 0
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """Call the function, unless a call with the same key is in flight, in
+        which case its result is awaited and returned instead.
+
+        Args:
+            key: The key of the call.
+            func: The function to call.
+        Returns:
+            The return value of the call.
+        Raises:
+            Any exception raised by the call.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                leader = True
+            else:
+                self.shared += 1
+                leader = False
+
+        if leader:
+            self._run(key, call, func)
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.value
+
+    def refresh(self, key: Hashable, func: Callable[[], Any]) -> bool:
+        """Call the function in a background thread, unless a call with the
+        same key is already in flight or :py:data:`BACKGROUND_REFRESH` is not
+        set. Exceptions are logged and discarded.
+
+        Args:
+            key: The key of the call.
+            func: The function to call.
+        Returns:
+            True if a call was started.
+        """
+        if not BACKGROUND_REFRESH:
+            return False
+        with self._lock:
+            if key in self._calls:
+                return False
+            call = self._calls[key] = _Call()
+            self.refreshes += 1
+
+        def run():
+            self._run(key, call, func)
+            if call.error is not None:
+                LOGGER.error("refresh of %r failed", key, exc_info=call.error)
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def _run(self, key: Hashable, call: _Call, func: Callable[[], Any]) -> None:
+        try:
+            call.value = func()
+        except Exception as exc:
+            call.error = exc
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the amount of calls made, calls that shared the result of
+        an in-flight call, and background refreshes.
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "shared": self.shared,
+                "refreshes": self.refreshes,
+                "in_flight": len(self._calls),
+            }
+
+
+class AsyncSingleFlight:
+    """Asyncio variant of :py:class:`SingleFlight`, which shares the result
+    of a coroutine among all tasks that make a call with the same key while
+    it is in flight. Calls are only shared within the same event loop.
+
+    Each call runs in a task of its own, which the callers await through
+    :py:func:`asyncio.shield`. Cancelling any of the callers, including the
+    one that started the call, therefore only cancels that caller.
+    """
+
+    def __init__(self):
+        # (loop, key) -> task of the in-flight call
+        self._calls = {}  # type: Dict[Hashable, "asyncio.Task"]
+        self.calls = 0
+        self.shared = 0
+        self.refreshes = 0
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable]) -> Any:
+        """Await the coroutine function, unless a call with the same key is in
+        flight, in which case its result is awaited and returned instead.
+
+        Args:
+            key: The key of the call.
+            func: A function that returns an awaitable.
+        Returns:
+            The result of the call.
+        Raises:
+            Any exception raised by the call.
+        """
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        task = self._calls.get((loop, key))
+        if task is None:
+            self.calls += 1
+            task = self._start(loop, key, func)
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def refresh(self, key: Hashable, func: Callable[[], Awaitable]) -> bool:
+        """Start the call as a task, unless a call with the same key is already
+        in flight or :py:data:`BACKGROUND_REFRESH` is not set. Exceptions are
+        logged, unless a caller of :py:meth:`do` shares the call and receives
+        them.
+
+        Args:
+            key: The key of the call.
+            func: A function that returns an awaitable.
+        Returns:
+            True if a call was started.
+        """
+        if not BACKGROUND_REFRESH:
+            return False
+        import asyncio
+
+        loop = asyncio.get_event_loop()
+        if (loop, key) in self._calls:
+            return False
+
+        self.refreshes += 1
+        task = self._start(loop, key, func)
+
+        def log_exception(task: "asyncio.Task") -> None:
+            if not task.cancelled() and task.exception() is not None:
+                LOGGER.error("refresh of %r failed", key, exc_info=task.exception())
+
+        task.add_done_callback(log_exception)
+        return True
+
+    def _start(self, loop, key, func) -> "asyncio.Task":
+        async def run():
+            try:
+                return await func()
+            finally:
+                del self._calls[(loop, key)]
+
+        task = self._calls[(loop, key)] = loop.create_task(run())
+        # retrieve the exception, in case all callers were cancelled
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return task
+
+    def stats(self) -> Dict[str, int]:
+        """Return the amount of calls made, calls that shared the result of
+        an in-flight call, and background refreshes.
+        """
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "refreshes": self.refreshes,
+            "in_flight": len(self._calls),
+        }
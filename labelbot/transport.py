@@ -0,0 +1,117 @@
+"""Shared HTTP transport for requests to the GitHub API.
+
+All GitHub API calls go through a single pooled session, so connections (and
+their TLS handshakes) are reused across calls and, in a warm process, across
+events.
+
+.. module:: transport
+    :synopsis: Shared HTTP transport for requests to the GitHub API.
+"""
+import threading
+from typing import Optional, Tuple
+
+import requests
+import requests.adapters
+
+from labelbot import github_api
+from labelbot import metrics
+from labelbot import ratelimit
+
+USER_AGENT = github_api.USER_AGENT
+# seconds to wait for a connection to be established and for a response
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 5
+# maximum amount of pooled connections per host
+POOL_SIZE = 10
+# times to retry a rate limited request, if the backoff is short enough
+RATE_LIMIT_RETRIES = 1
+
+
+class Session(requests.Session):
+    """A requests session with keep-alive connection pooling, gzip
+    negotiation and default connect/read timeouts. Requests are paced by a
+    :py:class:`~labelbot.ratelimit.RateLimiter`, and rate limited requests
+    are retried if the backoff is short enough.
+    """
+
+    def __init__(
+        self,
+        timeout: Tuple[float, float] = (CONNECT_TIMEOUT, READ_TIMEOUT),
+        pool_size: int = POOL_SIZE,
+        rate_limiter: Optional[ratelimit.RateLimiter] = None,
+    ):
+        """
+        Args:
+            timeout: A (connect timeout, read timeout) tuple that is used for
+                requests that do not specify a timeout.
+            pool_size: Maximum amount of pooled connections per host.
+            rate_limiter: The rate limiter to use. Defaults to the limiter
+                shared by the whole process.
+        """
+        super().__init__()
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or ratelimit.LIMITER
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.headers.update(
+            {
+                "User-Agent": USER_AGENT,
+                "Accept-Encoding": "gzip, deflate",
+                "Connection": "keep-alive",
+            }
+        )
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        key = ratelimit.request_key(kwargs.get("headers"))
+        for retry in range(RATE_LIMIT_RETRIES + 1):
+            self.rate_limiter.wait(key)
+            response = super().request(method, url, **kwargs)
+            _record_request(response)
+            throttled = self.rate_limiter.update(
+                key, response.status_code, response.headers
+            )
+            if (
+                not throttled
+                or retry == RATE_LIMIT_RETRIES
+                or self.rate_limiter.backoff(key) > self.rate_limiter.max_delay()
+            ):
+                break
+        return response
+
+
+def _record_request(response: requests.Response) -> None:
+    body = response.request.body if response.request is not None else None
+    metrics.record_request(
+        response.status_code, len(body) if body else 0, len(response.content)
+    )
+
+
+def get_session() -> requests.Session:
+    """Return the session shared by all GitHub API calls, creating it on
+    first use.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = Session()
+        return _session
+
+
+def set_session(session: Optional[requests.Session]) -> None:
+    """Replace the shared session, e.g. with a mock in tests. Passing None
+    causes a new default session to be created on next use.
+
+    Args:
+        session: The session to use for all GitHub API calls.
+    """
+    global _session
+    with _session_lock:
+        _session = session
+
+
+_session = None  # type: Optional[requests.Session]
+_session_lock = threading.Lock()
@@ -0,0 +1,462 @@
+"""Queues for processing webhooks after they have been acknowledged.
+
+In queued mode, the webhook handler only verifies and triages an event,
+enqueues it and responds with 202 Accepted. A :py:class:`QueueProcessor`
+then drains the queue on worker threads. This keeps the webhook response
+time independent of GitHub API latency.
+
+Two queue backends are provided: :py:class:`InMemoryQueue`, and the durable
+:py:class:`SQLiteQueue`, which keeps unprocessed events across restarts.
+Either can be wrapped in a :py:class:`CoalescingQueue`, which merges bursts
+of events for the same issue into one.
+
+.. module:: work_queue
+    :synopsis: Queues for processing webhooks after acknowledging them.
+"""
+import collections
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_DEPTH = 1000
+DEFAULT_WORKERS = 4
+# seconds that a worker blocks waiting for a job before checking for shutdown
+POLL_INTERVAL = 0.5
+
+# seconds during which items for the same issue are merged
+DEFAULT_COALESCE_WINDOW = 2.0
+
+Job = collections.namedtuple("Job", "id enqueued_at payload")
+
+
+def _issue_key(payload: dict) -> Hashable:
+    """Return the (owner, repo, issue_nr) coalescing key of an issue event."""
+    return payload["owner"], payload["repo"], payload["issue_nr"]
+
+
+class QueueFull(Exception):
+    """Raise when an item is put in a queue that is at its maximum depth."""
+
+
+class InMemoryQueue:
+    """A bounded, thread safe in-process queue."""
+
+    def __init__(
+        self,
+        max_depth: int = DEFAULT_MAX_DEPTH,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            max_depth: Maximum amount of queued items.
+            clock: Function returning the current time in seconds.
+        """
+        self._max_depth = max_depth
+        self._clock = clock
+        self._items = collections.deque()
+        self._not_empty = threading.Condition()
+        self._next_id = 0
+
+    def put(self, payload: dict) -> None:
+        """Enqueue an item.
+
+        Args:
+            payload: A JSON serializable dict.
+        Raises:
+            QueueFull: If the queue is at its maximum depth.
+        """
+        with self._not_empty:
+            if len(self._items) >= self._max_depth:
+                raise QueueFull(f"queue is at its max depth {self._max_depth}")
+            self._next_id += 1
+            self._items.append(Job(self._next_id, self._clock(), payload))
+            self._not_empty.notify()
+
+    @property
+    def max_depth(self) -> int:
+        return self._max_depth
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Job]:
+        """Dequeue the oldest item, waiting for one if the queue is empty.
+
+        Args:
+            timeout: Maximum amount of seconds to wait.
+        Returns:
+            The oldest job, or None if the timeout expired.
+        """
+        with self._not_empty:
+            if not self._not_empty.wait_for(lambda: self._items, timeout):
+                return None
+            return self._items.popleft()
+
+    def ack(self, job: Job) -> None:
+        """Mark a job as processed. A no-op, as jobs are removed from an
+        in-memory queue as soon as they are dequeued.
+        """
+
+    def depth(self) -> int:
+        """Return the amount of queued items."""
+        with self._not_empty:
+            return len(self._items)
+
+
+class SQLiteQueue:
+    """A bounded, durable queue stored in an SQLite database.
+
+    Dequeued jobs stay in the database until they are acknowledged, so jobs
+    that were in progress when the process died are processed again on the
+    next start.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_depth: int = DEFAULT_MAX_DEPTH,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            path: Path to the database file.
+            max_depth: Maximum amount of queued items.
+            clock: Function returning the current time in seconds.
+        """
+        self._max_depth = max_depth
+        self._clock = clock
+        self._not_empty = threading.Condition()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "enqueued_at REAL NOT NULL, "
+                "payload TEXT NOT NULL, "
+                "claimed INTEGER NOT NULL DEFAULT 0)"
+            )
+            # release jobs that were in progress when the last process died
+            self._conn.execute("UPDATE jobs SET claimed = 0")
+
+    def put(self, payload: dict) -> None:
+        """Enqueue an item.
+
+        Args:
+            payload: A JSON serializable dict.
+        Raises:
+            QueueFull: If the queue is at its maximum depth.
+        """
+        with self._not_empty, self._conn:
+            (depth,) = self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()
+            if depth >= self._max_depth:
+                raise QueueFull(f"queue is at its max depth {self._max_depth}")
+            self._conn.execute(
+                "INSERT INTO jobs (enqueued_at, payload) VALUES (?, ?)",
+                (self._clock(), json.dumps(payload)),
+            )
+            self._not_empty.notify()
+
+    @property
+    def max_depth(self) -> int:
+        return self._max_depth
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Job]:
+        """Claim the oldest unclaimed item, waiting for one if there is none.
+
+        Args:
+            timeout: Maximum amount of seconds to wait.
+        Returns:
+            The oldest job, or None if the timeout expired.
+        """
+        with self._not_empty:
+            job = self._claim()
+            if job is None and self._not_empty.wait(timeout):
+                job = self._claim()
+            return job
+
+    def _claim(self) -> Optional[Job]:
+        with self._conn:
+            row = self._conn.execute(
+                "SELECT id, enqueued_at, payload FROM jobs "
+                "WHERE claimed = 0 ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE jobs SET claimed = 1 WHERE id = ?", (row[0],))
+        return Job(row[0], row[1], json.loads(row[2]))
+
+    def ack(self, job: Job) -> None:
+        """Remove a processed job from the queue."""
+        with self._not_empty, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    def depth(self) -> int:
+        """Return the amount of queued and in-progress items."""
+        with self._not_empty:
+            (depth,) = self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()
+            return depth
+
+    def close(self) -> None:
+        with self._not_empty:
+            self._conn.close()
+
+
+class CoalescingQueue:
+    """Wraps a queue, and merges items for the same issue that are put
+    within a short window of each other.
+
+    The first item for an issue opens a window of ``window`` seconds. Items
+    for the same issue that arrive during the window replace the pending
+    item, and only the latest one is forwarded to the wrapped queue when the
+    window closes. Bursts of edits to an issue therefore result in a single
+    evaluation of its labels.
+
+    Pending items count towards the maximum depth of the wrapped queue, so
+    that an item that has been put can always be forwarded.
+    """
+
+    def __init__(
+        self,
+        event_queue,
+        window: float = DEFAULT_COALESCE_WINDOW,
+        key: Callable[[dict], Hashable] = _issue_key,
+        clock: Callable[[], float] = time.monotonic,
+        max_depth: Optional[int] = None,
+    ):
+        """
+        Args:
+            event_queue: The queue to forward items to.
+            window: Seconds to wait for more items for the same issue.
+            key: Function that returns the coalescing key of an item.
+            clock: Function returning a monotonic time in seconds.
+            max_depth: Maximum amount of pending and queued items. Defaults
+                to the maximum depth of the wrapped queue.
+        """
+        self._queue = event_queue
+        self._window = window
+        self._key = key
+        self._clock = clock
+        self._max_depth = event_queue.max_depth if max_depth is None else max_depth
+        self._cond = threading.Condition()
+        # key -> (deadline, payload)
+        self._pending = {}  # type: Dict[Hashable, Tuple[float, dict]]
+        # windows all have the same length, so deadlines are in order
+        self._deadlines = collections.deque()
+        self._closed = False
+        self.received = 0
+        self.merged = 0
+        self.cancelled = 0
+        self.forwarded = 0
+        self.dropped = 0
+        self._thread = threading.Thread(
+            target=self._forward_due_items, name="labelbot-coalescer", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def max_depth(self) -> int:
+        return self._max_depth
+
+    def put(self, payload: dict) -> None:
+        """Put an item, replacing any pending item for the same issue.
+
+        Args:
+            payload: A JSON serializable dict.
+        Raises:
+            QueueFull: If the item is not for an issue with a pending item,
+                and the pending and queued items are at the maximum depth.
+        """
+        key = self._key(payload)
+        with self._cond:
+            if key in self._pending:
+                deadline, _ = self._pending[key]
+                self.merged += 1
+            else:
+                if len(self._pending) + self._queue.depth() >= self._max_depth:
+                    raise QueueFull(f"queue is at its max depth {self._max_depth}")
+                deadline = self._clock() + self._window
+                self._deadlines.append((deadline, key))
+                self._cond.notify()
+            self.received += 1
+            self._pending[key] = (deadline, payload)
+
+    def replace_pending(self, payload: dict) -> bool:
+        """Replace the pending item for the same issue, if there is one.
+
+        Args:
+            payload: A JSON serializable dict.
+        Returns:
+            True if there was a pending item to replace.
+        """
+        key = self._key(payload)
+        with self._cond:
+            if key not in self._pending:
+                return False
+            deadline, _ = self._pending[key]
+            self._pending[key] = (deadline, payload)
+            self.received += 1
+            self.merged += 1
+            return True
+
+    def cancel_pending(self, payload: dict) -> bool:
+        """Remove the pending item for the same issue, if there is one.
+
+        Args:
+            payload: A JSON serializable dict.
+        Returns:
+            True if there was a pending item to remove.
+        """
+        with self._cond:
+            if self._pending.pop(self._key(payload), None) is None:
+                return False
+            self.cancelled += 1
+            return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Job]:
+        return self._queue.get(timeout)
+
+    def ack(self, job: Job) -> None:
+        self._queue.ack(job)
+
+    def depth(self) -> int:
+        """Return the amount of pending and queued items."""
+        with self._cond:
+            pending = len(self._pending)
+        return pending + self._queue.depth()
+
+    def close(self) -> None:
+        """Forward all pending items immediately, and stop the coalescer."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def stats(self) -> Dict[str, int]:
+        """Return the amount of received, merged, cancelled, forwarded and
+        dropped items.
+        """
+        with self._cond:
+            return {
+                "received": self.received,
+                "merged": self.merged,
+                "cancelled": self.cancelled,
+                "forwarded": self.forwarded,
+                "dropped": self.dropped,
+            }
+
+    def _forward_due_items(self) -> None:
+        while True:
+            with self._cond:
+                while not self._deadlines:
+                    if self._closed:
+                        return
+                    self._cond.wait()
+                deadline, key = self._deadlines[0]
+                timeout = deadline - self._clock()
+                if timeout > 0 and not self._closed:
+                    self._cond.wait(timeout)
+                    continue
+                self._deadlines.popleft()
+                # the item may have been cancelled, and a later item for the
+                # same issue has a deadline of its own
+                deadline_of_pending, payload = self._pending.get(key, (None, None))
+                if deadline_of_pending != deadline:
+                    continue
+                del self._pending[key]
+
+            try:
+                self._queue.put(payload)
+                forwarded = True
+            except QueueFull:
+                # only if something else puts items in the wrapped queue
+                LOGGER.warning("queue full, dropping coalesced item %s", key)
+                forwarded = False
+            with self._cond:
+                self.forwarded += forwarded
+                self.dropped += not forwarded
+
+
+class QueueProcessor:
+    """Drains a queue on a pool of worker threads."""
+
+    def __init__(
+        self,
+        event_queue,
+        process: Callable[[dict], bool],
+        workers: int = DEFAULT_WORKERS,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Args:
+            event_queue: The queue to drain.
+            process: Function that processes a payload, and returns True on
+                success.
+            workers: Amount of worker threads.
+            clock: Function returning the current time in seconds, must be
+                the same clock as the queue uses.
+        """
+        self._queue = event_queue
+        self._process = process
+        self._clock = clock
+        self._stopping = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"labelbot-worker-{i}")
+            for i in range(workers)
+        ]
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.queue_latency_total = 0.0
+        self.queue_latency_max = 0.0
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, drain: bool = True) -> None:
+        """Stop the workers.
+
+        Args:
+            drain: If True, process all queued jobs before stopping.
+        """
+        if drain:
+            while self._queue.depth() > 0 and any(t.is_alive() for t in self._threads):
+                time.sleep(POLL_INTERVAL / 10)
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self) -> None:
+        while not self._stopping.is_set():
+            job = self._queue.get(timeout=POLL_INTERVAL)
+            if job is None:
+                continue
+            latency = max(0.0, self._clock() - job.enqueued_at)
+            try:
+                success = self._process(job.payload)
+            except Exception:
+                LOGGER.exception("failed to process job %s", job.id)
+                success = False
+            self._queue.ack(job)
+            with self._lock:
+                self.processed += 1
+                self.failed += not success
+                self.queue_latency_total += latency
+                self.queue_latency_max = max(self.queue_latency_max, latency)
+
+    def stats(self) -> Dict[str, float]:
+        """Return the amount of processed and failed jobs, the current queue
+        depth, and the mean and max time jobs spent in the queue.
+        """
+        with self._lock:
+            return {
+                "processed": self.processed,
+                "failed": self.failed,
+                "depth": self._queue.depth(),
+                "queue_latency_mean": self.queue_latency_total / self.processed
+                if self.processed
+                else 0.0,
+                "queue_latency_max": self.queue_latency_max,
+            }
@@ -1,11 +1,23 @@
 #! /bin/bash
+# Build labelbot.zip for AWS Lambda.
+#
+# With SLIM=1, the AWS SDK (boto3, botocore and their dependencies) is left
+# out, as the Lambda Python runtime already provides it. This makes the
+# deployment package considerably smaller.
 
 PKG=package
+SLIM=${SLIM:-0}
 
 rm -rf "$PKG"
 mkdir "$PKG"
 python3 -m pip install . --target "$PKG"
 
+if [ "$SLIM" = "1" ]; then
+    for dist in boto3 botocore s3transfer jmespath; do
+        rm -rf "$PKG/$dist" "$PKG/$dist"-*.dist-info
+    done
+fi
+
 cd "$PKG"
 zip -r9 ../labelbot.zip .
 cd ..
@@ -11,6 +11,8 @@ test_requirements = [
     "pytest-mock",
 ]
 required = ["python_jwt", "jwcrypto", "requests", "boto3"]
+async_requirements = ["aiohttp>=3.5"]
+fast_requirements = ["orjson"]
 
 setup(
     name="labelbot",
@@ -27,6 +29,14 @@ setup(
     packages=find_packages(exclude=("tests", "docs")),
     install_requires=required,
     tests_require=test_requirements,
-    extras_require=dict(TEST=test_requirements),
+    extras_require=dict(
+        TEST=test_requirements, ASYNC=async_requirements, FAST=fast_requirements
+    ),
     python_requires=">=3.6",
+    entry_points={
+        "console_scripts": [
+            "labelbot-backfill = labelbot.backfill:main",
+            "labelbot-server = labelbot.server:main",
+        ]
+    },
 )
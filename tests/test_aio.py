@@ -0,0 +1,163 @@
+import asyncio
+import base64
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+from aiohttp import test_utils  # noqa: E402
+
+from labelbot import aio  # noqa: E402
+from labelbot import auth  # noqa: E402
+from labelbot import github_api  # noqa: E402
+
+OWNER = "someone"
+REPO = "best-repo"
+ISSUE_NR = 231
+INSTALLATION_ID = 825958
+ACCESS_TOKEN = "8924ab4"
+ALLOWED_LABELS = "help\nbug\n"
+REPO_LABELS = ["help", "bug"]
+
+
+def _create_app(requests):
+    async def access_tokens(request):
+        requests.append(request.path)
+        return web.json_response(
+            {"token": ACCESS_TOKEN, "expires_at": "2099-01-01T00:00:00Z"}
+        )
+
+    async def contents(request):
+        requests.append(request.path)
+        content = base64.b64encode(ALLOWED_LABELS.encode()).decode()
+        return web.json_response({"content": content}, headers={"ETag": '"abc"'})
+
+    async def repo_labels(request):
+        requests.append(request.path)
+        per_page = int(request.query["per_page"])
+        start = (int(request.query["page"]) - 1) * per_page
+        page = REPO_LABELS[start : start + per_page]
+        return web.json_response([{"name": name} for name in page])
+
+    async def add_labels(request):
+        requests.append(request.path)
+        assert request.headers["Authorization"] == f"token {ACCESS_TOKEN}"
+        payload = await request.json()
+        return web.json_response([{"name": name} for name in payload["labels"]])
+
+    app = web.Application()
+    app.router.add_post(
+        f"/app/installations/{INSTALLATION_ID}/access_tokens", access_tokens
+    )
+    app.router.add_get(
+        f"/repos/{OWNER}/{REPO}/contents/{github_api.ALLOWED_LABELS_FILE}", contents
+    )
+    app.router.add_get(f"/repos/{OWNER}/{REPO}/labels", repo_labels)
+    app.router.add_post(f"/repos/{OWNER}/{REPO}/issues/{{nr}}/labels", add_labels)
+    return app
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    auth.TOKEN_CACHE.invalidate()
+    github_api.ALLOWED_LABELS_CACHE.invalidate()
+    github_api.LABEL_CATALOG_CACHE.invalidate()
+    yield
+    auth.TOKEN_CACHE.invalidate()
+    github_api.ALLOWED_LABELS_CACHE.invalidate()
+    github_api.LABEL_CATALOG_CACHE.invalidate()
+
+
+def _run_with_server(coroutine_factory, monkeypatch):
+    """Run the coroutine returned by coroutine_factory against a local fake
+    GitHub API, and return its result and the requested paths.
+    """
+    requests = []
+
+    async def run():
+        server = test_utils.TestServer(_create_app(requests))
+        await server.start_server()
+        monkeypatch.setattr(github_api, "BASE_URL", str(server.make_url("")))
+        try:
+            return await coroutine_factory()
+        finally:
+            await aio.close_session()
+            await server.close()
+
+    return asyncio.run(run()), requests
+
+
+def test_set_allowed_labels_adds_missing_labels(monkeypatch):
+    result, requests = _run_with_server(
+        lambda: aio.set_allowed_labels(
+            OWNER, REPO, ISSUE_NR, ":label:`bug` :label:`nope`", [], ACCESS_TOKEN
+        ),
+        monkeypatch,
+    )
+
+    assert result
+    assert requests == [
+        f"/repos/{OWNER}/{REPO}/contents/{github_api.ALLOWED_LABELS_FILE}",
+        f"/repos/{OWNER}/{REPO}/labels",
+        f"/repos/{OWNER}/{REPO}/issues/{ISSUE_NR}/labels",
+    ]
+
+
+def test_set_allowed_labels_skips_labels_missing_in_repo(monkeypatch):
+    monkeypatch.setattr(__name__ + ".REPO_LABELS", ["help"])
+
+    result, requests = _run_with_server(
+        lambda: aio.set_allowed_labels(
+            OWNER, REPO, ISSUE_NR, ":label:`bug`", [], ACCESS_TOKEN
+        ),
+        monkeypatch,
+    )
+
+    assert result
+    assert f"/repos/{OWNER}/{REPO}/issues/{ISSUE_NR}/labels" not in requests
+
+
+def test_get_label_catalog_requests_all_pages(monkeypatch):
+    monkeypatch.setattr(github_api, "PER_PAGE", 1)
+
+    catalog, requests = _run_with_server(
+        lambda: aio.get_label_catalog(OWNER, REPO, ACCESS_TOKEN), monkeypatch
+    )
+
+    assert sorted(catalog) == ["bug", "help"]
+    assert requests == [f"/repos/{OWNER}/{REPO}/labels"] * 3
+
+
+def test_get_installation_access_token_uses_cache(monkeypatch):
+    async def get_token_twice():
+        first = await aio.get_installation_access_token(INSTALLATION_ID, lambda: "jwt")
+        second = await aio.get_installation_access_token(INSTALLATION_ID, lambda: "jwt")
+        return first, second
+
+    result, requests = _run_with_server(get_token_twice, monkeypatch)
+
+    assert result == (ACCESS_TOKEN, ACCESS_TOKEN)
+    assert len(requests) == 1
+
+
+def test_handles_concurrent_events(monkeypatch):
+    issue_nrs = range(1, 51)
+
+    async def set_labels_concurrently():
+        return await asyncio.gather(
+            *(
+                aio.set_allowed_labels(
+                    OWNER, REPO, nr, ":label:`help`", [], ACCESS_TOKEN
+                )
+                for nr in issue_nrs
+            )
+        )
+
+    results, requests = _run_with_server(set_labels_concurrently, monkeypatch)
+
+    assert all(results)
+    assert sum("/issues/" in path for path in requests) == len(issue_nrs)
+    # the concurrent cache misses share a single fetch of the allow-list and
+    # of the labels of the repo
+    assert sum(path.endswith(github_api.ALLOWED_LABELS_FILE) for path in requests) == 1
+    assert requests.count(f"/repos/{OWNER}/{REPO}/labels") == 1
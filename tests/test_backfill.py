@@ -0,0 +1,147 @@
+import base64
+import json
+
+import pytest
+import responses
+
+from labelbot import backfill
+from labelbot import github_api
+
+OWNER = "someone"
+REPO = "best-repo"
+ACCESS_TOKEN = "8924ab4"
+ISSUES_URL = f"{github_api.BASE_URL}/repos/{OWNER}/{REPO}/issues"
+ALLOWED_LABELS_URL = f"{github_api.BASE_URL}/repos/{OWNER}/{REPO}/contents/{github_api.ALLOWED_LABELS_FILE}"
+REPO_LABELS_URL = f"{github_api.BASE_URL}/repos/{OWNER}/{REPO}/labels"
+
+
+def _issue(nr, body, labels=()):
+    return {"number": nr, "body": body, "labels": [{"name": lab} for lab in labels]}
+
+
+FIRST_PAGE = [
+    _issue(1, ":label:`bug`"),
+    _issue(2, "no markup"),
+    {**_issue(3, ":label:`bug`"), "pull_request": {}},
+]
+SECOND_PAGE = [_issue(4, ":label:`bug`", labels=["bug"]), _issue(5, ":label:`help`")]
+
+
+@pytest.fixture(autouse=True)
+def github(mocker):
+    github_api.ALLOWED_LABELS_CACHE.invalidate()
+    github_api.LABEL_CATALOG_CACHE.invalidate()
+    content = base64.b64encode(b"bug\nhelp\n").decode()
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add(
+            responses.GET,
+            url=ALLOWED_LABELS_URL,
+            body=json.dumps({"content": content}),
+        )
+        rsps.add(
+            responses.GET,
+            url=REPO_LABELS_URL,
+            body=json.dumps([{"name": "bug"}, {"name": "help"}]),
+        )
+        rsps.add(
+            responses.GET,
+            url=ISSUES_URL,
+            body=json.dumps(FIRST_PAGE),
+            headers={"Link": f'<{ISSUES_URL}?page=2>; rel="next"'},
+            match=[
+                responses.matchers.query_param_matcher(
+                    {
+                        "state": "open",
+                        "sort": "created",
+                        "direction": "asc",
+                        "per_page": "100",
+                    }
+                )
+            ],
+        )
+        rsps.add(
+            responses.GET,
+            url=ISSUES_URL,
+            body=json.dumps(SECOND_PAGE),
+            match=[responses.matchers.query_param_matcher({"page": "2"})],
+        )
+        for nr in (1, 5):
+            rsps.add(responses.POST, url=f"{ISSUES_URL}/{nr}/labels", status=200)
+        yield rsps
+    github_api.ALLOWED_LABELS_CACHE.invalidate()
+    github_api.LABEL_CATALOG_CACHE.invalidate()
+
+
+def _label_posts(rsps):
+    return [call.request.url for call in rsps.calls if call.request.method == "POST"]
+
+
+def test_adds_labels_only_where_they_change(github):
+    labeled = backfill.backfill_repo(
+        OWNER, REPO, lambda: ACCESS_TOKEN, backfill.Checkpoint(), concurrency=2
+    )
+
+    assert labeled == 2
+    assert sorted(_label_posts(github)) == [
+        f"{ISSUES_URL}/1/labels",
+        f"{ISSUES_URL}/5/labels",
+    ]
+
+
+def test_skips_labels_missing_in_repo(github):
+    github.replace(
+        responses.GET, url=REPO_LABELS_URL, body=json.dumps([{"name": "bug"}])
+    )
+
+    labeled = backfill.backfill_repo(
+        OWNER, REPO, lambda: ACCESS_TOKEN, backfill.Checkpoint()
+    )
+
+    assert labeled == 1
+    assert _label_posts(github) == [f"{ISSUES_URL}/1/labels"]
+
+
+def test_dry_run_does_not_write(github):
+    labeled = backfill.backfill_repo(
+        OWNER, REPO, lambda: ACCESS_TOKEN, backfill.Checkpoint(), dry_run=True
+    )
+
+    assert labeled == 2
+    assert not _label_posts(github)
+
+
+def test_resumes_from_checkpoint(github, tmp_path):
+    checkpoint_file = str(tmp_path / "checkpoint.json")
+    backfill.Checkpoint(checkpoint_file).update(OWNER, REPO, last_issue_nr=2)
+
+    labeled = backfill.backfill_repo(
+        OWNER, REPO, lambda: ACCESS_TOKEN, backfill.Checkpoint(checkpoint_file)
+    )
+
+    assert labeled == 1
+    assert _label_posts(github) == [f"{ISSUES_URL}/5/labels"]
+    assert backfill.Checkpoint(checkpoint_file).is_done(OWNER, REPO)
+
+
+def test_skips_repo_without_allowed_labels_file(github, tmp_path):
+    github.replace(responses.GET, url=ALLOWED_LABELS_URL, status=404)
+    checkpoint_file = str(tmp_path / "checkpoint.json")
+
+    labeled = backfill.backfill_repo(
+        OWNER, REPO, lambda: ACCESS_TOKEN, backfill.Checkpoint(checkpoint_file)
+    )
+
+    assert labeled == 0
+    assert backfill.Checkpoint(checkpoint_file).is_done(OWNER, REPO)
+
+
+def test_does_not_mark_repo_done_on_transient_error(github, tmp_path):
+    github.replace(responses.GET, url=ALLOWED_LABELS_URL, status=502)
+    checkpoint_file = str(tmp_path / "checkpoint.json")
+
+    with pytest.raises(github_api.APIError):
+        backfill.backfill_repo(
+            OWNER, REPO, lambda: ACCESS_TOKEN, backfill.Checkpoint(checkpoint_file)
+        )
+
+    assert not backfill.Checkpoint(checkpoint_file).is_done(OWNER, REPO)
@@ -1,4 +1,9 @@
+import hashlib
+import hmac
+import json
+
 from labelbot import bot
+from labelbot import work_queue
 import responses
 import pytest
 
@@ -28,6 +33,279 @@ def test_lambda_handler_authentication_failure(env_setup):
     assert result["statuscode"] == 403
 
 
+def _signed_event(body, secret):
+    signature = hmac.new(secret.encode("utf8"), body.encode("utf8"), hashlib.sha1)
+    return {
+        "headers": {"X-Hub-Signature": f"sha1={signature.hexdigest()}"},
+        "body": body,
+    }
+
+
+def _modified_body(action=None, issue_body=None, changes=None):
+    body = json.loads(jsonstring)
+    if action is not None:
+        body["action"] = action
+    if issue_body is not None:
+        body["issue"]["body"] = issue_body
+    if changes is not None:
+        body["changes"] = changes
+    return json.dumps(body)
+
+
+class TestTriage:
+    """Tests for the I/O free triage of events in lambda_handler."""
+
+    @pytest.fixture
+    def mocked_apis(self, mocker):
+        get_token = mocker.patch(
+            "labelbot.bot.auth.get_installation_access_token",
+            autospec=True,
+            return_value="token",
+        )
+        set_allowed_labels = mocker.patch(
+            "labelbot.bot.github_api.set_allowed_labels",
+            autospec=True,
+            return_value=True,
+        )
+        yield get_token, set_allowed_labels
+
+    def test_ignores_unhandled_action(self, env_setup, mocked_apis):
+        event = _signed_event(_modified_body(action="closed"), env_setup["SECRET_KEY"])
+
+        result = bot.lambda_handler(event, None)
+
+        assert result["statusCode"] == 200
+        for api in mocked_apis:
+            assert not api.called
+
+    def test_ignores_issue_without_label_markup(self, env_setup, mocked_apis):
+        event = _signed_event(
+            _modified_body(issue_body="no markup here"), env_setup["SECRET_KEY"]
+        )
+
+        result = bot.lambda_handler(event, None)
+
+        assert result["statusCode"] == 200
+        for api in mocked_apis:
+            assert not api.called
+
+    def test_does_not_parse_unauthenticated_body(self, env_setup, mocker):
+        decode = mocker.spy(bot.payload, "decode")
+        event = {"headers": {"X-Hub-Signature-256": "sha256=0"}, "body": jsonstring}
+
+        result = bot.lambda_handler(event, None)
+
+        assert result["statuscode"] == 403
+        assert not decode.called
+
+    def test_accepts_sha256_signature_with_previous_secret(
+        self, env_setup, mocked_apis
+    ):
+        previous_secret = env_setup["SECRET_KEY"]
+        env_setup["SECRET_KEY"] = "new secret"
+        env_setup["SECRET_KEY_PREVIOUS"] = previous_secret
+        _, set_allowed_labels = mocked_apis
+        signature = hmac.new(
+            previous_secret.encode("utf8"), jsonstring.encode(), hashlib.sha256
+        )
+        event = {
+            "headers": {"X-Hub-Signature-256": f"sha256={signature.hexdigest()}"},
+            "body": jsonstring,
+        }
+
+        result = bot.lambda_handler(event, None)
+
+        assert result["statusCode"] == 200
+        assert set_allowed_labels.called
+
+    def test_accepts_secret_containing_comma(self, env_setup, mocked_apis):
+        env_setup["SECRET_KEY"] = "abc,def"
+        _, set_allowed_labels = mocked_apis
+        event = _signed_event(jsonstring, env_setup["SECRET_KEY"])
+
+        result = bot.lambda_handler(event, None)
+
+        assert result["statusCode"] == 200
+        assert set_allowed_labels.called
+
+    def test_sets_labels_when_labels_are_requested(self, env_setup, mocked_apis):
+        _, set_allowed_labels = mocked_apis
+        event = _signed_event(jsonstring, env_setup["SECRET_KEY"])
+
+        result = bot.lambda_handler(event, None)
+
+        assert result["statusCode"] == 200
+        set_allowed_labels.assert_called_once_with(
+            "jcroona", "testrepo", 10, ":label:`kaka`", [], "token"
+        )
+
+    def test_sets_labels_with_graphql_api_when_selected(
+        self, env_setup, mocked_apis, mocker, monkeypatch
+    ):
+        _, rest_set_allowed_labels = mocked_apis
+        graphql_set_allowed_labels = mocker.patch(
+            "labelbot.bot.graphql.set_allowed_labels", autospec=True, return_value=True
+        )
+        monkeypatch.setattr(bot.github_api, "API", "graphql")
+        event = _signed_event(jsonstring, env_setup["SECRET_KEY"])
+
+        result = bot.lambda_handler(event, None)
+
+        assert result["statusCode"] == 200
+        assert not rest_set_allowed_labels.called
+        graphql_set_allowed_labels.assert_called_once_with(
+            "jcroona", "testrepo", 10, ":label:`kaka`", [], "token"
+        )
+
+    def test_label_event_invalidates_label_catalog_of_repo(
+        self, env_setup, mocked_apis, mocker
+    ):
+        invalidate = mocker.patch.object(
+            bot.github_api.LABEL_CATALOG_CACHE, "invalidate", autospec=True
+        )
+        body = json.loads(jsonstring)
+        label_body = json.dumps(
+            {
+                "action": "deleted",
+                "label": {"name": "kaka"},
+                "repository": body["repository"],
+                "installation": body["installation"],
+            }
+        )
+        event = _signed_event(label_body, env_setup["SECRET_KEY"])
+        event["headers"]["X-GitHub-Event"] = "label"
+
+        result = bot.lambda_handler(event, None)
+
+        assert result["statusCode"] == 200
+        invalidate.assert_called_once_with("jcroona", "testrepo")
+        for api in mocked_apis:
+            assert not api.called
+
+    def test_ignores_edit_that_keeps_requested_labels(self, env_setup, mocked_apis):
+        body = _modified_body(
+            action="edited",
+            issue_body="Fixed a typo :label:`kaka`",
+            changes={"body": {"from": "Fixed a tpyo :label:`kaka`"}},
+        )
+
+        result = bot.lambda_handler(_signed_event(body, env_setup["SECRET_KEY"]), None)
+
+        assert result["statusCode"] == 200
+        for api in mocked_apis:
+            assert not api.called
+
+    def test_ignores_edit_of_title_only(self, env_setup, mocked_apis):
+        body = _modified_body(action="edited", changes={"title": {"from": "Old title"}})
+
+        result = bot.lambda_handler(_signed_event(body, env_setup["SECRET_KEY"]), None)
+
+        assert result["statusCode"] == 200
+        for api in mocked_apis:
+            assert not api.called
+
+    def test_sets_labels_when_edit_requests_new_labels(self, env_setup, mocked_apis):
+        _, set_allowed_labels = mocked_apis
+        body = _modified_body(
+            action="edited", changes={"body": {"from": "no markup yet"}}
+        )
+
+        result = bot.lambda_handler(_signed_event(body, env_setup["SECRET_KEY"]), None)
+
+        assert result["statusCode"] == 200
+        assert set_allowed_labels.called
+
+
+class TestQueuedHandler:
+    """Tests for the handler created by make_queued_handler."""
+
+    def test_enqueues_event_and_returns_202(self, env_setup):
+        queue = work_queue.InMemoryQueue()
+        handler = bot.make_queued_handler(queue)
+
+        result = handler(_signed_event(jsonstring, env_setup["SECRET_KEY"]))
+
+        assert result["statusCode"] == 202
+        payload = queue.get(timeout=0).payload
+        assert bot.IssueEvent(**payload).issue_nr == 10
+
+    def test_does_not_enqueue_events_without_labels(self, env_setup):
+        queue = work_queue.InMemoryQueue()
+        handler = bot.make_queued_handler(queue)
+
+        result = handler(
+            _signed_event(_modified_body(issue_body="nothing"), env_setup["SECRET_KEY"])
+        )
+
+        assert result["statusCode"] == 200
+        assert queue.depth() == 0
+
+    def test_returns_503_when_queue_is_full(self, env_setup):
+        queue = work_queue.InMemoryQueue(max_depth=0)
+        handler = bot.make_queued_handler(queue)
+
+        result = handler(_signed_event(jsonstring, env_setup["SECRET_KEY"]))
+
+        assert result["statusCode"] == 503
+
+    def test_returns_503_when_coalescing_queue_is_full(self, env_setup):
+        queue = work_queue.CoalescingQueue(
+            work_queue.InMemoryQueue(max_depth=1), window=60
+        )
+        handler = bot.make_queued_handler(queue)
+
+        first = handler(_signed_event(jsonstring, env_setup["SECRET_KEY"]))
+        body = json.loads(jsonstring)
+        body["issue"]["number"] = 11
+        second = handler(_signed_event(json.dumps(body), env_setup["SECRET_KEY"]))
+        queue.close()
+
+        assert (first["statusCode"], second["statusCode"]) == (202, 503)
+        assert queue.stats()["dropped"] == 0
+
+    def test_edit_removing_markup_cancels_pending_event(self, env_setup):
+        queue = work_queue.CoalescingQueue(work_queue.InMemoryQueue(), window=60)
+        handler = bot.make_queued_handler(queue)
+        adds_markup = _modified_body(
+            action="edited",
+            issue_body=":label:`bug`",
+            changes={"body": {"from": "no markup"}},
+        )
+        removes_markup = _modified_body(
+            action="edited",
+            issue_body="no markup",
+            changes={"body": {"from": ":label:`bug`"}},
+        )
+
+        first = handler(_signed_event(adds_markup, env_setup["SECRET_KEY"]))
+        second = handler(_signed_event(removes_markup, env_setup["SECRET_KEY"]))
+        queue.close()
+
+        assert (first["statusCode"], second["statusCode"]) == (202, 200)
+        assert queue.depth() == 0
+
+    def test_edit_keeping_labels_replaces_pending_event(self, env_setup):
+        queue = work_queue.CoalescingQueue(work_queue.InMemoryQueue(), window=60)
+        handler = bot.make_queued_handler(queue)
+        adds_markup = _modified_body(
+            action="edited",
+            issue_body="Typo :label:`bug`",
+            changes={"body": {"from": "no markup"}},
+        )
+        fixes_typo = _modified_body(
+            action="edited",
+            issue_body="Fixed typo :label:`bug`",
+            changes={"body": {"from": "Typo :label:`bug`"}},
+        )
+
+        handler(_signed_event(adds_markup, env_setup["SECRET_KEY"]))
+        handler(_signed_event(fixes_typo, env_setup["SECRET_KEY"]))
+        queue.close()
+
+        payload = queue.get(timeout=0).payload
+        assert payload["issue_body"] == "Fixed typo :label:`bug`"
+
+
 jsonstring = """{
   "action": "reopened",
   "issue": {
@@ -0,0 +1,98 @@
+from labelbot import cache
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestExpiringCache:
+    """Tests for the ExpiringCache class."""
+
+    def test_returns_value_before_expiry(self):
+        clock = FakeClock()
+        token_cache = cache.ExpiringCache(margin=10, clock=clock)
+        token_cache.put("key", "value", expires_at=clock.now + 60)
+
+        assert token_cache.get("key") == "value"
+
+    def test_returns_none_within_margin(self):
+        clock = FakeClock()
+        token_cache = cache.ExpiringCache(margin=10, clock=clock)
+        token_cache.put("key", "value", expires_at=clock.now + 60)
+
+        clock.now += 50
+
+        assert token_cache.get("key") is None
+
+    def test_counts_hits_and_misses(self):
+        clock = FakeClock()
+        token_cache = cache.ExpiringCache(clock=clock)
+        token_cache.put("key", "value", expires_at=clock.now + 60)
+
+        token_cache.get("key")
+        token_cache.get("key")
+        token_cache.get("other key")
+
+        assert token_cache.stats() == {"hits": 2, "misses": 1, "size": 1}
+
+    def test_invalidate_removes_entry(self):
+        clock = FakeClock()
+        token_cache = cache.ExpiringCache(clock=clock)
+        token_cache.put("key", "value", expires_at=clock.now + 60)
+
+        token_cache.invalidate("key")
+
+        assert token_cache.get("key") is None
+
+    def test_time_to_stale(self):
+        clock = FakeClock()
+        token_cache = cache.ExpiringCache(margin=10, clock=clock)
+        token_cache.put("key", "value", expires_at=clock.now + 60)
+
+        clock.now += 20
+
+        assert token_cache.time_to_stale("key") == 30
+        assert token_cache.time_to_stale("other key") is None
+        assert token_cache.stats()["hits"] == token_cache.stats()["misses"] == 0
+
+
+class TestLRUCache:
+    """Tests for the LRUCache class."""
+
+    def test_evicts_least_recently_used_when_full(self):
+        lru_cache = cache.LRUCache(max_size=10, sizeof=len)
+        lru_cache.put("a", "aaaa")
+        lru_cache.put("b", "bbbb")
+        lru_cache.get("a")
+
+        lru_cache.put("c", "cccc")
+
+        assert lru_cache.get("a") == "aaaa"
+        assert lru_cache.get("b") is None
+        assert lru_cache.get("c") == "cccc"
+        assert lru_cache.stats() == {
+            "hits": 3,
+            "misses": 1,
+            "evictions": 1,
+            "size": 2,
+            "bytes": 8,
+        }
+
+    def test_replacing_value_updates_size(self):
+        lru_cache = cache.LRUCache(max_size=10, sizeof=len)
+        lru_cache.put("a", "aaaa")
+
+        lru_cache.put("a", "aa")
+
+        assert lru_cache.stats()["bytes"] == 2
+
+    def test_does_not_store_values_larger_than_cache(self):
+        lru_cache = cache.LRUCache(max_size=10, sizeof=len)
+
+        lru_cache.put("a", "a" * 11)
+
+        assert lru_cache.get("a") is None
@@ -1,17 +1,20 @@
 import json
 import contextlib
+import time
 from unittest.mock import patch
 
 import responses
 import pytest
 
 from labelbot import github_api
+from labelbot import parse
 
 OWNER = "someone"
 REPO = "best-repo"
 ISSUE_NR = 231
 ACCESS_TOKEN = "8924ab4"
 ISSUE_URL = f"{github_api.BASE_URL}/repos/{OWNER}/{REPO}/issues/{ISSUE_NR}"
+ISSUE_LABELS_URL = f"{ISSUE_URL}/labels"
 ALLOWED_LABELS_URL = f"{github_api.BASE_URL}/repos/{OWNER}/{REPO}/contents/{github_api.ALLOWED_LABELS_FILE}"
 
 
@@ -51,6 +54,23 @@ class TestSetLabels:
         )
 
 
+class TestAddLabels:
+    """Tests for the add_labels function."""
+
+    @responses.activate
+    def test_posts_only_given_labels(self):
+        responses.add(responses.POST, url=ISSUE_LABELS_URL, status=200)
+
+        assert github_api.add_labels(["bug"], OWNER, REPO, ISSUE_NR, ACCESS_TOKEN)
+        assert json.loads(responses.calls[0].request.body) == {"labels": ["bug"]}
+
+    @responses.activate
+    def test_returns_false_on_404(self):
+        responses.add(responses.POST, url=ISSUE_LABELS_URL, status=404)
+
+        assert not github_api.add_labels(["bug"], OWNER, REPO, ISSUE_NR, ACCESS_TOKEN)
+
+
 class TestGetLabels:
     """Test for the get_labels function."""
 
@@ -116,16 +136,118 @@ class TestGetFileContents:
         assert f"could not fetch {github_api.ALLOWED_LABELS_FILE}" in str(exc_info)
 
 
+class TestAllowedLabelsCache:
+    """Tests for the AllowedLabelsCache class."""
+
+    ETAG = '"f5dba9638257d949a4858ddfbd471cda77a7e416"'
+
+    @staticmethod
+    def _create_cache():
+        clock = iter(range(0, 1000, 100)).__next__
+        return github_api.AllowedLabelsCache(ttl=50, clock=clock)
+
+    @responses.activate
+    def test_fetches_and_parses_on_miss(self):
+        responses.add(
+            responses.GET,
+            url=ALLOWED_LABELS_URL,
+            body=JSON_ALLOWED_LABELS_PAYLOAD,
+            headers={"ETag": self.ETAG},
+        )
+        cache = self._create_cache()
+
+        labels = cache.get(OWNER, REPO, ACCESS_TOKEN)
+
+        assert list(labels) == ["help", "bug", "feature request"]
+        assert cache.stats() == {"hits": 0, "revalidations": 0, "misses": 1}
+
+    @responses.activate
+    def test_reuses_labels_on_not_modified(self):
+        responses.add(
+            responses.GET,
+            url=ALLOWED_LABELS_URL,
+            body=JSON_ALLOWED_LABELS_PAYLOAD,
+            headers={"ETag": self.ETAG},
+        )
+        responses.add(responses.GET, url=ALLOWED_LABELS_URL, status=304)
+        cache = self._create_cache()
+
+        first = cache.get(OWNER, REPO, ACCESS_TOKEN)
+        second = cache.get(OWNER, REPO, ACCESS_TOKEN)
+
+        assert first == second
+        assert responses.calls[1].request.headers["If-None-Match"] == self.ETAG
+        assert cache.stats() == {"hits": 0, "revalidations": 1, "misses": 1}
+
+    @responses.activate
+    def test_skips_revalidation_within_ttl(self):
+        responses.add(
+            responses.GET, url=ALLOWED_LABELS_URL, body=JSON_ALLOWED_LABELS_PAYLOAD
+        )
+        cache = github_api.AllowedLabelsCache(ttl=50, clock=lambda: 0)
+
+        cache.get(OWNER, REPO, ACCESS_TOKEN)
+        cache.get(OWNER, REPO, ACCESS_TOKEN)
+
+        assert len(responses.calls) == 1
+        assert cache.stats() == {"hits": 1, "revalidations": 0, "misses": 1}
+
+    @responses.activate
+    def test_revalidates_in_background_ahead_of_ttl(self):
+        responses.add(
+            responses.GET,
+            url=ALLOWED_LABELS_URL,
+            body=JSON_ALLOWED_LABELS_PAYLOAD,
+            headers={"ETag": self.ETAG},
+        )
+        responses.add(responses.GET, url=ALLOWED_LABELS_URL, status=304)
+        now = [0]
+        cache = github_api.AllowedLabelsCache(
+            ttl=50, clock=lambda: now[0], refresh_ahead=10
+        )
+
+        first = cache.get(OWNER, REPO, ACCESS_TOKEN)
+        now[0] = 45
+        second = cache.get(OWNER, REPO, ACCESS_TOKEN)
+        while len(responses.calls) < 2 or cache.flights.stats()["in_flight"]:
+            time.sleep(0.001)
+
+        assert first is second
+        assert responses.calls[1].request.headers["If-None-Match"] == self.ETAG
+        assert cache.stats() == {"hits": 1, "revalidations": 1, "misses": 1}
+        # the revalidation restarted the ttl
+        assert not cache.needs_refresh(OWNER, REPO)
+
+    @responses.activate
+    def test_reuses_matcher_of_identical_file_in_other_repo(self, mocker):
+        other_url = ALLOWED_LABELS_URL.replace(f"/{REPO}/", "/other-repo/")
+        for url in (ALLOWED_LABELS_URL, other_url):
+            responses.add(responses.GET, url=url, body=JSON_ALLOWED_LABELS_PAYLOAD)
+        parse.MATCHER_CACHE.invalidate()
+        decode_contents = mocker.spy(github_api, "_decode_contents")
+        cache = self._create_cache()
+
+        first = cache.get(OWNER, REPO, ACCESS_TOKEN)
+        second = cache.get(OWNER, "other-repo", ACCESS_TOKEN)
+
+        assert first is second
+        assert decode_contents.call_count == 1
+
+
 class TestSetAllowedLabels:
     """Tests for set_allowed_labels."""
 
     @contextlib.contextmanager
-    def _mocked_apis(self, allowed_labels, wanted_labels, set_labels_result):
+    def _mocked_apis(
+        self, allowed_labels, wanted_labels, add_labels_result, repo_labels=None
+    ):
         """All apis mocked out returning the specified values. Yields the
-        set_labels mock.
+        add_labels mock. The repo has the allowed labels, unless other labels
+        are given.
         """
+        repo_labels = allowed_labels if repo_labels is None else repo_labels
         with patch(
-            "labelbot.github_api.parse.parse_allowed_labels",
+            "labelbot.github_api.get_allowed_labels",
             autospec=True,
             return_value=allowed_labels,
         ), patch(
@@ -133,31 +255,192 @@ class TestSetAllowedLabels:
             autospec=True,
             return_value=wanted_labels,
         ), patch(
-            "labelbot.github_api.get_file_contents", autospec=True, return_value=""
+            "labelbot.github_api.get_label_catalog",
+            autospec=True,
+            return_value=github_api.LabelCatalog(repo_labels),
         ):
             with patch(
-                "labelbot.github_api.set_labels", autospec=True, return_value=True
-            ) as set_labels:
-                yield set_labels
+                "labelbot.github_api.add_labels",
+                autospec=True,
+                return_value=add_labels_result,
+            ) as add_labels:
+                yield add_labels
 
     def test_happy_path(self):
         current_labels = ["enhancement"]
         allowed_labels = ["bug", "feature request"]
         wanted_labels = ["feature request", "help", "feature"]
-        expected_labels = {"enhancement", "feature request"}
+        expected_labels = {"feature request"}
 
         with self._mocked_apis(
-            allowed_labels, wanted_labels, set_labels_result=True
-        ) as set_labels:
+            allowed_labels, wanted_labels, add_labels_result=True
+        ) as add_labels:
             res = github_api.set_allowed_labels(
                 OWNER, REPO, ISSUE_NR, "", current_labels, ACCESS_TOKEN
             )
 
         assert res
-        set_labels.assert_called_once_with(
+        add_labels.assert_called_once_with(
             expected_labels, OWNER, REPO, ISSUE_NR, ACCESS_TOKEN
         )
 
+    def test_skips_write_when_labels_are_already_set(self):
+        current_labels = ["enhancement", "bug"]
+        allowed_labels = ["bug", "feature request"]
+        wanted_labels = ["bug"]
+
+        with self._mocked_apis(
+            allowed_labels, wanted_labels, add_labels_result=True
+        ) as add_labels:
+            res = github_api.set_allowed_labels(
+                OWNER, REPO, ISSUE_NR, "", current_labels, ACCESS_TOKEN
+            )
+
+        assert res
+        assert not add_labels.called
+
+    def test_adds_allow_list_spelling_of_case_insensitive_match(self):
+        current_labels = ["Enhancement"]
+        allowed_labels = parse.AllowListMatcher(
+            ["Bug", "enhancement"], case_insensitive=True
+        )
+        wanted_labels = ["bug", "ENHANCEMENT"]
+
+        with self._mocked_apis(
+            allowed_labels, wanted_labels, add_labels_result=True
+        ) as add_labels:
+            github_api.set_allowed_labels(
+                OWNER, REPO, ISSUE_NR, "", current_labels, ACCESS_TOKEN
+            )
+
+        add_labels.assert_called_once_with({"Bug"}, OWNER, REPO, ISSUE_NR, ACCESS_TOKEN)
+
+    def test_skips_write_of_labels_missing_in_repo(self):
+        allowed_labels = ["bug", "feature request"]
+        wanted_labels = ["bug", "feature request"]
+
+        with self._mocked_apis(
+            allowed_labels,
+            wanted_labels,
+            add_labels_result=True,
+            repo_labels=["enhancement"],
+        ) as add_labels:
+            res = github_api.set_allowed_labels(
+                OWNER, REPO, ISSUE_NR, "", [], ACCESS_TOKEN
+            )
+
+        assert res
+        assert not add_labels.called
+
+    def test_adds_repo_spelling_of_labels(self):
+        allowed_labels = parse.AllowListMatcher(["bug", "help"], case_insensitive=True)
+        wanted_labels = ["BUG", "help"]
+
+        with self._mocked_apis(
+            allowed_labels,
+            wanted_labels,
+            add_labels_result=True,
+            repo_labels=["Bug"],
+        ) as add_labels:
+            github_api.set_allowed_labels(OWNER, REPO, ISSUE_NR, "", [], ACCESS_TOKEN)
+
+        add_labels.assert_called_once_with({"Bug"}, OWNER, REPO, ISSUE_NR, ACCESS_TOKEN)
+
+
+class TestLabelCatalog:
+    """Tests for LabelCatalog."""
+
+    def test_matches_regardless_of_case(self):
+        catalog = github_api.LabelCatalog(["Bug", "feature request"])
+
+        assert catalog.match("bug") == "Bug"
+        assert catalog.match("Feature Request") == "feature request"
+        assert catalog.match("help") is None
+        assert "BUG" in catalog
+        assert len(catalog) == 2
+
+    def test_filter_returns_existing_labels_as_spelled_in_repo(self):
+        catalog = github_api.LabelCatalog(["Bug", "help"])
+
+        assert catalog.filter(["bug", "HELP", "nope"]) == {"Bug", "help"}
+
+
+REPO_LABELS_URL = f"{github_api.BASE_URL}/repos/{OWNER}/{REPO}/labels"
+
+
+class TestLabelCatalogCache:
+    """Tests for LabelCatalogCache."""
+
+    @pytest.fixture
+    def clock(self):
+        now = [0.0]
+        clock = lambda: now[0]
+        clock.advance = lambda seconds: now.__setitem__(0, now[0] + seconds)
+        return clock
+
+    @pytest.fixture
+    def catalog_cache(self, clock):
+        return github_api.LabelCatalogCache(ttl=60, clock=clock)
+
+    @responses.activate
+    def test_follows_pagination(self, catalog_cache):
+        responses.add(
+            responses.GET,
+            REPO_LABELS_URL,
+            json=[{"name": "bug"}],
+            headers={"Link": f'<{REPO_LABELS_URL}?page=2>; rel="next"'},
+            match=[responses.matchers.query_param_matcher({"per_page": "100"})],
+        )
+        responses.add(
+            responses.GET,
+            REPO_LABELS_URL,
+            json=[{"name": "help"}],
+            match=[responses.matchers.query_param_matcher({"page": "2"})],
+        )
+
+        catalog = catalog_cache.get(OWNER, REPO, ACCESS_TOKEN)
+
+        assert sorted(catalog) == ["bug", "help"]
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_uses_cached_labels_until_ttl_expires(self, catalog_cache, clock):
+        responses.add(responses.GET, REPO_LABELS_URL, json=[{"name": "bug"}])
+
+        catalog_cache.get(OWNER, REPO, ACCESS_TOKEN)
+        clock.advance(59)
+        catalog_cache.get(OWNER, REPO, ACCESS_TOKEN)
+        assert len(responses.calls) == 1
+
+        clock.advance(1)
+        catalog_cache.get(OWNER, REPO, ACCESS_TOKEN)
+        assert len(responses.calls) == 2
+        assert catalog_cache.stats() == {"hits": 1, "misses": 2, "size": 1}
+
+    @responses.activate
+    def test_invalidate_removes_labels_of_repo(self, catalog_cache):
+        responses.add(responses.GET, REPO_LABELS_URL, json=[{"name": "bug"}])
+        catalog_cache.get(OWNER, REPO, ACCESS_TOKEN)
+
+        catalog_cache.invalidate(OWNER, REPO)
+
+        assert catalog_cache.lookup(OWNER, REPO) is None
+
+    def test_put_discards_labels_fetched_before_invalidation(self, catalog_cache):
+        generation = catalog_cache.generation
+        catalog_cache.invalidate(OWNER, REPO)
+
+        catalog_cache.put(OWNER, REPO, github_api.LabelCatalog(["bug"]), generation)
+
+        assert catalog_cache.lookup(OWNER, REPO) is None
+
+    @responses.activate
+    def test_raises_on_failed_fetch(self, catalog_cache):
+        responses.add(responses.GET, REPO_LABELS_URL, status=404)
+
+        with pytest.raises(github_api.APIError):
+            catalog_cache.get(OWNER, REPO, ACCESS_TOKEN)
+
 
 ALLOWED_LABELS_CONTENT = "# labels that the labelbot are allowed to set\n# at the behest of users without read-access\nhelp\nbug\nfeature request\n"
 
@@ -0,0 +1,190 @@
+import json
+
+import pytest
+import responses
+
+from labelbot import github_api
+from labelbot import graphql
+from labelbot import parse
+
+OWNER = "someone"
+REPO = "best-repo"
+ISSUE_NR = 231
+ACCESS_TOKEN = "8924ab4"
+GRAPHQL_URL = f"{github_api.BASE_URL}/graphql"
+ALLOWED_LABELS = "help\nbug\nfeature request\n"
+
+
+class GraphQLStub:
+    """A stand-in for the GraphQL API of a repo with the given labels and
+    .allowed-labels file, and an issue with the given labels.
+    """
+
+    def __init__(self, repo_labels, issue_labels=(), allowed_labels=ALLOWED_LABELS):
+        self.repo_labels = {label.casefold(): label for label in repo_labels}
+        self.issue_labels = list(issue_labels)
+        self.allowed_labels = allowed_labels
+        self.requests = []
+        self.mutation_errors = []
+
+    def __call__(self, request):
+        body = json.loads(request.body)
+        self.requests.append(body)
+        if body["query"].startswith("mutation"):
+            if self.mutation_errors:
+                return 200, {}, json.dumps({"errors": self.mutation_errors})
+            data = {"addLabelsToLabelable": {"clientMutationId": None}}
+            return 200, {}, json.dumps({"data": data})
+
+        variables = body["variables"]
+        assert variables["expression"] == "HEAD:.allowed-labels"
+        blob = None
+        if self.allowed_labels is not None:
+            blob = {
+                "oid": parse.blob_sha(self.allowed_labels.encode()),
+                "text": self.allowed_labels,
+            }
+        repository = {
+            "allowedLabels": blob,
+            "issue": {
+                "id": "I_231",
+                "labels": {"nodes": [{"name": name} for name in self.issue_labels]},
+            },
+        }
+        for name, value in variables.items():
+            if name.startswith("label"):
+                label = self.repo_labels.get(value.casefold())
+                repository[name] = label and {"id": f"LA_{label}", "name": label}
+        return 200, {}, json.dumps({"data": {"repository": repository}})
+
+
+@pytest.fixture
+def stub():
+    with responses.RequestsMock(
+        assert_all_requests_are_fired=False
+    ) as mocked_responses:
+        graphql_stub = GraphQLStub(repo_labels=["help", "bug", "feature request"])
+        mocked_responses.add_callback(
+            responses.POST, GRAPHQL_URL, callback=graphql_stub
+        )
+        graphql_stub.responses = mocked_responses
+        yield graphql_stub
+
+
+def test_adds_labels_with_one_query_and_one_mutation(stub):
+    result = graphql.set_allowed_labels(
+        OWNER,
+        REPO,
+        ISSUE_NR,
+        ":label:`bug` :label:`help` :label:`nope`",
+        [],
+        ACCESS_TOKEN,
+    )
+
+    assert result
+    query, mutation = stub.requests
+    assert query["variables"] == {
+        "owner": OWNER,
+        "repo": REPO,
+        "number": ISSUE_NR,
+        "expression": "HEAD:.allowed-labels",
+        "label0": "bug",
+        "label1": "help",
+        "label2": "nope",
+    }
+    assert mutation["variables"] == {
+        "labelableId": "I_231",
+        "labelIds": ["LA_bug", "LA_help"],
+    }
+
+
+def test_skips_labels_set_according_to_webhook(stub):
+    result = graphql.set_allowed_labels(
+        OWNER, REPO, ISSUE_NR, ":label:`bug`", ["bug"], ACCESS_TOKEN
+    )
+
+    assert result
+    assert not stub.requests
+
+
+def test_skips_mutation_when_labels_are_already_set(stub):
+    stub.issue_labels = ["bug"]
+
+    result = graphql.set_allowed_labels(
+        OWNER, REPO, ISSUE_NR, ":label:`bug`", [], ACCESS_TOKEN
+    )
+
+    assert result
+    assert len(stub.requests) == 1
+
+
+def test_skips_labels_missing_in_repo(stub):
+    stub.repo_labels.pop("feature request")
+
+    result = graphql.set_allowed_labels(
+        OWNER,
+        REPO,
+        ISSUE_NR,
+        ":label:`bug` :label:`feature request`",
+        [],
+        ACCESS_TOKEN,
+    )
+
+    assert result
+    assert stub.requests[1]["variables"]["labelIds"] == ["LA_bug"]
+    assert len(stub.responses.calls) == 2
+
+
+def test_skips_mutation_when_no_label_exists_in_repo(stub):
+    stub.repo_labels.clear()
+
+    result = graphql.set_allowed_labels(
+        OWNER, REPO, ISSUE_NR, ":label:`bug`", [], ACCESS_TOKEN
+    )
+
+    assert result
+    assert len(stub.requests) == 1
+
+
+def test_raises_without_allowed_labels_file(stub):
+    stub.allowed_labels = None
+
+    with pytest.raises(github_api.APIError):
+        graphql.set_allowed_labels(
+            OWNER, REPO, ISSUE_NR, ":label:`bug`", [], ACCESS_TOKEN
+        )
+
+
+def test_returns_false_on_mutation_error(stub):
+    stub.mutation_errors = [{"message": "Resource not accessible by integration"}]
+
+    result = graphql.set_allowed_labels(
+        OWNER, REPO, ISSUE_NR, ":label:`bug`", [], ACCESS_TOKEN
+    )
+
+    assert not result
+
+
+@responses.activate
+def test_raises_on_query_errors():
+    responses.add(
+        responses.POST,
+        GRAPHQL_URL,
+        json={
+            "data": None,
+            "errors": [{"message": "Could not resolve to a Repository"}],
+        },
+    )
+
+    with pytest.raises(github_api.APIError) as exc_info:
+        graphql.get_issue_label_state(OWNER, REPO, ISSUE_NR, ["bug"], ACCESS_TOKEN)
+
+    assert "Could not resolve to a Repository" in str(exc_info.value)
+
+
+def test_query_declares_one_variable_per_label():
+    query = graphql._query(2)
+
+    assert "$label0: String!, $label1: String!" in query
+    assert "label1: label(name: $label1) { id name }" in query
+    assert "$label2" not in query
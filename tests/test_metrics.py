@@ -0,0 +1,135 @@
+import contextlib
+import json
+
+import pytest
+
+from labelbot import bot
+from labelbot import metrics
+
+
+@pytest.fixture
+def lines():
+    """Enable JSON output, and collect the emitted lines."""
+    emitted = []
+    metrics.configure("json", sink=emitted.append)
+    yield emitted
+    metrics.configure(None)
+
+
+@metrics.timed("double")
+def _double(value):
+    return value * 2
+
+
+class TestDisabled:
+    """Tests for instrumentation when output is disabled."""
+
+    def test_event_yields_no_record(self):
+        with metrics.event("webhook") as record:
+            metrics.increment("things")
+            assert _double(2) == 4
+
+        assert record is None
+
+    def test_unknown_format_is_rejected(self):
+        with pytest.raises(ValueError):
+            metrics.configure("xml")
+
+
+class TestJsonOutput:
+    """Tests for records emitted as plain JSON."""
+
+    def test_emits_one_record_per_event(self, lines):
+        with metrics.event("webhook", repo="best-repo"):
+            _double(1)
+            _double(2)
+            with metrics.stage("other"):
+                pass
+            metrics.increment("things", 3)
+            metrics.record_request(200, bytes_sent=10, bytes_received=100)
+            metrics.record_request(404, bytes_sent=0, bytes_received=20)
+            metrics.set_property("status_code", 200)
+
+        assert len(lines) == 1
+        record = json.loads(lines[0])
+        assert record["event"] == "webhook"
+        assert record["repo"] == "best-repo"
+        assert record["status_code"] == 200
+        assert record["stages"]["double"]["calls"] == 2
+        assert record["stages"]["other"]["calls"] == 1
+        assert record["counters"] == {
+            "things": 3,
+            "github_calls": 2,
+            "github_sent_bytes": 10,
+            "github_received_bytes": 120,
+            "github_errors": 1,
+        }
+
+    def test_nothing_is_recorded_outside_events(self, lines):
+        _double(1)
+        metrics.increment("things")
+
+        assert lines == []
+
+    def test_lambda_handler_emits_record(self, lines, monkeypatch):
+        monkeypatch.setenv("SECRET_KEY", "secret")
+        event = {"headers": {"X-Hub-Signature": "sha1=bogus"}, "body": "{}"}
+
+        bot.lambda_handler(event, None)
+
+        record = json.loads(lines[0])
+        assert record["status_code"] == 403
+        assert "triage" in record["stages"]
+
+
+def test_emf_output_declares_metrics():
+    emitted = []
+    metrics.configure("emf", sink=emitted.append)
+    try:
+        with metrics.event("webhook"):
+            _double(1)
+            metrics.record_request(200, bytes_sent=0, bytes_received=10)
+    finally:
+        metrics.configure(None)
+
+    record = json.loads(emitted[0])
+    declaration = record["_aws"]["CloudWatchMetrics"][0]
+    units = {metric["Name"]: metric["Unit"] for metric in declaration["Metrics"]}
+    assert declaration["Namespace"] == metrics.NAMESPACE
+    assert declaration["Dimensions"] == [["Event"]]
+    assert record["Event"] == "webhook"
+    assert units["double_time"] == "Milliseconds"
+    assert units["github_received_bytes"] == "Bytes"
+    assert units["github_calls"] == "Count"
+    assert record["github_received_bytes"] == 10
+
+
+def test_tracers_span_events_and_stages():
+    spans = []
+
+    @contextlib.contextmanager
+    def tracer(name):
+        spans.append(name)
+        yield
+
+    metrics.add_tracer(tracer)
+    try:
+        with metrics.event("webhook"):
+            _double(1)
+    finally:
+        metrics.remove_tracer(tracer)
+
+    assert spans == ["webhook", "double"]
+
+
+def test_only_first_record_is_cold_start(lines, monkeypatch):
+    monkeypatch.setattr(metrics, "_cold_start", True)
+
+    with metrics.event("webhook"):
+        pass
+    with metrics.event("webhook"):
+        pass
+
+    first, second = map(json.loads, lines)
+    assert first["cold_start"] and first["init_ms"] > 0
+    assert not second["cold_start"] and "init_ms" not in second
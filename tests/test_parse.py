@@ -56,3 +56,143 @@ EMPTY_LABELS_TEXT = ""
 def test_parse_allowed_labels_correctly_parses_labeles(text, expected_labels):
     actual_labels = parse.parse_allowed_labels(text)
     assert sorted(actual_labels) == sorted(expected_labels)
+
+
+class TestScanWantedLabels:
+    """Tests for the scan_wanted_labels function."""
+
+    def test_removes_duplicates_in_order(self):
+        text = ":label:`b` :label:`a` :label:`b`"
+
+        assert parse.scan_wanted_labels(text) == ["b", "a"]
+
+    def test_scans_bytes(self):
+        text = ":label:`bug` :label:`räksmörgås`".encode("utf8")
+
+        assert parse.scan_wanted_labels(text) == ["bug", "räksmörgås"]
+
+    def test_token_does_not_span_lines(self):
+        text = ":label:`not\na label` :label:`label`"
+
+        assert parse.scan_wanted_labels(text) == ["label"]
+
+    @pytest.mark.parametrize("as_bytes", [False, True], ids=["str", "bytes"])
+    def test_skips_fenced_code_blocks(self, as_bytes):
+        text = """:label:`before`
+```python
+# :label:`in code`
+```
+~~~
+:label:`in tildes`
+~~~
+:label:`after`
+"""
+        if as_bytes:
+            text = text.encode("utf8")
+
+        labels = parse.scan_wanted_labels(text, skip_code_blocks=True)
+
+        assert labels == ["before", "after"]
+
+    def test_unclosed_code_block_runs_to_end(self):
+        text = ":label:`before`\n```\n:label:`in code`\n"
+
+        assert parse.scan_wanted_labels(text, skip_code_blocks=True) == ["before"]
+
+    def test_stops_after_max_tokens(self):
+        text = " ".join(f":label:`{i}`" for i in range(10))
+
+        assert parse.scan_wanted_labels(text, max_tokens=3) == ["0", "1", "2"]
+
+    def test_stops_after_max_length(self):
+        text = ":label:`first`" + " " * 100 + ":label:`second`"
+
+        assert parse.scan_wanted_labels(text, max_length=100) == ["first"]
+
+
+class TestAllowListMatcher:
+    """Tests for the AllowListMatcher class."""
+
+    def test_matches_exact_entries(self):
+        matcher = parse.AllowListMatcher(["bug", "help wanted"])
+
+        assert "bug" in matcher
+        assert "help wanted" in matcher
+        assert "Bug" not in matcher
+        assert "bugs" not in matcher
+
+    def test_matches_prefix_entries(self):
+        matcher = parse.AllowListMatcher(["glob:area/*", "bug"])
+
+        assert matcher.match("area/parser") == "area/parser"
+        assert matcher.match("area/") == "area/"
+        assert matcher.match("area") is None
+        assert matcher.match("other/parser") is None
+
+    def test_matches_glob_entries(self):
+        matcher = parse.AllowListMatcher(
+            ["glob:priority-[123]", "glob:*-needed", "glob:v?"]
+        )
+
+        assert "priority-2" in matcher
+        assert "priority-4" not in matcher
+        assert "docs-needed" in matcher
+        assert "v1" in matcher
+        assert "v10" not in matcher
+
+    def test_case_insensitive_returns_allow_list_spelling(self):
+        matcher = parse.AllowListMatcher(["Bug", "glob:Area/*"], case_insensitive=True)
+
+        assert matcher.match("BUG") == "Bug"
+        assert matcher.match("area/Parser") == "area/Parser"
+
+    def test_entries_with_glob_characters_are_literal_labels(self):
+        matcher = parse.AllowListMatcher(["[bug]", "help wanted?", "wip*"])
+
+        assert matcher.match("[bug]") == "[bug]"
+        assert matcher.match("b") is None
+        assert matcher.match("help wanted?") == "help wanted?"
+        assert matcher.match("help wantedX") is None
+        assert matcher.match("wip*") == "wip*"
+        assert matcher.match("wipe") is None
+
+    def test_exact_match_is_tried_before_glob_patterns(self):
+        matcher = parse.AllowListMatcher(["Area/[x]", "glob:area/*"])
+
+        assert matcher.match("Area/[x]") == "Area/[x]"
+        assert matcher.match("glob:area/*") == "glob:area/*"
+        assert matcher.match("area/y") == "area/y"
+
+    def test_iterates_over_entries(self):
+        entries = ["bug", "glob:area/*"]
+
+        assert list(parse.AllowListMatcher(entries)) == entries
+
+
+def test_compile_allowed_labels_reuses_matcher_for_same_contents():
+    first = parse.compile_allowed_labels("bug\nhelp\n")
+    second = parse.compile_allowed_labels("bug\nhelp\n")
+    case_insensitive = parse.compile_allowed_labels("bug\nhelp\n", True)
+
+    assert first is second
+    assert case_insensitive is not first
+    assert list(first) == ["bug", "help"]
+
+
+def test_blob_sha_matches_git():
+    assert parse.blob_sha(b"") == "e69de29bb2d1d6434b8b29ae775ad8c2e48c5391"
+    assert parse.blob_sha(b"hello\n") == "ce013625030ba8dba906f756967f9e9ca394464a"
+
+
+def test_compile_allowed_labels_by_sha_only_loads_unknown_files():
+    loaded = []
+
+    def load_text():
+        loaded.append(True)
+        return "bug\n"
+
+    first = parse.compile_allowed_labels_by_sha("0" * 40, load_text)
+    second = parse.compile_allowed_labels_by_sha("0" * 40, load_text)
+
+    assert first is second
+    assert len(loaded) == 1
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from labelbot import payload
+
+ISSUE_EVENT = {
+    "action": "opened",
+    "issue": {
+        "number": 10,
+        "labels": [{"name": "bug"}, {"name": "help"}],
+        "body": ":label:`kaka`",
+    },
+    "repository": {"name": "testrepo", "owner": {"login": "jcroona"}},
+    "sender": {"login": "jcroona"},
+    "installation": {"id": 825958},
+}
+
+
+@pytest.fixture(params=["orjson", "json"])
+def decoder(request, monkeypatch):
+    """Run a test with both orjson (if installed) and the standard library."""
+    if request.param == "orjson":
+        orjson = pytest.importorskip("orjson")
+        monkeypatch.setattr(payload, "_loads", orjson.loads)
+    else:
+        monkeypatch.setattr(payload, "_loads", json.loads)
+
+
+@pytest.mark.parametrize("encode", [False, True])
+def test_extracts_fields(decoder, encode):
+    body = json.dumps(ISSUE_EVENT, indent=2)
+    webhook = payload.WebhookPayload(body.encode() if encode else body)
+
+    assert webhook.action == "opened"
+    assert webhook.is_issue_event
+    assert webhook.installation_id == 825958
+    assert webhook.owner == "jcroona"
+    assert webhook.repo == "testrepo"
+    assert webhook.issue_nr == 10
+    assert webhook.issue_body == ":label:`kaka`"
+    assert webhook.label_names == ["bug", "help"]
+    assert not webhook.has_changes
+
+
+@pytest.mark.parametrize("encode", [False, True])
+def test_reads_leading_action_without_decoding(encode, mocker):
+    decode = mocker.spy(payload, "decode")
+    body = json.dumps({**ISSUE_EVENT, "action": "closed"})
+    webhook = payload.WebhookPayload(body.encode() if encode else body)
+
+    assert webhook.action == "closed"
+    assert not webhook.is_decoded
+    assert not decode.called
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        json.dumps({"issue": {}, "action": "opened"}),
+        '{"action": "op\\u0065ned", "issue": {}}',
+    ],
+    ids=["action not first", "escaped action"],
+)
+def test_decodes_to_read_other_actions(decoder, body):
+    webhook = payload.WebhookPayload(body)
+
+    assert webhook.action == "opened"
+    assert webhook.is_decoded
+
+
+def test_missing_action_is_none(decoder):
+    webhook = payload.WebhookPayload('{"zen": "Keep it logically awesome."}')
+
+    assert webhook.action is None
+    assert not webhook.is_issue_event
+
+
+def test_issue_body_of_none_is_empty(decoder):
+    event = {**ISSUE_EVENT, "issue": {**ISSUE_EVENT["issue"], "body": None}}
+
+    assert payload.WebhookPayload(json.dumps(event)).issue_body == ""
+
+
+@pytest.mark.parametrize(
+    "changes, expected",
+    [
+        ({"body": {"from": "old body"}}, "old body"),
+        ({"body": {"from": None}}, ""),
+        ({"title": {"from": "old title"}}, ":label:`kaka`"),
+    ],
+)
+def test_previous_issue_body(decoder, changes, expected):
+    webhook = payload.WebhookPayload(json.dumps({**ISSUE_EVENT, "changes": changes}))
+
+    assert webhook.has_changes
+    assert webhook.previous_issue_body == expected
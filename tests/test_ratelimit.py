@@ -0,0 +1,143 @@
+import responses
+
+from labelbot import ratelimit
+from labelbot import transport
+
+URL = "https://api.github.com/repos/someone/best-repo/issues/1"
+KEY = "token 8924ab4"
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def _create_limiter(clock, **kwargs):
+    return ratelimit.RateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+class TestRateLimiter:
+    """Tests for the RateLimiter class."""
+
+    def test_does_not_delay_with_plenty_of_budget(self):
+        clock = FakeClock()
+        limiter = _create_limiter(clock, reserve=10)
+        limiter.update(
+            KEY,
+            200,
+            {"X-RateLimit-Remaining": "4000", "X-RateLimit-Reset": "2000"},
+        )
+
+        assert limiter.wait(KEY) == 0
+
+    def test_spreads_out_remaining_budget(self):
+        clock = FakeClock()
+        limiter = _create_limiter(clock, reserve=10, max_wait=1000)
+        limiter.update(
+            KEY, 200, {"X-RateLimit-Remaining": "5", "X-RateLimit-Reset": "1100"}
+        )
+
+        assert limiter.wait(KEY) == 20
+
+    def test_waits_for_retry_after(self):
+        clock = FakeClock()
+        limiter = _create_limiter(clock, max_wait=1000)
+
+        throttled = limiter.update(KEY, 403, {"Retry-After": "30"})
+
+        assert throttled
+        assert limiter.wait(KEY) == 30
+        assert limiter.stats() == {
+            "waits": 1,
+            "wait_seconds": 30,
+            "throttled": 1,
+            "budgets": 1,
+        }
+
+    def test_caps_delay_at_max_wait(self):
+        clock = FakeClock()
+        limiter = _create_limiter(clock, max_wait=2)
+        limiter.update(
+            KEY, 403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1600"}
+        )
+
+        assert limiter.wait(KEY) == 2
+
+    def test_caps_total_delay_at_wait_budget(self):
+        clock = FakeClock()
+        limiter = _create_limiter(clock, max_wait=5)
+        limiter.update(
+            KEY, 403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1600"}
+        )
+
+        with ratelimit.wait_budget(7):
+            delays = [limiter.wait(KEY) for _ in range(3)]
+            assert limiter.max_delay() == 0
+
+        assert delays == [5, 2, 0]
+        assert limiter.max_delay() == 5
+
+    def test_removes_budgets_that_have_been_reset(self):
+        clock = FakeClock()
+        limiter = _create_limiter(clock)
+        for i in range(3):
+            limiter.update(
+                f"token {i}",
+                200,
+                {"X-RateLimit-Remaining": "4000", "X-RateLimit-Reset": "1100"},
+            )
+        limiter.update("blocked", 429, {"Retry-After": "3600"})
+        assert limiter.stats()["budgets"] == 4
+
+        clock.now = 1100 + ratelimit.SWEEP_INTERVAL
+        limiter.update(KEY, 200, {})
+
+        assert limiter.stats()["budgets"] == 2
+        assert limiter.backoff("blocked") > 0
+
+
+@responses.activate
+def test_session_retries_after_short_backoff():
+    clock = FakeClock()
+    session = transport.Session(rate_limiter=_create_limiter(clock))
+    responses.add(responses.GET, URL, status=429, headers={"Retry-After": "1"})
+    responses.add(responses.GET, URL, status=200)
+
+    response = session.get(URL, headers={"Authorization": KEY})
+
+    assert response.status_code == 200
+    assert clock.slept == [1]
+
+
+@responses.activate
+def test_session_does_not_retry_after_long_backoff():
+    clock = FakeClock()
+    session = transport.Session(rate_limiter=_create_limiter(clock, max_wait=5))
+    responses.add(responses.GET, URL, status=429, headers={"Retry-After": "60"})
+
+    response = session.get(URL, headers={"Authorization": KEY})
+
+    assert response.status_code == 429
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_session_does_not_retry_beyond_wait_budget():
+    clock = FakeClock()
+    session = transport.Session(rate_limiter=_create_limiter(clock, max_wait=5))
+    responses.add(responses.GET, URL, status=429, headers={"Retry-After": "3"})
+
+    with ratelimit.wait_budget(2):
+        response = session.get(URL, headers={"Authorization": KEY})
+
+    assert response.status_code == 429
+    assert len(responses.calls) == 1
+    assert clock.slept == []
@@ -0,0 +1,107 @@
+import concurrent.futures
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+from labelbot import bot
+from labelbot import server
+
+
+@pytest.fixture
+def run_server():
+    servers = []
+
+    def start(event_handler, workers=4):
+        webhook_server = server.WebhookServer(
+            ("127.0.0.1", 0), workers=workers, event_handler=event_handler
+        )
+        thread = threading.Thread(target=webhook_server.serve_forever)
+        thread.start()
+        servers.append((webhook_server, thread))
+        host, port = webhook_server.server_address
+        return webhook_server, f"http://{host}:{port}/"
+
+    yield start
+
+    for webhook_server, thread in servers:
+        webhook_server.shutdown()
+        webhook_server.server_close()
+        thread.join()
+
+
+def test_passes_event_to_handler(run_server):
+    events = []
+
+    def event_handler(event):
+        events.append(event)
+        return {"statusCode": 200, "body": json.dumps("ok")}
+
+    _, url = run_server(event_handler)
+
+    response = requests.post(
+        url, data='{"action": "opened"}', headers={"X-Hub-Signature": "sha1=abc"}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == "ok"
+    assert events[0]["body"] == b'{"action": "opened"}'
+    assert events[0]["headers"]["x-hub-signature"] == "sha1=abc"
+
+
+def test_rejects_body_that_is_not_utf8_with_403(run_server, monkeypatch):
+    monkeypatch.setenv("SECRET_KEY", "secret")
+    _, url = run_server(lambda event: bot.lambda_handler(event, None))
+
+    response = requests.post(
+        url, data=b'{"action": "\xff"}', headers={"X-Hub-Signature-256": "sha256=0"}
+    )
+
+    assert response.status_code == 403
+
+
+def test_returns_500_on_handler_error(run_server):
+    def event_handler(event):
+        raise RuntimeError("oops")
+
+    _, url = run_server(event_handler)
+
+    assert requests.post(url, data="{}").status_code == 500
+
+
+def test_handles_requests_concurrently(run_server):
+    barrier = threading.Barrier(4, timeout=5)
+
+    def event_handler(event):
+        barrier.wait()
+        return {"statusCode": 200, "body": "{}"}
+
+    _, url = run_server(event_handler, workers=4)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        statuses = list(
+            executor.map(lambda _: requests.post(url).status_code, range(4))
+        )
+
+    assert statuses == [200] * 4
+
+
+def test_close_waits_for_in_flight_requests(run_server):
+    finished = []
+
+    def event_handler(event):
+        time.sleep(0.2)
+        finished.append(event)
+        return {"statusCode": 200, "body": "{}"}
+
+    webhook_server, url = run_server(event_handler)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(requests.post, url, data="{}")
+        time.sleep(0.05)
+        webhook_server.shutdown()
+        webhook_server.server_close()
+
+        assert finished
+        assert future.result().status_code == 200
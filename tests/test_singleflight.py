@@ -0,0 +1,241 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from labelbot import singleflight
+
+
+class TestSingleFlight:
+    """Tests for the thread based SingleFlight."""
+
+    def test_concurrent_calls_share_one_call(self):
+        flights = singleflight.SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(None)
+            release.wait()
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(flights.do("key", fetch)))
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        while flights.stats()["shared"] < len(threads) - 1:
+            pass
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert results == ["value"] * len(threads)
+        assert len(calls) == 1
+        assert flights.stats() == {
+            "calls": 1,
+            "shared": len(threads) - 1,
+            "refreshes": 0,
+            "in_flight": 0,
+        }
+
+    def test_sequential_calls_are_not_shared(self):
+        flights = singleflight.SingleFlight()
+        values = iter(range(10))
+
+        first = flights.do("key", lambda: next(values))
+        second = flights.do("key", lambda: next(values))
+
+        assert (first, second) == (0, 1)
+
+    def test_exception_is_raised_in_all_callers(self):
+        flights = singleflight.SingleFlight()
+        release = threading.Event()
+        errors = []
+
+        def fetch():
+            release.wait()
+            raise ValueError("failed")
+
+        def call():
+            try:
+                flights.do("key", fetch)
+            except ValueError as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while flights.stats()["shared"] < len(threads) - 1:
+            pass
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert len(errors) == len(threads)
+        assert flights.stats()["in_flight"] == 0
+
+    def test_refresh_runs_in_background_and_is_shared(self):
+        flights = singleflight.SingleFlight()
+        release = threading.Event()
+
+        def fetch():
+            release.wait()
+            return "refreshed"
+
+        results = []
+        assert flights.refresh("key", fetch)
+        assert not flights.refresh("key", fetch)
+        thread = threading.Thread(
+            target=lambda: results.append(flights.do("key", lambda: "not shared"))
+        )
+        thread.start()
+        while flights.stats()["shared"] < 1:
+            pass
+        release.set()
+        thread.join()
+
+        assert results == ["refreshed"]
+        assert flights.stats()["refreshes"] == 1
+
+    def test_refresh_logs_exceptions(self, caplog):
+        flights = singleflight.SingleFlight()
+
+        def fetch():
+            raise ValueError("failed")
+
+        flights.refresh("key", fetch)
+        deadline = time.monotonic() + 5
+        while "refresh of 'key' failed" not in caplog.text:
+            assert time.monotonic() < deadline
+            time.sleep(0.001)
+
+        assert flights.do("key", lambda: "value") == "value"
+
+
+class TestAsyncSingleFlight:
+    """Tests for AsyncSingleFlight."""
+
+    def test_concurrent_calls_share_one_call(self):
+        flights = singleflight.AsyncSingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(None)
+            await asyncio.sleep(0.01)
+            return "value"
+
+        async def run():
+            return await asyncio.gather(*(flights.do("key", fetch) for _ in range(10)))
+
+        assert asyncio.run(run()) == ["value"] * 10
+        assert len(calls) == 1
+        assert flights.stats() == {
+            "calls": 1,
+            "shared": 9,
+            "refreshes": 0,
+            "in_flight": 0,
+        }
+
+    def test_exception_is_raised_in_all_callers(self):
+        flights = singleflight.AsyncSingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+
+        async def run():
+            return await asyncio.gather(
+                *(flights.do("key", fetch) for _ in range(3)), return_exceptions=True
+            )
+
+        results = asyncio.run(run())
+
+        assert all(isinstance(result, ValueError) for result in results)
+
+    def test_cancelled_waiter_does_not_cancel_call(self):
+        flights = singleflight.AsyncSingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            return "value"
+
+        async def run():
+            leader = asyncio.ensure_future(flights.do("key", fetch))
+            await asyncio.sleep(0)
+            waiter = asyncio.ensure_future(flights.do("key", fetch))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            return await leader
+
+        assert asyncio.run(run()) == "value"
+
+    def test_cancelled_leader_does_not_cancel_call(self):
+        flights = singleflight.AsyncSingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            return "value"
+
+        async def run():
+            leader = asyncio.ensure_future(flights.do("key", fetch))
+            await asyncio.sleep(0)
+            followers = [asyncio.ensure_future(flights.do("key", fetch))]
+            followers.append(asyncio.ensure_future(flights.do("key", fetch)))
+            await asyncio.sleep(0)
+            leader.cancel()
+            results = await asyncio.gather(*followers)
+            return leader.cancelled(), results
+
+        assert asyncio.run(run()) == (True, ["value", "value"])
+
+    @pytest.mark.filterwarnings("error")
+    def test_exception_of_cancelled_callers_is_retrieved(self):
+        flights = singleflight.AsyncSingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise ValueError("failed")
+
+        async def run():
+            caller = asyncio.ensure_future(flights.do("key", fetch))
+            await asyncio.sleep(0)
+            caller.cancel()
+            await asyncio.sleep(0.02)
+            return flights.stats()["in_flight"]
+
+        assert asyncio.run(run()) == 0
+
+    def test_refresh_runs_as_task_and_is_shared(self):
+        flights = singleflight.AsyncSingleFlight()
+        calls = []
+
+        async def fetch():
+            calls.append(None)
+            await asyncio.sleep(0.01)
+            return "refreshed"
+
+        async def run():
+            assert flights.refresh("key", fetch)
+            assert not flights.refresh("key", fetch)
+            return await flights.do("key", fetch)
+
+        assert asyncio.run(run()) == "refreshed"
+        assert len(calls) == 1
+
+    @pytest.mark.filterwarnings("error")
+    def test_refresh_discards_exceptions(self):
+        flights = singleflight.AsyncSingleFlight()
+
+        async def fetch():
+            raise ValueError("failed")
+
+        async def run():
+            flights.refresh("key", fetch)
+            await asyncio.sleep(0.01)
+            return flights.stats()["in_flight"]
+
+        assert asyncio.run(run()) == 0
@@ -0,0 +1,47 @@
+from unittest import mock
+
+import pytest
+import requests
+
+from labelbot import github_api
+from labelbot import transport
+
+
+@pytest.fixture(autouse=True)
+def reset_session():
+    transport.set_session(None)
+    yield
+    transport.set_session(None)
+
+
+def test_get_session_returns_shared_session():
+    assert transport.get_session() is transport.get_session()
+
+
+def test_session_applies_default_timeout(mocker):
+    request = mocker.patch.object(requests.Session, "request", autospec=True)
+    session = transport.Session(timeout=(1, 2))
+
+    session.get("https://api.github.com")
+
+    _, kwargs = request.call_args
+    assert kwargs["timeout"] == (1, 2)
+
+
+def test_session_keeps_explicit_timeout(mocker):
+    request = mocker.patch.object(requests.Session, "request", autospec=True)
+    session = transport.Session(timeout=(1, 2))
+
+    session.get("https://api.github.com", timeout=7)
+
+    _, kwargs = request.call_args
+    assert kwargs["timeout"] == 7
+
+
+def test_github_api_uses_injected_session():
+    session = mock.MagicMock(spec=requests.Session)
+    session.patch.return_value.status_code = 200
+    transport.set_session(session)
+
+    assert github_api.set_labels(["bug"], "owner", "repo", 1, "token")
+    session.patch.assert_called_once()
@@ -0,0 +1,171 @@
+import threading
+
+import pytest
+
+from labelbot import work_queue
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def event_queue(request, tmp_path):
+    if request.param == "memory":
+        yield work_queue.InMemoryQueue(max_depth=2)
+    else:
+        queue = work_queue.SQLiteQueue(str(tmp_path / "queue.db"), max_depth=2)
+        yield queue
+        queue.close()
+
+
+class TestQueues:
+    """Tests that apply to all queue backends."""
+
+    def test_returns_items_in_order(self, event_queue):
+        event_queue.put({"nr": 1})
+        event_queue.put({"nr": 2})
+
+        assert event_queue.get(timeout=0).payload == {"nr": 1}
+        assert event_queue.get(timeout=0).payload == {"nr": 2}
+
+    def test_get_times_out_on_empty_queue(self, event_queue):
+        assert event_queue.get(timeout=0.01) is None
+
+    def test_put_raises_when_full(self, event_queue):
+        event_queue.put({"nr": 1})
+        event_queue.put({"nr": 2})
+
+        with pytest.raises(work_queue.QueueFull):
+            event_queue.put({"nr": 3})
+
+
+def test_sqlite_queue_reprocesses_unacked_jobs(tmp_path):
+    path = str(tmp_path / "queue.db")
+    queue = work_queue.SQLiteQueue(path)
+    queue.put({"nr": 1})
+    queue.put({"nr": 2})
+    queue.ack(queue.get(timeout=0))
+    queue.get(timeout=0)  # claimed, but never acked
+    queue.close()
+
+    reopened = work_queue.SQLiteQueue(path)
+
+    assert reopened.get(timeout=0).payload == {"nr": 2}
+    reopened.close()
+
+
+def test_processor_drains_queue():
+    queue = work_queue.InMemoryQueue()
+    processed = []
+    lock = threading.Lock()
+
+    def process(payload):
+        with lock:
+            processed.append(payload["nr"])
+        return payload["nr"] != 3
+
+    for nr in range(5):
+        queue.put({"nr": nr})
+    processor = work_queue.QueueProcessor(queue, process, workers=2)
+
+    processor.start()
+    processor.stop(drain=True)
+
+    assert sorted(processed) == list(range(5))
+    stats = processor.stats()
+    assert stats["processed"] == 5
+    assert stats["failed"] == 1
+    assert stats["depth"] == 0
+
+
+class TestCoalescingQueue:
+    """Tests for the CoalescingQueue class."""
+
+    @staticmethod
+    def _event(issue_nr, body):
+        return {
+            "owner": "someone",
+            "repo": "best-repo",
+            "issue_nr": issue_nr,
+            "body": body,
+        }
+
+    def test_forwards_only_latest_item_per_issue(self):
+        queue = work_queue.InMemoryQueue()
+        coalescing_queue = work_queue.CoalescingQueue(queue, window=0.05)
+
+        coalescing_queue.put(self._event(1, "first"))
+        coalescing_queue.put(self._event(1, "second"))
+        coalescing_queue.put(self._event(2, "other issue"))
+        coalescing_queue.put(self._event(1, "third"))
+
+        first = coalescing_queue.get(timeout=1)
+        second = coalescing_queue.get(timeout=1)
+        assert [first.payload["body"], second.payload["body"]] == [
+            "third",
+            "other issue",
+        ]
+        assert coalescing_queue.get(timeout=0.1) is None
+        coalescing_queue.close()
+        assert coalescing_queue.stats() == {
+            "received": 4,
+            "merged": 2,
+            "cancelled": 0,
+            "forwarded": 2,
+            "dropped": 0,
+        }
+
+    def test_close_forwards_pending_items(self):
+        queue = work_queue.InMemoryQueue()
+        coalescing_queue = work_queue.CoalescingQueue(queue, window=60)
+
+        coalescing_queue.put(self._event(1, "body"))
+        coalescing_queue.close()
+
+        assert queue.depth() == 1
+
+    def test_put_raises_when_pending_and_queued_items_reach_max_depth(self):
+        queue = work_queue.InMemoryQueue(max_depth=2)
+        queue.put(self._event(1, "queued"))
+        coalescing_queue = work_queue.CoalescingQueue(queue, window=0.05)
+
+        coalescing_queue.put(self._event(2, "pending"))
+        # replacing a pending item does not add to the depth
+        coalescing_queue.put(self._event(2, "replaced"))
+        with pytest.raises(work_queue.QueueFull):
+            coalescing_queue.put(self._event(3, "rejected"))
+        coalescing_queue.close()
+
+        assert queue.depth() == 2
+        assert coalescing_queue.stats()["dropped"] == 0
+
+    def test_cancelled_item_is_not_forwarded(self):
+        queue = work_queue.InMemoryQueue()
+        coalescing_queue = work_queue.CoalescingQueue(queue, window=0.05)
+
+        coalescing_queue.put(self._event(1, "stale"))
+        assert coalescing_queue.cancel_pending(self._event(1, "latest"))
+        assert not coalescing_queue.replace_pending(self._event(1, "latest"))
+
+        assert coalescing_queue.get(timeout=0.2) is None
+        coalescing_queue.close()
+        assert coalescing_queue.stats()["cancelled"] == 1
+
+    def test_item_put_after_cancel_waits_for_its_own_window(self):
+        now = [0.0]
+        queue = work_queue.InMemoryQueue()
+        coalescing_queue = work_queue.CoalescingQueue(
+            queue, window=10, clock=lambda: now[0]
+        )
+
+        coalescing_queue.put(self._event(1, "cancelled"))
+        coalescing_queue.cancel_pending(self._event(1, "cancelled"))
+        now[0] = 5
+        coalescing_queue.put(self._event(1, "latest"))
+        now[0] = 10
+        with coalescing_queue._cond:
+            coalescing_queue._cond.notify()
+
+        assert coalescing_queue.get(timeout=0.1) is None
+        now[0] = 15
+        with coalescing_queue._cond:
+            coalescing_queue._cond.notify()
+        assert coalescing_queue.get(timeout=1).payload["body"] == "latest"
+        coalescing_queue.close()